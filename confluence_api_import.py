@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Confluence to Notion API Importer
+
+This script imports Confluence spaces into Notion through the REST APIs
+of both products, without driving a browser. The page tree of each space
+is crawled concurrently and recreated under a Notion parent page.
+Created pages are checkpointed so an interrupted import resumes where it
+stopped; a page whose body was only partly written is archived and created
+again.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import quote
+from dotenv import load_dotenv
+
+from list_confluence_spaces import create_session, ConfluenceError, RETRY_STATUSES
+from fixture_servers import fixture_key, save_fixture, RecordedConfluenceServer, FakeNotionServer
+
+# Shared notion-sync modules (rate limiting, storage format conversion, metrics)
+import notion_sync_path  # noqa: F401
+from src.notion.ratelimit import is_idempotent, shared_rate_limiter
+from src.confluence.storage import convert_storage
+from src.utils.metrics import shared_metrics
+
+# Load environment variables
+load_dotenv(dotenv_path=".env")
+
+DEFAULT_NOTION_API_URL = 'https://api.notion.com/v1'
+NOTION_VERSION = '2022-06-28'
+# Characters accepted in a single rich text object
+NOTION_TEXT_LIMIT = 2000
+# Page size for Confluence content listings
+PAGE_LIMIT = 50
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+DEFAULT_CHECKPOINT = 'confluence_import_checkpoint.jsonl'
+# Confluence fields requested with every page listing (bodies come with the listing)
+PAGE_EXPAND = 'body.storage'
+
+
+class ConfluenceClient:
+    """Pooled, retrying Confluence REST client that can record its responses"""
+
+    def __init__(self, base_url, api_token, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES,
+                 record_dir=None, metrics=None):
+        self.base_url = base_url.rstrip('/')
+        self.session = create_session(api_token, workers, shared_metrics())
+        self.retries = retries
+        self.record_dir = record_dir
+        self.metrics = metrics
+
+    def get(self, path, params):
+        """GET a JSON resource, retrying transient failures"""
+        import requests
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(f"{self.base_url}{path}", params=params, timeout=60)
+                if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                    retry_after = response.headers.get('Retry-After', '')
+                    shared_metrics().count('confluence', 'retries')
+                    time.sleep(float(retry_after) if retry_after.isdigit() else 2 ** attempt)
+                    continue
+                response.raise_for_status()
+                break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise ConfluenceError(f"{path}: {e}") from e
+                shared_metrics().count('confluence', 'retries')
+                time.sleep(2 ** attempt)
+            except requests.HTTPError as e:
+                raise ConfluenceError(f"{path}: {e}") from e
+
+        if self.metrics:
+            self.metrics.add(confluence_requests=1, confluence_bytes=len(response.content))
+        body = response.json()
+        if self.record_dir:
+            save_fixture(self.record_dir, fixture_key(path, params.items()), body)
+        return body
+
+    def iter_pages(self, path, **params):
+        """Yield every page of a paginated content listing"""
+        start = 0
+        while True:
+            data = self.get(path, dict(params, limit=PAGE_LIMIT, start=start, expand=PAGE_EXPAND))
+            results = data.get('results', [])
+            yield from results
+            if len(results) < PAGE_LIMIT or 'next' not in data.get('_links', {}):
+                return
+            start += len(results)
+
+    def root_pages(self, space_key):
+        return self.iter_pages(f"/rest/api/space/{space_key}/content/page", depth='root')
+
+    def child_pages(self, page_id):
+        return self.iter_pages(f"/rest/api/content/{page_id}/child/page")
+
+    def attachment_url(self, page_id, filename):
+        """Download URL of a page attachment, used for images and files in the body"""
+        return f"{self.base_url}/download/attachments/{page_id}/{quote(filename)}"
+
+    def close(self):
+        self.session.close()
+
+
+class NotionWriter:
+    """Creates Notion pages through the API, sharing the process-wide rate limiter"""
+
+    def __init__(self, token, api_url=DEFAULT_NOTION_API_URL, rate_limit=3.0, metrics=None):
+        self.api_url = api_url.rstrip('/')
+        self.headers = {
+            'Authorization': f'Bearer {token}',
+            'Notion-Version': NOTION_VERSION,
+            'Content-Type': 'application/json'
+        }
+        self.limiter = shared_rate_limiter(rate=rate_limit)
+        self.local = threading.local()
+        self.metrics = metrics
+        shared_metrics().track_rate_limiter('notion', self.limiter)
+
+    @property
+    def session(self):
+        import requests
+
+        if not hasattr(self.local, 'session'):
+            self.local.session = shared_metrics().instrument_session(requests.Session(), 'notion')
+        return self.local.session
+
+    def request(self, method, path, body):
+        # Page creates and block appends are not replayed after a timeout
+        response = self.limiter.call(
+            self.session.request, method, f"{self.api_url}{path}",
+            idempotent=is_idempotent(method, path),
+            json=body, headers=self.headers
+        )
+        if self.metrics:
+            self.metrics.add(notion_requests=1)
+        if response.status_code != 200:
+            raise Exception(f'Notion API error: {response.text}')
+        return response.json()
+
+    def create_page(self, parent_id, title, children):
+        """Create a child page with its first batch of blocks and return its id"""
+        page = self.request('POST', '/pages', {
+            'parent': {'page_id': parent_id},
+            'properties': {'title': {'title': [{'text': {'content': title[:NOTION_TEXT_LIMIT]}}]}},
+            'children': children,
+        })
+        return page['id']
+
+    def append_blocks(self, page_id, batches):
+        """Append batches of blocks as they are produced and return the block count
+
+        A long body is therefore never held in memory as a whole.
+        """
+        count = 0
+        for batch in batches:
+            self.request('PATCH', f"/blocks/{page_id}/children", {'children': batch})
+            count += len(batch)
+        return count
+
+    def archive_page(self, page_id):
+        self.request('PATCH', f"/pages/{page_id}", {'archived': True})
+
+
+class Checkpoint:
+    """Append-only record of Confluence page id -> created Notion page id
+
+    A page is recorded as soon as it exists in Notion and again, marked
+    complete, once its whole body has been appended. The last line for a
+    page wins; lines without 'complete' predate partial records and always
+    describe finished pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pages = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.pages[entry['confluence_id']] = (
+                            entry['notion_id'], entry.get('complete', True))
+        self.file = open(path, 'a')
+
+    def get(self, confluence_id):
+        """Return (notion_id, complete) for a recorded page, or None"""
+        return self.pages.get(confluence_id)
+
+    def record(self, confluence_id, notion_id, complete):
+        with self.lock:
+            self.pages[confluence_id] = (notion_id, complete)
+            self.file.write(json.dumps({'confluence_id': confluence_id, 'notion_id': notion_id,
+                                        'complete': complete}) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ImportMetrics:
+    """Thread-safe counters and throughput of an import run"""
+
+    FIELDS = ('pages', 'resumed', 'failed', 'blocks', 'confluence_requests',
+              'confluence_bytes', 'notion_requests')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def to_dict(self):
+        with self.lock:
+            counts = dict(self.counts)
+        elapsed = time.monotonic() - self.started
+        counts['elapsed_seconds'] = round(elapsed, 2)
+        counts['pages_per_second'] = round(counts['pages'] / elapsed, 2) if elapsed else 0.0
+        return counts
+
+    def summary(self):
+        m = self.to_dict()
+        return (f"{m['pages']} pages created, {m['resumed']} resumed, {m['failed']} failed "
+                f"in {m['elapsed_seconds']:.1f}s ({m['pages_per_second']:.2f} pages/s); "
+                f"{m['blocks']} blocks, {m['confluence_requests']} Confluence requests "
+                f"({m['confluence_bytes'] / 1024:.0f} KiB), {m['notion_requests']} Notion requests")
+
+
+class SpaceImporter:
+    """Recreates Confluence page trees under a Notion parent page
+
+    Each page is one task: create the Notion page (unless checkpointed),
+    then list its Confluence children and submit them with the new page
+    as parent. Sibling subtrees therefore proceed concurrently, bounded
+    by the worker pool and the Notion rate limiter.
+    """
+
+    def __init__(self, confluence, notion, checkpoint, metrics, workers=DEFAULT_WORKERS):
+        self.confluence = confluence
+        self.notion = notion
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = 0
+        self.idle = threading.Condition()
+        self.errors = []
+
+    def submit(self, func, *args):
+        with self.idle:
+            self.pending += 1
+        self.executor.submit(self._run, func, *args)
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            self.metrics.add(failed=1)
+            self.errors.append(str(e))
+            print(f"Error: {e}", file=sys.stderr)
+        finally:
+            with self.idle:
+                self.pending -= 1
+                self.idle.notify_all()
+
+    def import_space(self, space_key, parent_id):
+        """Queue the root pages of a space"""
+        for page in self.confluence.root_pages(space_key):
+            self.submit(self.import_page, page, parent_id)
+
+    def import_page(self, page, parent_id):
+        recorded = self.checkpoint.get(page['id'])
+        if recorded and recorded[1]:
+            notion_id = recorded[0]
+            self.metrics.add(resumed=1)
+        else:
+            if recorded:
+                # Which appends landed is unknown, so replace the partial page
+                self.notion.archive_page(recorded[0])
+            notion_id = self.create_page(page, parent_id)
+
+        for child in self.confluence.child_pages(page['id']):
+            self.submit(self.import_page, child, notion_id)
+
+    def create_page(self, page, parent_id):
+        """Create the Notion page for a Confluence page, checkpointing each step"""
+        storage = page.get('body', {}).get('storage', {}).get('value', '')
+        batches = convert_storage(
+            storage, attachment_url=partial(self.confluence.attachment_url, page['id']))
+        # Conversion is streamed into the requests, so this covers both
+        with shared_metrics().phase('notion.create_page'):
+            first = next(batches, [])
+            notion_id = self.notion.create_page(parent_id, page['title'], first)
+            self.checkpoint.record(page['id'], notion_id, complete=False)
+            blocks = len(first) + self.notion.append_blocks(notion_id, batches)
+        self.checkpoint.record(page['id'], notion_id, complete=True)
+        self.metrics.add(pages=1, blocks=blocks)
+        return notion_id
+
+    def run(self, space_keys, parent_id, progress_interval=10.0):
+        """Import the spaces and wait until every queued page is done"""
+        for space_key in space_keys:
+            self.submit(self.import_space, space_key, parent_id)
+        with self.idle:
+            while self.pending:
+                if not self.idle.wait(timeout=progress_interval):
+                    print(f"Progress: {self.metrics.summary()}", file=sys.stderr)
+        self.executor.shutdown()
+
+
+def write_metrics(metrics, path):
+    """Write the import counters together with the per-endpoint API metrics"""
+    api_metrics = shared_metrics()
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(dict(metrics.to_dict(), api=api_metrics.to_dict()), f, indent=2)
+        return
+    for name, value in metrics.to_dict().items():
+        api_metrics.set_value(name, value)
+    api_metrics.write(path)
+
+
+def main():
+    """Main function to run the API-based importer"""
+    parser = argparse.ArgumentParser(description='Import Confluence spaces to Notion through the REST APIs')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--spaces', help='Comma-separated list of Confluence space keys to import')
+    group.add_argument('--spaces-file', help='Path to file containing space keys, one per line')
+    parser.add_argument('--confluence-url', help='Confluence URL (overrides environment variable)')
+    parser.add_argument('--api-token', help='Confluence API token (overrides environment variable)')
+    parser.add_argument('--notion-parent', help='Notion page id to import under '
+                        '(overrides NOTION_IMPORT_PARENT_ID)')
+    parser.add_argument('--notion-api-url', help='Notion API base URL (overrides NOTION_API_URL, '
+                        f'default: {DEFAULT_NOTION_API_URL})')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Concurrent page tasks (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--checkpoint',
+                        help=f'Checkpoint file for resuming (default: {DEFAULT_CHECKPOINT}, '
+                             'or a temporary file with --fixtures)')
+    parser.add_argument('--metrics', help='Write final metrics, including per-endpoint request '
+                        'counts and latency histograms, to this file: JSON for .json, '
+                        'Prometheus text format otherwise')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--record', metavar='DIR', help='Record Confluence responses to DIR as fixtures')
+    mode.add_argument('--fixtures', metavar='DIR',
+                      help='Replay recorded Confluence fixtures from DIR against local stand-in '
+                           'Confluence and Notion servers (no credentials needed)')
+    args = parser.parse_args()
+
+    confluence_url = args.confluence_url or os.getenv('CONFLUENCE_URL')
+    api_token = args.api_token or os.getenv('CONFLUENCE_API_TOKEN')
+    notion_token = os.getenv('NOTION_TOKEN')
+    notion_api_url = args.notion_api_url or os.getenv('NOTION_API_URL') or DEFAULT_NOTION_API_URL
+    parent_id = args.notion_parent or os.getenv('NOTION_IMPORT_PARENT_ID')
+    rate_limit = float(os.getenv('NOTION_RATE_LIMIT', '3'))
+
+    if args.spaces:
+        space_keys = [space.strip() for space in args.spaces.split(',') if space.strip()]
+    else:
+        with open(args.spaces_file) as f:
+            space_keys = [line.strip() for line in f if line.strip()]
+
+    stand_ins = []
+    if args.fixtures:
+        confluence_server = RecordedConfluenceServer(args.fixtures).start()
+        notion_server = FakeNotionServer().start()
+        stand_ins = [confluence_server, notion_server]
+        confluence_url, api_token = confluence_server.url, 'fixture'
+        notion_api_url, notion_token = notion_server.api_url, 'fixture'
+        parent_id = parent_id or 'fixture-parent'
+        # The stand-in has no rate limit
+        rate_limit = 1000.0
+
+    if not confluence_url or not api_token:
+        print("Error: Confluence URL and API token are required. Set CONFLUENCE_URL and "
+              "CONFLUENCE_API_TOKEN or provide --confluence-url and --api-token.", file=sys.stderr)
+        return 1
+    if not notion_token or not parent_id:
+        print("Error: Set NOTION_TOKEN and NOTION_IMPORT_PARENT_ID (or --notion-parent).",
+              file=sys.stderr)
+        return 1
+
+    metrics = ImportMetrics()
+    confluence = ConfluenceClient(confluence_url, api_token, workers=args.workers,
+                                  record_dir=args.record, metrics=metrics)
+    notion = NotionWriter(notion_token, notion_api_url, rate_limit=rate_limit, metrics=metrics)
+    checkpoint_path = args.checkpoint or DEFAULT_CHECKPOINT
+    if args.fixtures and not args.checkpoint:
+        # Keep stand-in page ids out of the real checkpoint
+        checkpoint_path = os.path.join(tempfile.mkdtemp(), DEFAULT_CHECKPOINT)
+    checkpoint = Checkpoint(checkpoint_path)
+    try:
+        importer = SpaceImporter(confluence, notion, checkpoint, metrics, workers=args.workers)
+        importer.run(space_keys, parent_id)
+    finally:
+        checkpoint.close()
+        confluence.close()
+        for server in stand_ins:
+            server.stop()
+
+    print(metrics.summary())
+    if args.fixtures:
+        print(f"Stand-in Notion received {len(stand_ins[1].pages)} pages")
+    print(shared_metrics().summary())
+    if args.metrics:
+        write_metrics(metrics, args.metrics)
+    return 1 if importer.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
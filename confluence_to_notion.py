@@ -3,20 +3,42 @@
 Notion Confluence Space Bulk Importer
 
 This script automates importing multiple Confluence spaces to Notion
-by controlling the browser to perform the imports sequentially.
+by controlling the browser. Spaces are imported sequentially, or by
+several isolated browser contexts pulling from a shared queue when
+--parallel is given. --fake-notion runs the same flow against a local
+stand-in of the Notion import page, without credentials or network access.
 """
 import os
-import sys
+import json
 import time
 import argparse
 import asyncio
+import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+
+# Shared notion-sync modules (API metrics)
+import notion_sync_path  # noqa: F401
+from src.utils.metrics import endpoint_of, shared_metrics
 
 # Load environment variables
 load_dotenv(dotenv_path=".env")
 
+# Base URL of the Notion web app (overridable to point at a local fake import page)
+DEFAULT_NOTION_URL = 'https://www.notion.so'
+
+# Page indicators used to follow an import
+IMPORT_STARTED = 'text=Importing'
+IMPORT_COMPLETE = 'text=Import complete'
+IMPORT_FAILED = 'text=Import failed'
+
+# Seconds to follow one import before leaving it as 'running' in the journal
+DEFAULT_IMPORT_TIMEOUT = 600
+# Seconds between journal heartbeats while an import is being followed
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_JOURNAL = 'confluence_import_journal.json'
+
 async def send_slack_notification(webhook_url, message):
     """Send notification to Slack using webhook URL"""
     if not webhook_url:
@@ -31,9 +53,9 @@ async def send_slack_notification(webhook_url, message):
         print(f"Error sending Slack notification: {str(e)}")
         return False
 
-async def login_to_notion(page, email, password):
+async def login_to_notion(page, email, password, notion_url=DEFAULT_NOTION_URL):
     """Login to Notion"""
-    await page.goto('https://www.notion.so/login')
+    await page.goto(f'{notion_url}/login')
     await page.fill('input[name="email"]', email)
     await page.fill('input[name="password"]', password)
     await page.click('button[type="submit"]')
@@ -42,7 +64,7 @@ async def login_to_notion(page, email, password):
     await page.wait_for_load_state('networkidle')
     
     # Check if login was successful
-    if page.url.startswith('https://www.notion.so/login'):
+    if page.url.startswith(f'{notion_url}/login'):
         error_message = await page.inner_text('.notion-login-error')
         if error_message:
             raise Exception(f"Login failed: {error_message}")
@@ -50,10 +72,10 @@ async def login_to_notion(page, email, password):
     
     print("Successfully logged in to Notion")
 
-async def import_confluence_space(page, confluence_url, space_key):
-    """Import a single Confluence space to Notion"""
+async def start_confluence_import(page, confluence_url, space_key, notion_url=DEFAULT_NOTION_URL):
+    """Fill in the Confluence import form for one space and wait until the import starts"""
     # Navigate to Notion import page
-    await page.goto('https://www.notion.so/import')
+    await page.goto(f'{notion_url}/import')
     
     # Click on Confluence import option
     await page.click('text=Confluence')
@@ -70,11 +92,9 @@ async def import_confluence_space(page, confluence_url, space_key):
     # Wait for space selection page
     await page.wait_for_selector('input[placeholder="Search for a space"]')
     
-    # Search for the specific space
+    # Search for the specific space and select it as soon as it is listed
     await page.fill('input[placeholder="Search for a space"]', space_key)
-    await page.wait_for_timeout(1000)  # Wait for search results
-    
-    # Select the space (first result)
+    await page.wait_for_selector('text=' + space_key)
     await page.click('text=' + space_key)
     
     # Click Import button
@@ -82,17 +102,206 @@ async def import_confluence_space(page, confluence_url, space_key):
     await import_button.click()
     
     # Wait for import to start
-    await page.wait_for_selector('text=Importing')
+    await page.wait_for_selector(IMPORT_STARTED)
+
+async def wait_for_import_result(page, timeout, poll_interval=DEFAULT_POLL_INTERVAL, on_poll=None):
+    """Wait until the page shows the import as complete or failed
+
+    Returns 'done', 'failed', or 'running' if neither appeared within
+    `timeout` seconds. The wait resolves as soon as either indicator is
+    rendered; every `poll_interval` seconds `on_poll` is called so the
+    caller can record that the import is still being followed.
+    """
+    outcome = page.locator(IMPORT_COMPLETE).or_(page.locator(IMPORT_FAILED)).first
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return 'running'
+        try:
+            await outcome.wait_for(state='visible', timeout=min(poll_interval, remaining) * 1000)
+            break
+        except PlaywrightTimeoutError:
+            if on_poll:
+                on_poll()
     
-    # Wait for import to complete (this might take a while)
-    # We'll look for a success message or completion indicator
-    try:
-        await page.wait_for_selector('text=Import complete', timeout=600000)  # 10 minute timeout
+    if await page.locator(IMPORT_COMPLETE).count():
+        return 'done'
+    return 'failed'
+
+async def import_confluence_space(page, confluence_url, space_key, notion_url=DEFAULT_NOTION_URL,
+                                  timeout=DEFAULT_IMPORT_TIMEOUT):
+    """Import a single Confluence space to Notion"""
+    await start_confluence_import(page, confluence_url, space_key, notion_url)
+    result = await wait_for_import_result(page, timeout)
+    if result == 'done':
         print(f"Successfully imported Confluence space: {space_key}")
-        return True
-    except Exception as e:
-        print(f"Import may still be in progress for space {space_key}: {str(e)}")
-        return False
+    else:
+        print(f"Import may still be in progress for space {space_key}: {result}")
+    return result == 'done'
+
+class ImportJournal:
+    """Persistent state of each space import (pending/running/done/failed)
+
+    Entries are kept per Confluence URL and written atomically after every
+    change, so an interrupted run can be resumed: completed spaces are
+    skipped and spaces left 'running' are rechecked on the page their
+    import was started from.
+    """
+
+    def __init__(self, path, confluence_url):
+        self.path = path
+        self.confluence_url = confluence_url
+        try:
+            with open(path, 'r') as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = {}
+        self.spaces = self.data.setdefault(confluence_url, {})
+
+    def get(self, space_key):
+        """Return a copy of the entry, so later updates do not change it"""
+        return dict(self.spaces.get(space_key) or {'state': 'pending', 'attempts': 0})
+
+    def state(self, space_key):
+        return self.get(space_key)['state']
+
+    def update(self, space_key, **fields):
+        entry = self.spaces.setdefault(space_key, {'state': 'pending', 'attempts': 0})
+        entry.update(fields, updated_at=datetime.now().isoformat(timespec='seconds'))
+        self.save()
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def format_duration(seconds):
+    """Format a duration as e.g. 1h 02m 03s"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02d}s"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+def track_api_responses(context, notion_url):
+    """Record the Notion web app's own API calls made in a browser context
+
+    Only /api/ requests to the Notion web app are recorded, with the time
+    to the first response byte as latency. Static assets are ignored.
+    """
+    api_prefix = f"{notion_url}/api/"
+    metrics = shared_metrics()
+
+    def on_response(response):
+        if not response.url.startswith(api_prefix):
+            return
+        seconds = max(response.request.timing.get('responseStart', 0), 0) / 1000
+        metrics.observe_request('notion-web', endpoint_of(response.request.method, response.url),
+                                response.status, seconds)
+
+    context.on('response', on_response)
+
+async def import_worker(worker_id, context, queue, results, journal, confluence_url, notion_url,
+                        delay, timeout, poll_interval):
+    """Import spaces from the shared queue in one browser context until it is empty"""
+    page = await context.new_page()
+    try:
+        while True:
+            try:
+                space_key = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            
+            # State left by earlier runs, read before this attempt marks it running
+            prior = journal.get(space_key)
+            started = time.monotonic()
+            error = None
+            journal.update(space_key, state='running', attempts=prior['attempts'] + 1)
+            metrics = shared_metrics()
+            try:
+                if prior['state'] == 'running' and prior.get('url'):
+                    # A previous run lost track of this import: look at it again
+                    print(f"[worker {worker_id}] Rechecking import of space: {space_key}")
+                    await page.goto(prior['url'])
+                else:
+                    print(f"[worker {worker_id}] Importing Confluence space: {space_key}")
+                    with metrics.phase('import.start'):
+                        await start_confluence_import(page, confluence_url, space_key, notion_url)
+                    journal.update(space_key, url=page.url)
+                with metrics.phase('import.wait'):
+                    state = await wait_for_import_result(
+                        page, timeout, poll_interval,
+                        on_poll=lambda: journal.update(space_key, state='running'))
+            except Exception as e:
+                state = 'failed'
+                error = str(e)
+                print(f"[worker {worker_id}] Error importing space {space_key}: {error}")
+            
+            seconds = time.monotonic() - started
+            metrics.count('notion-web', f'import_{state}')
+            journal.update(space_key, state=state, seconds=round(seconds, 1), error=error)
+            results.append({
+                'space_key': space_key,
+                'state': state,
+                'success': state == 'done',
+                'seconds': seconds,
+                'worker': worker_id,
+                'error': error,
+            })
+            queue.task_done()
+            
+            # Optional pause between imports
+            if delay and not queue.empty():
+                await page.wait_for_timeout(delay * 1000)
+    finally:
+        await page.close()
+
+async def run_imports(browser, space_keys, storage_state, confluence_url, notion_url, journal,
+                      parallel=1, delay=0, timeout=DEFAULT_IMPORT_TIMEOUT,
+                      poll_interval=DEFAULT_POLL_INTERVAL):
+    """Import spaces with up to `parallel` isolated contexts sharing one work queue
+
+    Every context starts from the logged-in storage state, so Notion is
+    only logged into once. Spaces the journal records as done are skipped,
+    and spaces left running by an earlier run are rechecked first.
+    Results keep the original order of space_keys.
+    """
+    pending = [key for key in space_keys if journal.state(key) != 'done']
+    pending.sort(key=lambda key: journal.state(key) != 'running')
+    queue = asyncio.Queue()
+    for space_key in pending:
+        queue.put_nowait(space_key)
+    
+    results = []
+    contexts = [await browser.new_context(storage_state=storage_state)
+                for _ in range(min(parallel, len(pending)))]
+    for context in contexts:
+        track_api_responses(context, notion_url)
+    try:
+        await asyncio.gather(*(
+            import_worker(worker_id, context, queue, results, journal, confluence_url,
+                          notion_url, delay, timeout, poll_interval)
+            for worker_id, context in enumerate(contexts, 1)
+        ))
+    finally:
+        for context in contexts:
+            await context.close()
+    
+    order = {space_key: index for index, space_key in enumerate(space_keys)}
+    return sorted(results, key=lambda result: order[result['space_key']])
+
+def write_metrics(path):
+    """Write the collected request and phase metrics"""
+    metrics = shared_metrics()
+    print(metrics.summary())
+    try:
+        metrics.write(path)
+    except OSError as e:
+        print(f"Error writing metrics file: {str(e)}")
 
 def read_spaces_from_file(file_path):
     """Read space keys from a file, one per line"""
@@ -114,6 +323,28 @@ async def main():
     parser.add_argument('--notion-password', help='Notion password (overrides environment variable)')
     parser.add_argument('--headless', action='store_true', help='Run browser in headless mode')
     parser.add_argument('--limit', type=int, help='Limit the number of spaces to import')
+    parser.add_argument('--parallel', type=int, default=1,
+                        help='Number of browser contexts importing concurrently (default: 1)')
+    parser.add_argument('--delay', type=float, default=0,
+                        help='Seconds to wait between imports in each context (default: 0)')
+    parser.add_argument('--import-timeout', type=float, default=DEFAULT_IMPORT_TIMEOUT,
+                        help='Seconds to follow each import before leaving it as running '
+                             f'(default: {DEFAULT_IMPORT_TIMEOUT})')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds between progress checks of a running import '
+                             f'(default: {DEFAULT_POLL_INTERVAL})')
+    parser.add_argument('--journal',
+                        help=f'Path of the resumable import journal (default: {DEFAULT_JOURNAL}, '
+                             'or a temporary file with --fake-notion)')
+    notion = parser.add_mutually_exclusive_group()
+    notion.add_argument('--notion-url', help='Notion web app URL (overrides NOTION_URL, '
+                        f'default: {DEFAULT_NOTION_URL})')
+    notion.add_argument('--fake-notion', type=float, nargs='?', const=2.0, metavar='SECONDS',
+                        help='Import against a local stand-in Notion import page whose imports '
+                             'finish after SECONDS (default: 2); no credentials needed')
+    parser.add_argument('--metrics-file', default=os.getenv('SYNC_METRICS_FILE'),
+                        help='Write request and phase metrics to this file: JSON for .json, '
+                             'Prometheus text format otherwise (default: SYNC_METRICS_FILE)')
     args = parser.parse_args()
     
     # Get credentials from environment variables or command line arguments
@@ -121,6 +352,20 @@ async def main():
     notion_password = args.notion_password or os.getenv('NOTION_PASSWORD')
     confluence_url = args.confluence_url or os.getenv('CONFLUENCE_URL')
     slack_webhook_url = os.getenv('SLACK_WEBHOOK_URL')
+    notion_url = (args.notion_url or os.getenv('NOTION_URL') or DEFAULT_NOTION_URL).rstrip('/')
+    journal_path = args.journal or DEFAULT_JOURNAL
+    
+    stand_in = None
+    if args.fake_notion is not None:
+        from fixture_servers import FakeNotionWebServer
+
+        stand_in = FakeNotionWebServer(import_seconds=args.fake_notion).start()
+        notion_url = stand_in.url
+        notion_email, notion_password = 'fixture@example.com', 'fixture'
+        confluence_url = confluence_url or 'https://confluence.example.com'
+        if not args.journal:
+            # Keep stand-in imports out of the real journal
+            journal_path = os.path.join(tempfile.mkdtemp(), DEFAULT_JOURNAL)
     
     if not notion_email or not notion_password:
         print("Error: Notion credentials not provided. Set NOTION_EMAIL and NOTION_PASSWORD "
@@ -151,33 +396,52 @@ async def main():
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     start_message = (f"*Starting Confluence to Notion Import* ({current_time})\n"
                      f"Confluence URL: {confluence_url}\n"
-                     f"Spaces to import: {', '.join(space_keys)}")
+                     f"Spaces to import: {', '.join(space_keys)}\n"
+                     f"Parallel contexts: {max(args.parallel, 1)}")
     await send_slack_notification(slack_webhook_url, start_message)
     
     # Start browser automation
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=args.headless)
-        page = await browser.new_page()
         
         try:
-            # Login to Notion
-            await login_to_notion(page, notion_email, notion_password)
+            # Login to Notion once and share the session with every context
+            login_context = await browser.new_context()
+            page = await login_context.new_page()
+            with shared_metrics().phase('notion.login'):
+                await login_to_notion(page, notion_email, notion_password, notion_url)
+            storage_state = await login_context.storage_state()
+            await login_context.close()
             
-            # Import each space
-            results = []
-            for space_key in space_keys:
-                print(f"Importing Confluence space: {space_key}")
-                success = await import_confluence_space(page, confluence_url, space_key)
-                results.append((space_key, success))
-                
-                # Small delay between imports
-                await page.wait_for_timeout(5000)
+            # Import the spaces
+            journal = ImportJournal(journal_path, confluence_url)
+            skipped = [key for key in space_keys if journal.state(key) == 'done']
+            if skipped:
+                print(f"Skipping {len(skipped)} spaces already imported according to {journal_path}")
+            started = time.monotonic()
+            results = await run_imports(browser, space_keys, storage_state, confluence_url,
+                                        notion_url, journal, parallel=max(args.parallel, 1),
+                                        delay=args.delay, timeout=args.import_timeout,
+                                        poll_interval=args.poll_interval)
+            elapsed = time.monotonic() - started
             
             # Send completion notification
-            completion_message = f"*Confluence to Notion Import Results* ({current_time})\n"
-            for space_key, success in results:
-                status = "✅ Complete" if success else "⚠️ In Progress/Failed"
-                completion_message += f"• {space_key}: {status}\n"
+            succeeded = sum(1 for result in results if result['success'])
+            completion_message = (f"*Confluence to Notion Import Results* ({current_time})\n"
+                                  f"{succeeded}/{len(results)} complete in "
+                                  f"{format_duration(elapsed)}\n")
+            if skipped:
+                completion_message += f"{len(skipped)} spaces already imported, skipped\n"
+            for result in results:
+                status = {
+                    'done': "✅ Complete",
+                    'running': "⚠️ In Progress",
+                }.get(result['state'], "❌ Failed")
+                completion_message += (f"• {result['space_key']}: {status} "
+                                       f"({format_duration(result['seconds'])}, "
+                                       f"worker {result['worker']})\n")
+                if result['error']:
+                    completion_message += f"    {result['error']}\n"
             
             await send_slack_notification(slack_webhook_url, completion_message)
             
@@ -187,6 +451,10 @@ async def main():
             await send_slack_notification(slack_webhook_url, f"⚠️ {error_message}")
         finally:
             await browser.close()
+            if stand_in:
+                stand_in.stop()
+            if args.metrics_file:
+                write_metrics(args.metrics_file)
     
     return 0
 
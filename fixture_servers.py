@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Local stand-in HTTP servers
+
+RecordedConfluenceServer replays Confluence REST responses recorded by
+confluence_api_import.py --record, and FakeNotionServer accepts the
+Notion API calls the importer makes and keeps the created pages in
+memory. FakeNotionWebServer serves the login and Confluence import pages
+that confluence_to_notion.py drives in the browser, with imports that
+finish after a fixed time. All listen on 127.0.0.1 on a free port and run
+in a background thread, so imports can be exercised without network access.
+"""
+import os
+import json
+import uuid
+import hashlib
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+
+def fixture_key(path, params):
+    """Canonical request key shared by the recorder and the replay server"""
+    query = urlencode(sorted((str(k), str(v)) for k, v in params))
+    return f"{path}?{query}"
+
+
+def fixture_filename(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.json'
+
+
+def save_fixture(directory, key, body):
+    """Store one recorded response"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, fixture_filename(key)), 'w') as f:
+        json.dump({'request': key, 'response': body}, f)
+
+
+class _StandInServer:
+    """Threaded HTTP server bound to a free local port"""
+
+    def __init__(self, handler_class):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.httpd.stand_in = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+
+class _ConfluenceHandler(_JSONHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        key = fixture_key(parts.path, parse_qsl(parts.query, keep_blank_values=True))
+        body = self.server.stand_in.fixtures.get(key)
+        if body is None:
+            self.send_json(404, {'message': f'no fixture recorded for {key}'})
+        else:
+            self.send_json(200, body)
+
+
+class RecordedConfluenceServer(_StandInServer):
+    """Replays recorded Confluence REST responses from a fixture directory"""
+
+    def __init__(self, directory):
+        self.fixtures = {}
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name)) as f:
+                    fixture = json.load(f)
+                self.fixtures[fixture['request']] = fixture['response']
+        super().__init__(_ConfluenceHandler)
+
+
+class _NotionHandler(_JSONHandler):
+    def do_POST(self):
+        server = self.server.stand_in
+        if self.path.rstrip('/').endswith('/pages'):
+            body = self.read_json()
+            page_id = server.create_page(body.get('parent', {}), body.get('properties', {}),
+                                         body.get('children', []))
+            self.send_json(200, {'object': 'page', 'id': page_id})
+        else:
+            self.send_json(404, {'object': 'error', 'code': 'invalid_request_url'})
+
+    def do_PATCH(self):
+        server = self.server.stand_in
+        parts = self.path.rstrip('/').split('/')
+        if len(parts) >= 2 and parts[-1] == 'children':
+            children = self.read_json().get('children', [])
+            results = server.append_blocks(parts[-2], children)
+            if results is None:
+                self.send_json(404, {'object': 'error', 'code': 'object_not_found'})
+            else:
+                self.send_json(200, {'object': 'list', 'results': results})
+        elif len(parts) >= 2 and parts[-2] == 'pages':
+            if not self.read_json().get('archived'):
+                self.send_json(400, {'object': 'error', 'code': 'validation_error'})
+            elif server.archive_page(parts[-1]):
+                self.send_json(200, {'object': 'page', 'id': parts[-1], 'archived': True})
+            else:
+                self.send_json(404, {'object': 'error', 'code': 'object_not_found'})
+        else:
+            self.send_json(404, {'object': 'error', 'code': 'invalid_request_url'})
+
+
+class FakeNotionServer(_StandInServer):
+    """In-memory stand-in for the page creation and archiving endpoints of the Notion API"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # page id -> {'parent': ..., 'title': ..., 'blocks': [...]}
+        self.pages = {}
+        super().__init__(_NotionHandler)
+
+    @property
+    def api_url(self):
+        return f"{self.url}/v1"
+
+    def create_page(self, parent, properties, children):
+        title = ''.join(
+            item.get('text', {}).get('content', '')
+            for item in properties.get('title', {}).get('title', [])
+        )
+        page_id = str(uuid.uuid4())
+        with self.lock:
+            self.pages[page_id] = {
+                'parent': parent.get('page_id') or parent.get('database_id'),
+                'title': title,
+                'blocks': list(children),
+            }
+        return page_id
+
+    def append_blocks(self, block_id, children):
+        with self.lock:
+            page = self.pages.get(block_id)
+            if page is None:
+                return None
+            page['blocks'].extend(children)
+        return [{'object': 'block', 'id': str(uuid.uuid4())} for _ in children]
+
+    def archive_page(self, page_id):
+        """Drop an archived page; returns False if it does not exist"""
+        with self.lock:
+            return self.pages.pop(page_id, None) is not None
+
+
+# Pages of the stand-in Notion web app. They use the same labels and
+# placeholders as the real import flow so the browser automation runs unchanged.
+LOGIN_PAGE = """<!doctype html>
+<title>Log in</title>
+<form method="post" action="/login">
+  <input name="email" type="email"><input name="password" type="password">
+  <button type="submit">Log in</button>
+</form>
+"""
+
+IMPORT_PAGE = """<!doctype html>
+<title>Import</title>
+<section id="source"><button id="confluence">Confluence</button></section>
+<section id="site" hidden>
+  <input id="url" placeholder="https://company.atlassian.net">
+  <button id="continue">Continue</button>
+</section>
+<section id="spaces" hidden>
+  <input id="search" placeholder="Search for a space">
+  <ul id="results"></ul>
+  <button id="start" hidden>Import</button>
+</section>
+<script>
+  const show = id => document.getElementById(id).hidden = false;
+  let space = null;
+  document.getElementById('confluence').onclick = () => show('site');
+  document.getElementById('continue').onclick = () => show('spaces');
+  document.getElementById('search').oninput = event => {
+    const results = document.getElementById('results');
+    results.replaceChildren();
+    const key = event.target.value.trim();
+    if (!key) return;
+    const item = document.createElement('li');
+    item.textContent = key;
+    item.onclick = () => { space = key; show('start'); };
+    results.append(item);
+  };
+  document.getElementById('start').onclick = async () => {
+    const response = await fetch('/api/v3/enqueueTask', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({space: space, url: document.getElementById('url').value}),
+    });
+    location.href = '/import/' + (await response.json()).taskId;
+  };
+</script>
+"""
+
+TASK_PAGE = """<!doctype html>
+<title>Import</title>
+<p id="status">Importing</p>
+<script>
+  const poll = async () => {
+    const response = await fetch('/api/v3/getTasks?id=' + location.pathname.split('/').pop());
+    const task = await response.json();
+    if (task.state === 'success') {
+      document.getElementById('status').textContent = 'Import complete';
+    } else if (task.state === 'failure') {
+      document.getElementById('status').textContent = 'Import failed';
+    } else {
+      setTimeout(poll, 250);
+    }
+  };
+  poll();
+</script>
+"""
+
+SESSION_COOKIE = 'token_v2'
+
+
+class _NotionWebHandler(_JSONHandler):
+    def send_html(self, body):
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def redirect(self, location, cookie=None):
+        self.send_response(302)
+        self.send_header('Location', location)
+        if cookie:
+            self.send_header('Set-Cookie', f"{cookie}; Path=/; HttpOnly")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def logged_in(self):
+        return f"{SESSION_COOKIE}=" in (self.headers.get('Cookie') or '')
+
+    def do_GET(self):
+        server = self.server.stand_in
+        parts = urlsplit(self.path)
+        if parts.path == '/login':
+            self.send_html(LOGIN_PAGE)
+        elif not self.logged_in():
+            if parts.path.startswith('/api/'):
+                self.send_json(401, {'name': 'UnauthorizedError'})
+            else:
+                self.redirect('/login')
+        elif parts.path == '/api/v3/getTasks':
+            task_id = dict(parse_qsl(parts.query)).get('id', '')
+            self.send_json(200, {'id': task_id, 'state': server.task_state(task_id)})
+        elif parts.path in ('/', '/import') or parts.path.startswith('/import/'):
+            self.send_html(TASK_PAGE if parts.path.startswith('/import/') else IMPORT_PAGE)
+        else:
+            self.send_json(404, {'name': 'NotFoundError'})
+
+    def do_POST(self):
+        server = self.server.stand_in
+        if self.path == '/login':
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self.redirect('/', cookie=f"{SESSION_COOKIE}={uuid.uuid4().hex}")
+        elif not self.logged_in():
+            self.send_json(401, {'name': 'UnauthorizedError'})
+        elif self.path == '/api/v3/enqueueTask':
+            body = self.read_json()
+            self.send_json(200, {'taskId': server.start_import(body.get('space', ''))})
+        else:
+            self.send_json(404, {'name': 'NotFoundError'})
+
+
+class FakeNotionWebServer(_StandInServer):
+    """Stand-in for the Notion web app's login and Confluence import pages
+
+    Every import succeeds `import_seconds` after it was started, except
+    for spaces listed in `failing_spaces`, which fail after the same time.
+    """
+
+    def __init__(self, import_seconds=2.0, failing_spaces=()):
+        self.import_seconds = import_seconds
+        self.failing_spaces = set(failing_spaces)
+        self.lock = threading.Lock()
+        # task id -> (space key, start time)
+        self.tasks = {}
+        super().__init__(_NotionWebHandler)
+
+    def start_import(self, space_key):
+        task_id = str(uuid.uuid4())
+        with self.lock:
+            self.tasks[task_id] = (space_key, time.monotonic())
+        return task_id
+
+    def task_state(self, task_id):
+        """'running', 'success' or 'failure' (unknown tasks fail)"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+        if task is None:
+            return 'failure'
+        space_key, started = task
+        if time.monotonic() - started < self.import_seconds:
+            return 'running'
+        return 'failure' if space_key in self.failing_spaces else 'success'
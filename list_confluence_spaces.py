@@ -7,62 +7,158 @@ and outputs their keys to a file or stdout.
 """
 import os
 import sys
+import time
 import argparse
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv(dotenv_path=".env")
 
-def get_confluence_spaces(confluence_url, api_token):
-    """Retrieve all spaces from Confluence using the API"""
+# Page size requested from /rest/api/space (the API caps it at 100)
+PAGE_LIMIT = 100
+# Number of pages fetched concurrently
+DEFAULT_WORKERS = 4
+# Attempts per page before giving up
+DEFAULT_RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ConfluenceError(Exception):
+    """Raised when a page of spaces cannot be retrieved"""
+
+
+def build_api_url(confluence_url):
+    """Return the space endpoint for a Confluence base URL"""
+    return f"{confluence_url.rstrip('/')}/rest/api/space"
+
+
+def load_metrics():
+    """Return the process-wide API metrics shared with notion-sync"""
+    import notion_sync_path  # noqa: F401
+    from src.utils.metrics import shared_metrics
+
+    return shared_metrics()
+
+
+def create_session(api_token, workers=DEFAULT_WORKERS, metrics=None):
+    """Create a pooled session shared by all page fetches
+
+    With `metrics`, every response is recorded per endpoint.
+    """
     import requests
+    from requests.adapters import HTTPAdapter
     from requests.auth import HTTPBasicAuth
-    
-    # Prepare API endpoint URL
-    if confluence_url.endswith('/'):
-        api_url = f"{confluence_url}rest/api/space"
-    else:
-        api_url = f"{confluence_url}/rest/api/space"
-    
-    # Set up parameters for pagination
-    params = {
-        'limit': 100,
-        'start': 0,
-        'status': 'current'
-    }
-    
-    # Set up authentication
-    auth = HTTPBasicAuth('', api_token)  # Username is ignored when using API token
-    
-    # Initialize results
-    all_spaces = []
-    
-    # Fetch all spaces with pagination
-    while True:
+
+    session = requests.Session()
+    session.auth = HTTPBasicAuth('', api_token)  # Username is ignored when using API token
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if metrics is not None:
+        metrics.instrument_session(session, 'confluence')
+    return session
+
+
+def fetch_space_page(session, api_url, start, limit=PAGE_LIMIT, retries=DEFAULT_RETRIES,
+                     metrics=None):
+    """Fetch one page of spaces, retrying this page only on transient errors"""
+    import requests
+
+    params = {'limit': limit, 'start': start, 'status': 'current'}
+    for attempt in range(retries + 1):
         try:
-            response = requests.get(api_url, params=params, auth=auth)
+            response = session.get(api_url, params=params, timeout=30)
+            if response.status_code in RETRY_STATUSES and attempt < retries:
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else 2 ** attempt
+                if metrics is not None:
+                    metrics.count('confluence', 'retries')
+                time.sleep(delay)
+                continue
             response.raise_for_status()
-            
-            data = response.json()
-            spaces = data.get('results', [])
-            
-            if not spaces:
-                break
-                
-            all_spaces.extend(spaces)
-            
-            # Check if there are more spaces to fetch
-            if len(spaces) < params['limit']:
+            return response.json().get('results', [])
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise ConfluenceError(f"spaces at offset {start}: {e}") from e
+            if metrics is not None:
+                metrics.count('confluence', 'retries')
+            time.sleep(2 ** attempt)
+        except requests.HTTPError as e:
+            raise ConfluenceError(f"spaces at offset {start}: {e}") from e
+    raise ConfluenceError(f"spaces at offset {start}: retries exhausted")
+
+
+def iter_confluence_spaces(confluence_url, api_token, workers=DEFAULT_WORKERS,
+                           limit=PAGE_LIMIT, retries=DEFAULT_RETRIES, metrics=None):
+    """Yield spaces page by page, in API order, as soon as each page arrives
+
+    The endpoint does not report a total, so up to `workers` offsets are
+    fetched speculatively ahead of the page being consumed. Enumeration
+    stops at the first short page; requests beyond it are discarded.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    api_url = build_api_url(confluence_url)
+    session = create_session(api_token, workers, metrics)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = {}
+    next_start = 0
+    try:
+        while True:
+            while len(pending) < workers:
+                pending[next_start] = executor.submit(
+                    fetch_space_page, session, api_url, next_start, limit, retries, metrics)
+                next_start += limit
+
+            start = min(pending)
+            spaces = pending.pop(start).result()
+            yield from spaces
+            if len(spaces) < limit:
                 break
-                
-            # Update start parameter for next page
-            params['start'] += params['limit']
-            
-        except Exception as e:
-            print(f"Error retrieving Confluence spaces: {str(e)}", file=sys.stderr)
-            sys.exit(1)
-    
-    return all_spaces
+    finally:
+        for future in pending.values():
+            future.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
+        session.close()
+
+
+def get_confluence_spaces(confluence_url, api_token):
+    """Retrieve all spaces from Confluence using the API"""
+    return list(iter_confluence_spaces(confluence_url, api_token))
+
+
+def write_spaces(spaces, output, output_format):
+    """Write spaces to output as they arrive and return the count"""
+    import json
+
+    count = 0
+    if output_format == 'full':
+        output.write('[')
+    for space in spaces:
+        if output_format == 'keys':
+            output.write(f"{space['key']}\n")
+        elif output_format == 'ndjson':
+            output.write(json.dumps(space) + '\n')
+        else:
+            output.write(',\n' if count else '\n')
+            output.write(json.dumps(space, indent=2))
+        count += 1
+        # Let downstream consumers start before enumeration finishes
+        if output_format != 'full':
+            output.flush()
+    if output_format == 'full':
+        output.write('\n]\n')
+    return count
+
+
+def write_metrics(metrics, path):
+    """Write the collected metrics and print a one-line summary"""
+    print(metrics.summary(), file=sys.stderr)
+    try:
+        metrics.write(path)
+    except OSError as e:
+        print(f"Error writing metrics file: {str(e)}", file=sys.stderr)
+
 
 def main():
     """Main function to run the Confluence space list generator"""
@@ -70,8 +166,16 @@ def main():
     parser.add_argument('--confluence-url', help='Confluence URL (overrides environment variable)')
     parser.add_argument('--api-token', help='Confluence API token (overrides environment variable)')
     parser.add_argument('--output', help='Output file path (default: stdout)')
-    parser.add_argument('--format', choices=['keys', 'full'], default='keys',
-                        help='Output format: keys (default) or full JSON')
+    parser.add_argument('--format', choices=['keys', 'ndjson', 'full'], default='keys',
+                        help='Output format: keys (default), ndjson (one JSON object per line) '
+                             'or full JSON')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Pages fetched concurrently (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f'Retries per page on transient errors (default: {DEFAULT_RETRIES})')
+    parser.add_argument('--metrics-file', default=os.getenv('SYNC_METRICS_FILE'),
+                        help='Write per-endpoint request metrics to this file: JSON for .json, '
+                             'Prometheus text format otherwise (default: SYNC_METRICS_FILE)')
     args = parser.parse_args()
     
     # Get credentials from environment variables or command line arguments
@@ -88,27 +192,31 @@ def main():
               "or provide --api-token argument.", file=sys.stderr)
         return 1
     
-    # Get spaces from Confluence
-    spaces = get_confluence_spaces(confluence_url, api_token)
-    
-    # Prepare output
-    if args.format == 'keys':
-        output = '\n'.join([space['key'] for space in spaces])
-    else:
-        import json
-        output = json.dumps(spaces, indent=2)
-    
-    # Write output to file or stdout
-    if args.output:
-        try:
+    metrics = load_metrics() if args.metrics_file else None
+
+    # Stream spaces from Confluence to file or stdout
+    spaces = iter_confluence_spaces(confluence_url, api_token,
+                                    workers=args.workers, retries=args.retries, metrics=metrics)
+    started = time.perf_counter()
+    try:
+        if args.output:
             with open(args.output, 'w') as f:
-                f.write(output)
-            print(f"Wrote {len(spaces)} spaces to {args.output}", file=sys.stderr)
-        except Exception as e:
-            print(f"Error writing to output file: {str(e)}", file=sys.stderr)
-            return 1
-    else:
-        print(output)
+                count = write_spaces(spaces, f, args.format)
+            print(f"Wrote {count} spaces to {args.output}", file=sys.stderr)
+        else:
+            count = write_spaces(spaces, sys.stdout, args.format)
+        if metrics is not None:
+            metrics.set_value('spaces', count)
+    except ConfluenceError as e:
+        print(f"Error retrieving Confluence spaces: {str(e)}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"Error writing to output file: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        if metrics is not None:
+            metrics.add_phase('spaces.list', time.perf_counter() - started)
+            write_metrics(metrics, args.metrics_file)
     
     return 0
 
@@ -0,0 +1,147 @@
+"""
+BlockConverterのベンチマーク
+
+合成した10万ブロックのページを、テーブル駆動の現在の実装と、
+ブロックごとにgetattrで変換関数を探していた以前の実装で変換し、
+処理時間とピークメモリを比較する。現在の実装はファイルへの
+逐次書き出し（write_markdown）も計測する。
+
+    cd notion-sync
+    python -m benchmarks.block_converter [--blocks 100000]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List
+
+from src.notion.block import BlockConverter
+
+
+class LegacyBlockConverter:
+    """以前の実装（比較用）"""
+
+    @staticmethod
+    def to_markdown(block: Dict[str, Any]) -> str:
+        block_type = block.get("type")
+        if not block_type:
+            return ""
+        converter = getattr(LegacyBlockConverter, f"convert_{block_type}", None)
+        if converter:
+            return converter(block)
+        return ""
+
+    @staticmethod
+    def _text(block: Dict[str, Any]) -> str:
+        return "".join(
+            span.get("plain_text", "")
+            for span in block[block["type"]]["rich_text"]
+        )
+
+    @staticmethod
+    def convert_paragraph(block):
+        return f"{LegacyBlockConverter._text(block)}\n\n"
+
+    @staticmethod
+    def convert_heading_2(block):
+        return f"## {LegacyBlockConverter._text(block)}\n\n"
+
+    @staticmethod
+    def convert_bulleted_list_item(block):
+        return f"- {LegacyBlockConverter._text(block)}\n"
+
+    @staticmethod
+    def convert_numbered_list_item(block):
+        return f"1. {LegacyBlockConverter._text(block)}\n"
+
+    @staticmethod
+    def convert_code(block):
+        return f"```{block['code']['language']}\n{LegacyBlockConverter._text(block)}\n```\n\n"
+
+    @staticmethod
+    def blocks_to_markdown(blocks: List[Dict[str, Any]]) -> str:
+        return "".join(LegacyBlockConverter.to_markdown(block) for block in blocks)
+
+
+def span(text: str, **annotations: bool) -> Dict[str, Any]:
+    return {
+        "type": "text",
+        "plain_text": text,
+        "text": {"content": text, "link": None},
+        "href": None,
+        "annotations": {
+            "bold": False,
+            "italic": False,
+            "strikethrough": False,
+            "underline": False,
+            "code": False,
+            "color": "default",
+            **annotations,
+        },
+    }
+
+
+def synthetic_blocks(count: int) -> Iterator[Dict[str, Any]]:
+    """APIのレスポンスと同じ形の合成ブロックを生成"""
+    kinds = ("paragraph", "heading_2", "bulleted_list_item", "numbered_list_item", "code")
+    for n in range(count):
+        block_type = kinds[n % len(kinds)]
+        payload: Dict[str, Any] = {
+            "rich_text": [
+                span(f"Block {n} "),
+                span("bold", bold=True),
+                span(" and "),
+                span("code", code=True),
+                span(" with some trailing text to make it realistic."),
+            ],
+            "color": "default",
+        }
+        if block_type == "code":
+            payload = {"rich_text": [span(f"print({n})")], "language": "python", "caption": []}
+        yield {"object": "block", "id": f"block-{n}", "type": block_type, "has_children": False, block_type: payload}
+
+
+def measure(label: str, func: Callable[[], Any]) -> None:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<40} {elapsed:>7.3f} s  peak {peak / 1024 / 1024:>8.2f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BlockConverterのベンチマーク")
+    parser.add_argument("--blocks", type=int, default=100_000, help="ブロック数")
+    args = parser.parse_args()
+
+    blocks = list(synthetic_blocks(args.blocks))
+    print(f"{args.blocks:,} blocks")
+
+    measure("legacy blocks_to_markdown (list)", lambda: LegacyBlockConverter.blocks_to_markdown(blocks))
+    measure("blocks_to_markdown (list)", lambda: BlockConverter.blocks_to_markdown(blocks))
+
+    fd, path = tempfile.mkstemp(suffix=".md")
+    os.close(fd)
+    try:
+        def legacy_to_file():
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(LegacyBlockConverter.blocks_to_markdown(synthetic_blocks(args.blocks)))
+
+        def stream_to_file():
+            with open(path, "w", encoding="utf-8") as f:
+                BlockConverter.write_markdown(synthetic_blocks(args.blocks), f)
+
+        measure("legacy string + write (generated)", legacy_to_file)
+        measure("write_markdown streaming (generated)", stream_to_file)
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Confluenceストレージ形式コンバーターのマイクロベンチマーク
+
+数MBのストレージ形式の本文を64KBずつ渡して変換し、スループットと
+ピークメモリを計測する。ピークメモリは本文のサイズではなく最大の
+最上位要素の大きさで決まるため、入力を増やしてもほぼ一定になる。
+
+    cd notion-sync
+    python -m benchmarks.confluence_storage [--sizes 1,4,16]
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Iterator
+
+from src.confluence.storage import convert_storage
+
+CHUNK_SIZE = 64 * 1024
+
+SECTION = """<h2>Section {n}</h2>
+<p>Paragraph with <strong>bold</strong>, <em>italic</em>, <code>code</code>&nbsp;and a
+<a href="https://example.com/{n}">link</a> &mdash; plus <ac:link><ri:page ri:content-title="Page {n}"/></ac:link>.</p>
+<ul><li>item {n}<ul><li>nested item with <s>strike</s></li></ul></li><li><p>second</p></li></ul>
+<ol><li>first</li><li>second</li></ol>
+<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">python</ac:parameter>
+<ac:plain-text-body><![CDATA[def f{n}(x):
+    return x * {n}  # &nbsp; stays literal
+]]></ac:plain-text-body></ac:structured-macro>
+<ac:structured-macro ac:name="info"><ac:rich-text-body><p>Note {n}</p><p>More detail</p></ac:rich-text-body></ac:structured-macro>
+<table><tbody><tr><th>key</th><th>value</th></tr><tr><td>a{n}</td><td><p>b{n}</p></td></tr>
+<tr><td>c{n}</td><td>d{n}</td></tr></tbody></table>
+<p><ac:image><ri:attachment ri:filename="diagram-{n}.png"/></ac:image></p>
+<hr/>
+"""
+
+
+def synthetic_chunks(size_bytes: int) -> Iterator[str]:
+    """指定サイズ程度の合成ストレージ形式をCHUNK_SIZEずつ生成"""
+    written = 0
+    n = 0
+    buffer = []
+    buffered = 0
+    while written < size_bytes:
+        section = SECTION.format(n=n)
+        written += len(section.encode("utf-8"))
+        n += 1
+        buffer.append(section)
+        buffered += len(section)
+        if buffered >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def run(size_mb: float) -> None:
+    size_bytes = int(size_mb * 1024 * 1024)
+
+    started = time.perf_counter()
+    batches = 0
+    blocks = 0
+    for batch in convert_storage(synthetic_chunks(size_bytes)):
+        batches += 1
+        blocks += len(batch)
+    elapsed = time.perf_counter() - started
+
+    # tracemallocは処理を遅くするため、メモリは別に計測する
+    tracemalloc.start()
+    for _ in convert_storage(synthetic_chunks(size_bytes)):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{size_mb:>7.1f} MB  {blocks:>9,} blocks  {batches:>7,} batches  {elapsed:>7.2f} s  "
+        f"{size_mb / elapsed:>6.2f} MB/s  {blocks / elapsed:>9,.0f} blocks/s  "
+        f"peak {peak / 1024:>8.1f} KiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confluenceストレージ形式コンバーターのベンチマーク")
+    parser.add_argument("--sizes", default="1,4,16", help="入力サイズ（MB、カンマ区切り）")
+    args = parser.parse_args()
+
+    for size in args.sizes.split(","):
+        run(float(size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+データベース検索（get_database_pages）のベンチマーク
+
+スタンドインのデータベースに行を用意し、次の読み方で呼び出し数・
+応答サイズ・経過時間を比べる。
+
+- first-page: 最初の1ページだけ（以前のget_database_pagesの動作）
+- full-scan: next_cursorを最後まで辿る（先読みあり）
+- sequential: 同じ全件走査を先読みなしで行う
+- recent: 最後の1時間に編集された行だけをサーバー側で絞り込み、
+  タイトルとステータスだけを返させる
+
+    cd notion-sync
+    python -m benchmarks.database_scan [--rows 50000] [--latency 50]
+"""
+import argparse
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterator
+
+from src.notion.client import NotionClient, database_query
+from src.notion.ratelimit import RateLimiter
+from src.utils.metrics import Metrics
+
+from .fake_api import ROWS_EDITED_FROM, FakeAPIServer, FakeNotion
+
+
+def sequential_scan(client: NotionClient, database_id: str) -> Iterator[Dict[str, Any]]:
+    """先読みせずに全件を取得する（比較用）"""
+    kwargs = database_query()
+    cursor = None
+    while True:
+        response = client.query_database(database_id, kwargs, cursor)
+        yield from response["results"]
+        if not response.get("has_more"):
+            return
+        cursor = response["next_cursor"]
+
+
+def run(
+    name: str,
+    server: FakeAPIServer,
+    read: Callable[[NotionClient], Iterator[Dict[str, Any]]],
+    work: float,
+) -> None:
+    metrics = Metrics()
+    client = NotionClient("benchmark", RateLimiter(rate=1000.0), base_url=server.url, metrics=metrics)
+    server.reset_calls()
+    started = time.perf_counter()
+    rows = 0
+    for _ in read(client):
+        rows += 1
+        if work:
+            # 呼び出し側の処理時間（1行あたり）
+            time.sleep(work)
+    elapsed = time.perf_counter() - started
+    calls = sum(count for endpoint, count in server.reset_calls().items() if endpoint != "rate_limited")
+    size = sum(metrics.response_bytes.values())
+    print(
+        f"{name:<12} {rows:>7,} rows  {calls:>5} calls  {size / 1024 / 1024:>8.2f} MB  "
+        f"{elapsed:>7.2f} s",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="データベース検索のベンチマーク")
+    parser.add_argument("--rows", type=int, default=50000, help="データベースの行数")
+    parser.add_argument("--latency", type=float, default=50.0, help="スタンドインの応答遅延（ミリ秒）")
+    parser.add_argument("--work", type=float, default=0.2, help="呼び出し側の1行あたりの処理時間（ミリ秒）")
+    args = parser.parse_args()
+
+    backend = FakeNotion(1, rows=args.rows)
+    database_id = backend.database_id
+    recent = ROWS_EDITED_FROM + timedelta(minutes=args.rows - 60)
+    work = args.work / 1000
+    with FakeAPIServer(backend, args.latency / 1000) as server:
+        run("first-page", server, lambda client: iter(
+            client.query_database(database_id, database_query())["results"]
+        ), work)
+        run("full-scan", server, lambda client: client.get_database_pages(database_id), work)
+        run("sequential", server, lambda client: sequential_scan(client, database_id), work)
+        run("recent", server, lambda client: client.get_database_pages(
+            database_id,
+            edited_after=recent,
+            filter_properties=["title", "stat"],
+        ), work)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,580 @@
+"""
+ベンチマーク用のNotion API・GitHub GraphQL APIのスタンドイン
+
+127.0.0.1の空いているポートで別スレッドのHTTPサーバーとして動き、
+同期が使うエンドポイント（ページ・子ブロック・データベース検索・
+ブロックの追加/更新/削除、GitHubのプロジェクト/Issueのクエリ）に
+合成したワークスペースの内容で応答する。
+
+応答ごとの遅延と、トークンバケットによるレート制限（超えた場合は
+Retry-After付きの429）を設定できる。エンドポイントごとの呼び出し
+回数を数え、ベンチマークの「1ページあたりのAPI呼び出し数」に使う。
+"""
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+EDITED_AT = "2024-01-01T00:00:00.000Z"
+BLOCK_PAGE_SIZE = 100
+DATABASE_PAGE_SIZE = 100
+# データベースの行の編集日時（n番目の行はこのn分後に編集されたことにする）
+ROWS_EDITED_FROM = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _rich_text(content: str, **annotations: bool) -> Dict[str, Any]:
+    return {
+        "type": "text",
+        "text": {"content": content, "link": None},
+        "plain_text": content,
+        "href": None,
+        "annotations": {
+            "bold": False,
+            "italic": False,
+            "strikethrough": False,
+            "underline": False,
+            "code": False,
+            "color": "default",
+            **annotations,
+        },
+    }
+
+
+def _payload(block_type: str, rich_text: List[Dict[str, Any]], **extra: Any) -> Dict[str, Any]:
+    return {"type": block_type, block_type: {"rich_text": rich_text, "color": "default", **extra}}
+
+
+def page_content(n: int) -> List[Dict[str, Any]]:
+    """n番目のページの本文（作成時の形式、子ブロックはchildrenに入れる）"""
+    return [
+        _payload("heading_2", [_rich_text(f"概要 {n}")]),
+        _payload("paragraph", [
+            _rich_text("本文の段落 "),
+            _rich_text("太字", bold=True),
+            _rich_text(" と "),
+            _rich_text("コード", code=True),
+            _rich_text(f" を含む {n} 番目のページ。"),
+        ]),
+        _payload("bulleted_list_item", [_rich_text("項目 1")], children=[
+            _payload("bulleted_list_item", [_rich_text("入れ子の項目")]),
+        ]),
+        _payload("bulleted_list_item", [_rich_text("項目 2")]),
+        _payload("to_do", [_rich_text("確認する")], checked=False),
+        _payload("quote", [_rich_text("引用された文章")]),
+        {"type": "code", "code": {
+            "rich_text": [_rich_text(f"def page_{n}():\n    return {n}")],
+            "language": "python",
+        }},
+        {"type": "divider", "divider": {}},
+        {"type": "table", "table": {
+            "table_width": 2,
+            "has_column_header": True,
+            "has_row_header": False,
+            "children": [
+                {"type": "table_row", "table_row": {"cells": [[_rich_text("キー")], [_rich_text("値")]]}},
+                {"type": "table_row", "table_row": {"cells": [[_rich_text("n")], [_rich_text(str(n))]]}},
+            ],
+        }},
+        _payload("paragraph", [_rich_text("最後の段落。")]),
+    ]
+
+
+def row_properties(n: int) -> Dict[str, Any]:
+    """データベースのn番目の行のプロパティ（絞り込みを試せるよう大きめにする）"""
+    return {
+        "Name": {"id": "title", "type": "title", "title": [_rich_text(f"Row {n}")]},
+        "Status": {"id": "stat", "type": "select", "select": {"name": ("Open", "Closed")[n % 2]}},
+        "Summary": {"id": "summ", "type": "rich_text", "rich_text": [_rich_text(f"行 {n} の概要。" * 8)]},
+        "Notes": {"id": "note", "type": "rich_text", "rich_text": [_rich_text(f"行 {n} のメモ。" * 8)]},
+        "Owner": {"id": "ownr", "type": "rich_text", "rich_text": [_rich_text(f"owner-{n % 17}")]},
+    }
+
+
+def _timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class FakeNotion:
+    """Notion APIのスタンドインが保持するワークスペース
+
+    ページはroot_idを根とする木で、各ページはfanout個までの子ページを持つ。
+    ブロックは親ID -> 子ブロックIDの一覧として保持する。
+    rowsを指定すると、database_idのデータベースにその数の行を用意する。
+    """
+
+    def __init__(
+        self,
+        pages: int,
+        fanout: int = 10,
+        database_id: str = "bench-database",
+        rows: int = 0,
+    ):
+        self.lock = threading.Lock()
+        self.database_id = database_id
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        self.blocks: Dict[str, Dict[str, Any]] = {}
+        self.children: Dict[str, List[str]] = {}
+        self.root_id = self.add_page(None, "Workspace", 0)
+        queue = [self.root_id]
+        for n in range(1, pages):
+            parent = queue[(n - 1) // fanout]
+            page_id = self.add_page(parent, f"Page {n}", n)
+            queue.append(page_id)
+        for n in range(rows):
+            row_id = self.add_page(None, "", 0, database_id, row_properties(n))
+            edited = (ROWS_EDITED_FROM + timedelta(minutes=n)).isoformat(timespec="milliseconds")
+            self.pages[row_id]["last_edited_time"] = edited.replace("+00:00", "Z")
+
+    # --- ワークスペース -----------------------------------------------
+
+    def add_page(
+        self,
+        parent_id: Optional[str],
+        title: str,
+        n: int,
+        database_id: Optional[str] = None,
+        properties: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        page_id = str(uuid.uuid4())
+        if properties is None:
+            properties = {"title": {"id": "title", "type": "title", "title": [_rich_text(title)]}}
+        if database_id:
+            parent = {"type": "database_id", "database_id": database_id}
+        elif parent_id:
+            parent = {"type": "page_id", "page_id": parent_id}
+        else:
+            parent = {"type": "workspace", "workspace": True}
+        self.pages[page_id] = {
+            "object": "page",
+            "id": page_id,
+            "created_time": EDITED_AT,
+            "last_edited_time": EDITED_AT,
+            "archived": False,
+            "parent": parent,
+            "properties": properties,
+        }
+        self.children[page_id] = []
+        if database_id is None:
+            self.append(page_id, page_content(n))
+        if parent_id is not None:
+            # 子ページのブロックIDはページIDと同じ
+            self.append(parent_id, [{"id": page_id, "type": "child_page", "child_page": {"title": title}}])
+        return page_id
+
+    def append(
+        self,
+        parent_id: str,
+        children: List[Dict[str, Any]],
+        after: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """ブロックを追加（入れ子のchildrenも作成する）"""
+        siblings = self.children.setdefault(parent_id, [])
+        position = siblings.index(after) + 1 if after in siblings else len(siblings)
+        created = []
+        for block in children:
+            block_type = block["type"]
+            content = dict(block[block_type])
+            nested = content.pop("children", None) or []
+            block_id = block.get("id") or str(uuid.uuid4())
+            stored = {
+                "object": "block",
+                "id": block_id,
+                "created_time": EDITED_AT,
+                "last_edited_time": EDITED_AT,
+                "has_children": bool(nested) or block_type == "child_page",
+                "archived": False,
+                "type": block_type,
+                block_type: content,
+            }
+            self.blocks[block_id] = stored
+            self.children.setdefault(block_id, [])
+            if nested:
+                self.append(block_id, nested)
+            created.append(stored)
+        siblings[position:position] = [block["id"] for block in created]
+        return created
+
+    def remove(self, block_id: str) -> Optional[Dict[str, Any]]:
+        block = self.blocks.pop(block_id, None)
+        if block is None:
+            return None
+        for siblings in self.children.values():
+            if block_id in siblings:
+                siblings.remove(block_id)
+                break
+        block["archived"] = True
+        return block
+
+    # --- エンドポイント -------------------------------------------------
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Any) -> Tuple[int, Any, str]:
+        """(ステータス, 応答, 集計用のエンドポイント名)を返す"""
+        parts = [part for part in path.split("/") if part][1:]  # "v1"を除く
+        with self.lock:
+            if parts[:1] == ["pages"] and len(parts) == 1 and method == "POST":
+                return 200, self.create_page(body), "pages.create"
+            if parts[:1] == ["pages"] and len(parts) == 2:
+                page = self.pages.get(parts[1])
+                if page is None:
+                    return 404, self.error(404, "object_not_found"), "pages.retrieve"
+                if method == "PATCH":
+                    page["properties"].update(body.get("properties") or {})
+                    page["last_edited_time"] = _now()
+                    if "archived" in body:
+                        page["archived"] = body["archived"]
+                    return 200, page, "pages.update"
+                return 200, page, "pages.retrieve"
+            if parts[:1] == ["blocks"] and len(parts) == 3 and parts[2] == "children":
+                if method == "PATCH":
+                    if parts[1] not in self.children:
+                        return 404, self.error(404, "object_not_found"), "blocks.children.append"
+                    created = self.append(parts[1], body.get("children", []), body.get("after"))
+                    parent = self.blocks.get(parts[1])
+                    if parent is not None:
+                        parent["has_children"] = True
+                    return 200, {"object": "list", "results": created}, "blocks.children.append"
+                return self.list_children(parts[1], query)
+            if parts[:1] == ["blocks"] and len(parts) == 2:
+                if method == "DELETE":
+                    block = self.remove(parts[1])
+                    if block is None:
+                        return 404, self.error(404, "object_not_found"), "blocks.delete"
+                    return 200, block, "blocks.delete"
+                block = self.blocks.get(parts[1])
+                if method == "GET":
+                    if block is None:
+                        return 404, self.error(404, "object_not_found"), "blocks.retrieve"
+                    return 200, block, "blocks.retrieve"
+                if block is None:
+                    return 404, self.error(404, "object_not_found"), "blocks.update"
+                block[block["type"]].update(body.get(block["type"]) or {})
+                return 200, block, "blocks.update"
+            if parts[:1] == ["databases"] and len(parts) == 3 and parts[2] == "query":
+                return self.query_database(parts[1], body, query)
+            if parts == ["search"] and method == "POST":
+                return self.search(body)
+        return 404, self.error(404, "invalid_request_url"), "unknown"
+
+    def create_page(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        parent = body.get("parent") or {}
+        database_id = parent.get("database_id")
+        properties = {
+            name: {"id": name, **value} for name, value in (body.get("properties") or {}).items()
+        }
+        for value in properties.values():
+            for key in ("title", "rich_text"):
+                for item in value.get(key, []):
+                    item.setdefault("plain_text", (item.get("text") or {}).get("content", ""))
+        page_id = self.add_page(parent.get("page_id"), "", 0, database_id, properties)
+        self.pages[page_id]["created_time"] = self.pages[page_id]["last_edited_time"] = _now()
+        if body.get("children"):
+            self.append(page_id, body["children"])
+        return self.pages[page_id]
+
+    def list_children(self, block_id: str, query: Dict[str, str]) -> Tuple[int, Any, str]:
+        if block_id not in self.children:
+            return 404, self.error(404, "object_not_found"), "blocks.children.list"
+        start = int(query.get("start_cursor") or 0)
+        size = min(int(query.get("page_size") or BLOCK_PAGE_SIZE), BLOCK_PAGE_SIZE)
+        ids = self.children[block_id]
+        end = start + size
+        return 200, {
+            "object": "list",
+            "results": [self.blocks[child_id] for child_id in ids[start:end]],
+            "next_cursor": str(end) if end < len(ids) else None,
+            "has_more": end < len(ids),
+            "type": "block",
+            "block": {},
+        }, "blocks.children.list"
+
+    def query_database(
+        self,
+        database_id: str,
+        body: Dict[str, Any],
+        query: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[int, Any, str]:
+        """filter（タイトルの一致・編集日時・and）、sorts（編集日時）、filter_propertiesに対応"""
+        body = body or {}
+        pages = [
+            page for page in self.pages.values()
+            if page["parent"].get("database_id") == database_id and not page["archived"]
+            and self.matches(page, body.get("filter"))
+        ]
+        for sort in reversed(body.get("sorts") or []):
+            if sort.get("timestamp") in ("last_edited_time", "created_time"):
+                pages.sort(key=lambda page: page[sort["timestamp"]], reverse=sort.get("direction") == "descending")
+        start = int(body.get("start_cursor") or 0)
+        size = min(int(body.get("page_size") or DATABASE_PAGE_SIZE), DATABASE_PAGE_SIZE)
+        end = start + size
+        results = pages[start:end]
+        projection = (query or {}).get("filter_properties")
+        if projection is not None:
+            if isinstance(projection, str):
+                projection = [projection]
+            results = [
+                dict(page, properties={
+                    name: value for name, value in page["properties"].items()
+                    if value.get("id") in projection or name in projection
+                })
+                for page in results
+            ]
+        return 200, {
+            "object": "list",
+            "results": results,
+            "next_cursor": str(end) if end < len(pages) else None,
+            "has_more": end < len(pages),
+            "type": "page_or_database",
+            "page_or_database": {},
+        }, "databases.query"
+
+    def search(self, body: Dict[str, Any]) -> Tuple[int, Any, str]:
+        """filter（object）とsort（last_edited_time）に対応する検索"""
+        body = body or {}
+        kind = (body.get("filter") or {}).get("value")
+        # データベースの行も検索結果に含まれる（実際のAPIと同じ）
+        pages = [page for page in self.pages.values() if kind in (None, "page")]
+        sort = body.get("sort") or {}
+        if sort.get("timestamp") == "last_edited_time":
+            pages.sort(key=lambda page: page["last_edited_time"], reverse=sort.get("direction") != "ascending")
+        start = int(body.get("start_cursor") or 0)
+        size = min(int(body.get("page_size") or DATABASE_PAGE_SIZE), DATABASE_PAGE_SIZE)
+        end = start + size
+        return 200, {
+            "object": "list",
+            "results": pages[start:end],
+            "next_cursor": str(end) if end < len(pages) else None,
+            "has_more": end < len(pages),
+            "type": "page_or_database",
+            "page_or_database": {},
+        }, "search"
+
+    @classmethod
+    def matches(cls, page: Dict[str, Any], query_filter: Optional[Dict[str, Any]]) -> bool:
+        if not query_filter:
+            return True
+        if "and" in query_filter:
+            return all(cls.matches(page, item) for item in query_filter["and"])
+        if "or" in query_filter:
+            return any(cls.matches(page, item) for item in query_filter["or"])
+        timestamp = query_filter.get("timestamp")
+        if timestamp:
+            condition = query_filter[timestamp]
+            value = _timestamp(page[timestamp])
+            if "after" in condition and not value > _timestamp(condition["after"]):
+                return False
+            if "on_or_after" in condition and not value >= _timestamp(condition["on_or_after"]):
+                return False
+            if "before" in condition and not value < _timestamp(condition["before"]):
+                return False
+            return True
+        title = (query_filter.get("title") or {}).get("equals")
+        if title is not None:
+            prop = page["properties"].get(query_filter["property"], {})
+            return "".join(item["plain_text"] for item in prop.get("title", [])) == title
+        return True
+
+    @staticmethod
+    def error(status: int, code: str, message: str = "") -> Dict[str, Any]:
+        return {"object": "error", "status": status, "code": code, "message": message or code}
+
+
+class FakeGitHub:
+    """GitHub GraphQL APIのスタンドインが保持するプロジェクト
+
+    Issueはissues件で、それぞれlabels個のラベルを持つ。
+    """
+
+    LABEL_PAGE_SIZE = 100
+    ITEM_PAGE_SIZE = 100
+
+    def __init__(self, issues: int, labels: int = 3):
+        self.lock = threading.Lock()
+        self.issues = {
+            f"I_{n}": {
+                "id": f"I_{n}",
+                "number": n,
+                "title": f"Issue {n}",
+                "state": "OPEN" if n % 3 else "CLOSED",
+                "updatedAt": "2024-01-01T00:00:00Z",
+                "labels": [f"label-{(n + i) % 10}" for i in range(labels)],
+            }
+            for n in range(1, issues + 1)
+        }
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Any) -> Tuple[int, Any, str]:
+        text = body.get("query", "")
+        variables = body.get("variables") or {}
+        rate_limit = {"cost": 1, "remaining": 5000, "resetAt": "2099-01-01T00:00:00Z"}
+        with self.lock:
+            if "projectV2" in text:
+                ids = list(self.issues)
+                start = int(variables.get("cursor") or 0)
+                end = start + self.ITEM_PAGE_SIZE
+                nodes = [
+                    {"updatedAt": self.issues[i]["updatedAt"],
+                     "content": {"id": i, "updatedAt": self.issues[i]["updatedAt"]}}
+                    for i in ids[start:end]
+                ]
+                data = {"organization": {"projectV2": {"items": {
+                    "pageInfo": {"hasNextPage": end < len(ids), "endCursor": str(end)},
+                    "nodes": nodes,
+                }}}}
+                return 200, {"data": {**data, "rateLimit": rate_limit}}, "graphql.items"
+            if "nodes(ids" in text:
+                nodes = [self.issue_node(i) for i in variables.get("ids", [])]
+                return 200, {"data": {"nodes": nodes, "rateLimit": rate_limit}}, "graphql.issues"
+            if "node(id" in text:
+                start = int(variables.get("cursor") or 0)
+                node = {"labels": self.labels(variables["id"], start)}
+                return 200, {"data": {"node": node, "rateLimit": rate_limit}}, "graphql.labels"
+        return 200, {"errors": [{"message": "unsupported query"}]}, "graphql.unknown"
+
+    def issue_node(self, issue_id: str) -> Optional[Dict[str, Any]]:
+        issue = self.issues.get(issue_id)
+        if issue is None:
+            return None
+        return {key: issue[key] for key in ("id", "number", "title", "state")} | {
+            "labels": self.labels(issue_id, 0),
+        }
+
+    def labels(self, issue_id: str, start: int) -> Dict[str, Any]:
+        names = self.issues[issue_id]["labels"]
+        end = start + self.LABEL_PAGE_SIZE
+        return {
+            "pageInfo": {"hasNextPage": end < len(names), "endCursor": str(end)},
+            "nodes": [{"name": name} for name in names[start:end]],
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-aliveで接続を使い回す（実際のAPIと同じ）。ヘッダーと本文を
+    # 別に書き込むため、Nagleアルゴリズムによる遅延が入らないようにする
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method: str):
+        server: "FakeAPIServer" = self.server.stand_in
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        parts = urlsplit(self.path)
+
+        retry_after = server.admit()
+        if retry_after:
+            server.count("rate_limited")
+            self.respond(429, FakeNotion.error(429, "rate_limited"), {"Retry-After": f"{retry_after:.0f}"})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+
+        status, response, endpoint = server.backend.handle(
+            method, parts.path, self.query_params(parts.query), body
+        )
+        server.count(endpoint)
+        self.respond(status, response)
+
+    @staticmethod
+    def query_params(query: str) -> Dict[str, Any]:
+        """クエリ文字列（filter_propertiesのように繰り返すキーはリストにする）"""
+        return {
+            key: values if len(values) > 1 else values[0]
+            for key, values in parse_qs(query).items()
+        }
+
+    def respond(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Date", formatdate(usegmt=True))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeAPIServer:
+    """スタンドインのHTTPサーバー
+
+    latencyは応答ごとの遅延（秒）。rate_limitを指定すると、平均がその
+    回数/秒（burstまでの超過は許容）を超えたリクエストに429を返す。
+    """
+
+    def __init__(self, backend: Any, latency: float = 0.0, rate_limit: float = 0.0, burst: int = 3):
+        self.backend = backend
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.stand_in = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def admit(self) -> float:
+        """レート制限を超えていれば、再試行までの秒数を返す"""
+        if not self.rate_limit:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate_limit)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(1.0, (1 - self.tokens) / self.rate_limit)
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.calls[endpoint] += 1
+
+    def reset_calls(self) -> Counter:
+        """これまでの呼び出し回数を返して0に戻す"""
+        with self.lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+    def start(self) -> "FakeAPIServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FakeAPIServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,89 @@
+"""
+Markdownコンパイラのマイクロベンチマーク
+
+入力サイズを倍々に増やしながら compile_markdown を実行し、
+処理時間が入力サイズに比例すること（1KBあたりの時間がほぼ一定）と、
+ピークメモリが入力サイズに依存しないことを確認する。
+
+    cd notion-sync
+    python -m benchmarks.markdown_compiler [--sizes 1,2,4,8]
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Iterator
+
+from src.markdown.compiler import compile_markdown
+
+SECTION = """## Section {n}
+
+Paragraph with **bold**, *italic*, `code` and a [link](https://example.com/{n}).
+A second line that keeps the paragraph going for a while longer.
+
+- item {n}
+  - nested item with ~~strike~~
+    - deeper item
+- [ ] todo {n}
+1. first
+2. second
+
+> quoted text {n}
+
+```python
+def f{n}(x):
+    return x * {n}
+```
+
+| key | value |
+|-----|-------|
+| a{n} | b{n} |
+| c{n} | d{n} |
+
+---
+
+"""
+
+
+def synthetic_lines(size_bytes: int) -> Iterator[str]:
+    """指定サイズ程度の合成Markdownを1行ずつ生成"""
+    written = 0
+    n = 0
+    while written < size_bytes:
+        section = SECTION.format(n=n)
+        written += len(section.encode("utf-8"))
+        n += 1
+        yield from section.splitlines(keepends=True)
+
+
+def run(size_mb: float) -> None:
+    size_bytes = int(size_mb * 1024 * 1024)
+
+    started = time.perf_counter()
+    blocks = sum(1 for _ in compile_markdown(synthetic_lines(size_bytes)))
+    elapsed = time.perf_counter() - started
+
+    # tracemallocは処理を遅くするため、メモリは別に計測する
+    tracemalloc.start()
+    for _ in compile_markdown(synthetic_lines(size_bytes)):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{size_mb:>7.1f} MB  {blocks:>9,} blocks  {elapsed:>7.2f} s  "
+        f"{size_mb / elapsed:>6.2f} MB/s  {elapsed * 1e6 / (size_bytes / 1024):>7.1f} us/KB  "
+        f"peak {peak / 1024:>8.1f} KiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Markdownコンパイラのベンチマーク")
+    parser.add_argument("--sizes", default="1,2,4,8", help="入力サイズ（MB、カンマ区切り）")
+    args = parser.parse_args()
+
+    for size in args.sizes.split(","):
+        run(float(size))
+
+
+if __name__ == "__main__":
+    main()
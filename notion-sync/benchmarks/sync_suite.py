@@ -0,0 +1,247 @@
+"""
+同期のオフラインベンチマーク
+
+ローカルのNotion API・GitHub GraphQL APIのスタンドイン（fake_api）に
+合成したワークスペース（10 / 1,000 / 10,000ページ）を用意し、次の
+シナリオを実際の同期処理で最後まで実行する。
+
+- pull: 空のディレクトリへのsync_from_notion
+- pull-warm: 変更のない状態での2回目のsync_from_notion
+- push: 全ファイルに段落を1つ追記してsync_from_markdown
+- issues: 全Issueを空のデータベースへsync_issues_to_notion
+- issues-warm: 変更のない状態での2回目のsync_issues_to_notion
+
+各シナリオは別プロセスで実行し、経過時間・1ページあたりのAPI呼び出し
+数・ピークRSS・ページ/秒を表示する（--jsonで、処理段階ごとの時間を
+含めた結果を保存できる）。
+サーバーは親プロセスで動かすため、ピークRSSには含まれない。
+
+    cd notion-sync
+    python -m benchmarks.sync_suite [--pages 10,1000,10000] [--latency 50] [--server-rate 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from .fake_api import FakeAPIServer, FakeGitHub, FakeNotion
+
+SCENARIOS = ["pull", "pull-warm", "push", "issues", "issues-warm"]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def sync_config(args: argparse.Namespace) -> Dict[str, Any]:
+    """スタンドインに向けたnotion-syncの設定"""
+    return {
+        "notion": {
+            "token": "benchmark",
+            "baseUrl": args.notion_url,
+            "databases": {"management": {"rootPageId": args.root_page}},
+        },
+        "markdown": {
+            "managementDir": os.path.join(args.work_dir, "management"),
+            "developmentDir": os.path.join(args.work_dir, "development"),
+            "assetsDir": os.path.join(args.work_dir, "assets"),
+        },
+        "sync": {
+            "watchMode": False,
+            "concurrency": args.concurrency,
+            "blockDepth": 8,
+            "rateLimit": args.client_rate,
+            "maxRetries": 5,
+            "retryDelay": 1000,
+            "stateFile": os.path.join(args.work_dir, ".notion-sync.db"),
+            "debounce": 500,
+            "watchWorkers": 4,
+            "assetConcurrency": 4,
+            "metricsFile": metrics_file(args.work_dir, args.child),
+            "metricsInterval": 60,
+            "interval": 300000,
+            "issuesInterval": 0,
+            "controlSocket": os.path.join(args.work_dir, ".notion-sync.sock"),
+            "discovery": args.discovery,
+        },
+    }
+
+
+def metrics_file(work_dir: str, scenario: str) -> str:
+    """子プロセスが計測値（処理段階ごとの時間など）を書き出すファイル"""
+    return os.path.join(work_dir, f"metrics-{scenario}.json")
+
+
+async def run_sync(args: argparse.Namespace) -> int:
+    """notion-syncのシナリオを実行し、処理したページ数を返す"""
+    from src.sync.manager import SyncManager
+
+    manager = SyncManager(sync_config(args))
+    try:
+        if args.child == "push":
+            directory = os.path.join(args.work_dir, "management")
+            for file_path, _ in manager.scan_markdown(directory):
+                with open(file_path, "a", encoding="utf-8") as f:
+                    f.write("\nベンチマークで追記した段落。\n")
+            await manager.sync_from_markdown()
+            return manager.pushed_files
+        await manager.sync_from_notion()
+        return manager.written_pages + manager.skipped_pages + manager.identical_pages
+    finally:
+        await manager.close()
+        manager.write_metrics()
+
+
+def run_issues(args: argparse.Namespace) -> int:
+    """sync_issues_to_notionを実行し、同期したIssueの数を返す"""
+    os.environ.update({
+        "GITHUB_TOKEN": "benchmark",
+        "NOTION_TOKEN": "benchmark",
+        "NOTION_DATABASE_ID": args.database,
+        "GITHUB_GRAPHQL_URL": f"{args.github_url}/graphql",
+        "NOTION_API_URL": f"{args.notion_url}/v1",
+        "GITHUB_SYNC_STATE_FILE": os.path.join(args.work_dir, ".github-sync-state.json"),
+        "SYNC_METRICS_FILE": metrics_file(args.work_dir, args.child),
+        "NOTION_RATE_LIMIT": str(args.client_rate),
+    })
+    sys.path.insert(0, REPO_ROOT)
+    import sync_issues_to_notion
+
+    sync_issues_to_notion.main()
+    return args.pages
+
+
+def run_child(args: argparse.Namespace) -> None:
+    """1つのシナリオを実行し、結果をJSONで標準出力の最後の行に書く"""
+    started = time.perf_counter()
+    if args.child.startswith("issues"):
+        pages = run_issues(args)
+    else:
+        pages = asyncio.run(run_sync(args))
+    elapsed = time.perf_counter() - started
+    # Linuxではキロバイト単位
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"pages": pages, "elapsed": elapsed, "peak_rss_kb": peak_rss}))
+
+
+def run_scenario(
+    args: argparse.Namespace,
+    scenario: str,
+    pages: int,
+    notion: FakeAPIServer,
+    github: FakeAPIServer,
+    work_dir: str,
+) -> Dict[str, Any]:
+    notion.reset_calls()
+    github.reset_calls()
+    command = [
+        sys.executable, "-m", "benchmarks.sync_suite",
+        "--child", scenario,
+        "--pages", str(pages),
+        "--work-dir", work_dir,
+        "--notion-url", notion.url,
+        "--github-url", github.url,
+        "--root-page", notion.backend.root_id,
+        "--database", notion.backend.database_id,
+        "--client-rate", str(args.client_rate),
+        "--concurrency", str(args.concurrency),
+        "--discovery", args.discovery,
+    ]
+    result = subprocess.run(
+        command,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stdout[-2000:] + result.stderr[-4000:])
+        raise RuntimeError(f"{scenario} ({pages} pages) failed with exit code {result.returncode}")
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    with open(metrics_file(work_dir, scenario), encoding="utf-8") as f:
+        phases = json.load(f)["phases"]
+
+    calls = notion.reset_calls()
+    github_calls = github.reset_calls()
+    notion_calls = sum(count for name, count in calls.items() if name != "rate_limited")
+    return {
+        "scenario": scenario,
+        "pages": pages,
+        "processed": measured["pages"],
+        "elapsed": round(measured["elapsed"], 3),
+        "pages_per_second": round(pages / measured["elapsed"], 2) if measured["elapsed"] else 0.0,
+        "notion_calls": notion_calls,
+        "calls_per_page": round(notion_calls / pages, 2),
+        "github_calls": sum(github_calls.values()),
+        "rate_limited": calls.get("rate_limited", 0),
+        "peak_rss_mb": round(measured["peak_rss_kb"] / 1024, 1),
+        "calls": dict(calls),
+        "phases": {name: round(phase["sum"], 3) for name, phase in phases.items()},
+    }
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    print(
+        f"{result['scenario']:<12} {result['pages']:>7,} pages  {result['elapsed']:>8.2f} s  "
+        f"{result['pages_per_second']:>8.1f} pages/s  {result['calls_per_page']:>6.2f} calls/page  "
+        f"429 {result['rate_limited']:>5}  peak RSS {result['peak_rss_mb']:>7.1f} MB",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同期のオフラインベンチマーク")
+    parser.add_argument("--pages", default="10,1000,10000", help="ワークスペースのページ数（カンマ区切り）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="実行するシナリオ（カンマ区切り）")
+    parser.add_argument("--latency", type=float, default=0.0, help="スタンドインの応答遅延（ミリ秒）")
+    parser.add_argument("--server-rate", type=float, default=0.0,
+                        help="スタンドインが429を返し始める平均リクエスト数/秒（0で無制限）")
+    parser.add_argument("--client-rate", type=float,
+                        help="同期側のレート制限（回/秒、既定は--server-rate、それもなければ1000）")
+    parser.add_argument("--concurrency", type=int, default=8, help="同期側の同時リクエスト数")
+    parser.add_argument("--discovery", choices=("tree", "search"), default="tree",
+                        help="ページの探し方（SYNC_DISCOVERYと同じ）")
+    parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    # 子プロセス用（シナリオを1つ実行する）
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--notion-url", help=argparse.SUPPRESS)
+    parser.add_argument("--github-url", help=argparse.SUPPRESS)
+    parser.add_argument("--root-page", help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.pages = int(args.pages)
+        run_child(args)
+        return
+
+    if args.client_rate is None:
+        args.client_rate = args.server_rate or 1000.0
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    results: List[Dict[str, Any]] = []
+    for size in (int(value) for value in args.pages.split(",")):
+        notion = FakeAPIServer(FakeNotion(size), args.latency / 1000, args.server_rate)
+        github = FakeAPIServer(FakeGitHub(size), args.latency / 1000)
+        with notion, github, tempfile.TemporaryDirectory(prefix="notion-sync-bench-") as work_dir:
+            for scenario in scenarios:
+                result = run_scenario(args, scenario, size, notion, github, work_dir)
+                print_result(result)
+                results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "latency_ms": args.latency,
+                "server_rate": args.server_rate,
+                "client_rate": args.client_rate,
+                "concurrency": args.concurrency,
+                "discovery": args.discovery,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,581 @@
+"""
+Confluenceのストレージ形式（XHTML）をNotionブロックに変換するコンバーター
+
+本文をXMLPullParserに少しずつ渡し、最上位の要素が閉じるたびに
+その要素をブロックに変換して返す。変換済みの要素は木から取り除く
+ため、使用メモリは本文全体ではなく最大の最上位要素（大きな表など）
+の大きさで決まる。
+
+ストレージ形式は宣言されていない名前空間（ac:, ri:）とHTMLの
+文字実体参照（&nbsp;など）を含むため、名前空間を宣言した要素で
+囲み、実体参照は数値文字参照に置き換えてから解析する。
+"""
+import re
+from html.entities import name2codepoint
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+from xml.etree.ElementTree import Element, XMLPullParser
+
+from ..markdown.compiler import code_language, fit_block, split_rich_text
+from ..notion.diff import APPEND_LIMIT
+
+NAMESPACES = {
+    "ac": "http://atlassian.com/content",
+    "ri": "http://atlassian.com/resource/identifier",
+    "at": "http://atlassian.com/template",
+}
+ROOT_OPEN = "<storage-root {}>".format(
+    " ".join(f'xmlns:{prefix}="{uri}"' for prefix, uri in NAMESPACES.items())
+)
+ROOT_CLOSE = "</storage-root>"
+
+# XMLとして解釈できる実体参照（それ以外はHTMLの実体参照として置き換える）
+XML_ENTITIES = {"amp", "lt", "gt", "quot", "apos"}
+ENTITY_RE = re.compile(r"&([A-Za-z][A-Za-z0-9]*);")
+CDATA_OPEN = "<![CDATA["
+CDATA_CLOSE = "]]>"
+# 実体参照の名前の最大長（途中で切れた実体参照を次のチャンクに持ち越す範囲）
+MAX_ENTITY_LENGTH = 32
+
+HEADINGS = {
+    "h1": "heading_1",
+    "h2": "heading_2",
+    "h3": "heading_3",
+    "h4": "heading_3",
+    "h5": "heading_3",
+    "h6": "heading_3",
+}
+
+# 書式を表すインライン要素 -> annotationsのキー
+INLINE_ANNOTATIONS = {
+    "strong": "bold",
+    "b": "bold",
+    "em": "italic",
+    "i": "italic",
+    "u": "underline",
+    "s": "strikethrough",
+    "del": "strikethrough",
+    "strike": "strikethrough",
+    "code": "code",
+}
+
+# パネル系マクロ -> calloutのアイコン
+PANEL_ICONS = {
+    "info": "ℹ️",
+    "note": "📝",
+    "warning": "⚠️",
+    "tip": "💡",
+    "panel": "📌",
+}
+
+AttachmentResolver = Callable[[str], Optional[str]]
+
+
+def _qname(prefix: str, name: str) -> str:
+    return f"{{{NAMESPACES[prefix]}}}{name}"
+
+
+AC_IMAGE = _qname("ac", "image")
+AC_LINK = _qname("ac", "link")
+AC_MACRO = _qname("ac", "structured-macro")
+AC_PARAMETER = _qname("ac", "parameter")
+AC_NAME = _qname("ac", "name")
+AC_PLAIN_BODY = _qname("ac", "plain-text-body")
+AC_RICH_BODY = _qname("ac", "rich-text-body")
+AC_LINK_BODY = _qname("ac", "link-body")
+AC_PLAIN_LINK_BODY = _qname("ac", "plain-text-link-body")
+AC_TASK_LIST = _qname("ac", "task-list")
+AC_TASK = _qname("ac", "task")
+AC_TASK_STATUS = _qname("ac", "task-status")
+AC_TASK_BODY = _qname("ac", "task-body")
+AC_EMOTICON = _qname("ac", "emoticon")
+RI_URL = _qname("ri", "url")
+RI_VALUE = _qname("ri", "value")
+RI_ATTACHMENT = _qname("ri", "attachment")
+RI_FILENAME = _qname("ri", "filename")
+RI_PAGE = _qname("ri", "page")
+RI_CONTENT_TITLE = _qname("ri", "content-title")
+AC_EMOJI_FALLBACK = _qname("ac", "emoji-fallback")
+
+
+class EntityTranslator:
+    """HTMLの実体参照を数値文字参照に置き換える（CDATAの中は変更しない）
+
+    チャンクの境界で切れた実体参照やCDATAの区切りは次のチャンクに持ち越す。
+    """
+
+    def __init__(self):
+        self.pending = ""
+        self.in_cdata = False
+
+    @staticmethod
+    def _replace(match: "re.Match[str]") -> str:
+        name = match.group(1)
+        if name in XML_ENTITIES or name not in name2codepoint:
+            return match.group(0)
+        return f"&#{name2codepoint[name]};"
+
+    def feed(self, chunk: str, final: bool = False) -> str:
+        data = self.pending + chunk
+        self.pending = ""
+        out = []
+        pos = 0
+        while pos < len(data):
+            if self.in_cdata:
+                end = data.find(CDATA_CLOSE, pos)
+                if end < 0:
+                    keep = len(data) if final else max(pos, len(data) - len(CDATA_CLOSE) + 1)
+                    out.append(data[pos:keep])
+                    self.pending = data[keep:]
+                    break
+                out.append(data[pos:end + len(CDATA_CLOSE)])
+                pos = end + len(CDATA_CLOSE)
+                self.in_cdata = False
+                continue
+
+            start = data.find(CDATA_OPEN, pos)
+            if start < 0:
+                keep = len(data) if final else self._safe_end(data, pos)
+                out.append(ENTITY_RE.sub(self._replace, data[pos:keep]))
+                self.pending = data[keep:]
+                break
+            out.append(ENTITY_RE.sub(self._replace, data[pos:start]))
+            out.append(CDATA_OPEN)
+            pos = start + len(CDATA_OPEN)
+            self.in_cdata = True
+        return "".join(out)
+
+    @staticmethod
+    def _safe_end(data: str, pos: int) -> int:
+        """途中で切れている可能性のある実体参照・CDATAの開始を除いた終端"""
+        end = len(data)
+        amp = data.rfind("&", max(pos, end - MAX_ENTITY_LENGTH))
+        if amp >= 0 and ";" not in data[amp:]:
+            end = amp
+        lt = data.rfind("<", max(pos, len(data) - len(CDATA_OPEN)))
+        if lt >= 0 and CDATA_OPEN.startswith(data[lt:]):
+            end = min(end, lt)
+        return end
+
+
+def _local(tag: Any) -> str:
+    """名前空間なしの要素名（ac:, ri:の要素は修飾名のまま）"""
+    return tag if isinstance(tag, str) else ""
+
+
+def _span(content: str, annotations: Dict[str, bool], link: Optional[str]) -> Dict[str, Any]:
+    text: Dict[str, Any] = {"content": content}
+    if link:
+        text["link"] = {"url": link}
+    span: Dict[str, Any] = {"type": "text", "text": text}
+    if annotations:
+        span["annotations"] = dict(annotations)
+    return span
+
+
+class StorageConverter:
+    """Confluenceのストレージ形式をNotionブロックに変換する
+
+    attachment_urlは添付ファイル名からURLを求める関数。URLが
+    分からない添付ファイルは、ファイル名のテキストとして残す。
+    """
+
+    def __init__(self, attachment_url: Optional[AttachmentResolver] = None):
+        self.attachment_url = attachment_url
+
+    # --- ストリーミング -------------------------------------------------
+
+    def iter_blocks(self, chunks: Union[str, Iterable[str]]) -> Iterator[Dict[str, Any]]:
+        """本文（文字列またはチャンクの列）を変換し、最上位のブロックを順に返す"""
+        if isinstance(chunks, str):
+            chunks = (chunks,)
+        parser = XMLPullParser(events=("start", "end"))
+        translator = EntityTranslator()
+        parser.feed(ROOT_OPEN)
+        depth = 0
+        root: Optional[Element] = None
+        previous: Optional[Element] = None
+
+        def release() -> List[Dict[str, Any]]:
+            # 要素の後ろの地のテキストは次の要素が始まるまで確定しない
+            nonlocal previous
+            if previous is None:
+                return self.text_blocks(root.text)
+            blocks = self.text_blocks(previous.tail)
+            root.remove(previous)
+            return blocks
+
+        def drain() -> Iterator[Dict[str, Any]]:
+            nonlocal depth, root, previous
+            for event, elem in parser.read_events():
+                if event == "start":
+                    if depth == 0:
+                        root = elem
+                    elif depth == 1:
+                        yield from release()
+                        previous = elem
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    # 最上位の要素が閉じた: 変換して中身を捨てる（tailは残す）
+                    yield from self.top_level(elem)
+                    del elem[:]
+                    elem.text = None
+                elif depth == 0:
+                    yield from release()
+
+        for chunk in chunks:
+            parser.feed(translator.feed(chunk))
+            yield from drain()
+        parser.feed(translator.feed("", final=True))
+        parser.feed(ROOT_CLOSE)
+        yield from drain()
+        parser.close()
+
+    def iter_batches(
+        self,
+        chunks: Union[str, Iterable[str]],
+        batch_size: int = APPEND_LIMIT,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """最上位のブロックをbatch_size個（既定はappendの上限）ずつまとめて返す"""
+        batch: List[Dict[str, Any]] = []
+        for block in self.iter_blocks(chunks):
+            batch.append(block)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def text_blocks(self, text: Optional[str]) -> List[Dict[str, Any]]:
+        """要素の外にある地のテキストを段落にする"""
+        if text and text.strip():
+            return [self.paragraph([_span(text.strip(), {}, None)])]
+        return []
+
+    # --- ブロック要素 ---------------------------------------------------
+
+    def top_level(self, elem: Element) -> List[Dict[str, Any]]:
+        """最上位の要素を変換（入れ子の深さ・子の数・rich_textの要素数をNotionの上限に合わせる）"""
+        blocks: List[Dict[str, Any]] = []
+        for block in self.convert(elem):
+            blocks.extend(fit_block(block))
+        return blocks
+
+    def convert(self, elem: Element) -> List[Dict[str, Any]]:
+        tag = _local(elem.tag)
+        if tag == "p" or tag == "div" or tag == "span":
+            return self.convert_paragraph(elem)
+        if tag in HEADINGS:
+            return [self.text_block(HEADINGS[tag], self.rich_text(elem))]
+        if tag in ("ul", "ol"):
+            return self.convert_list(elem)
+        if tag == "table":
+            return self.convert_table(elem)
+        if tag == "pre":
+            return self.code(self.plain_text(elem), "plain text")
+        if tag == "blockquote":
+            return self.convert_container("quote", elem)
+        if tag == "hr":
+            return [{"object": "block", "type": "divider", "divider": {}}]
+        if tag == AC_MACRO:
+            return self.convert_macro(elem)
+        if tag == AC_IMAGE:
+            return self.convert_image(elem)
+        if tag == AC_TASK_LIST:
+            return self.convert_task_list(elem)
+        if tag == AC_LINK:
+            return self.convert_paragraph(elem)
+        if tag in ("tbody", "thead", "section", "article", "body"):
+            return self.convert_children(elem)
+        # 未対応の要素は中のテキストだけを残す
+        spans = self.rich_text(elem)
+        return [self.paragraph(spans)] if spans else []
+
+    def convert_children(self, elem: Element) -> List[Dict[str, Any]]:
+        """子要素を順に変換（子要素の間の地のテキストは段落にする）"""
+        blocks = self.text_blocks(elem.text)
+        for child in elem:
+            blocks.extend(self.convert(child))
+            blocks.extend(self.text_blocks(child.tail))
+        return blocks
+
+    def convert_paragraph(self, elem: Element) -> List[Dict[str, Any]]:
+        """段落（中の画像は段落の後に画像ブロックとして出す）"""
+        blocks = []
+        spans = self.rich_text(elem)
+        if spans:
+            blocks.append(self.paragraph(spans))
+        for image in elem.iter(AC_IMAGE):
+            blocks.extend(self.convert_image(image))
+        for link in elem.iter(AC_LINK):
+            attachment = link.find(RI_ATTACHMENT)
+            if attachment is not None:
+                blocks.extend(self.file_block(attachment.get(RI_FILENAME, "")))
+        return blocks
+
+    def convert_container(self, block_type: str, elem: Element) -> List[Dict[str, Any]]:
+        """本文を持つブロック（引用など）: 最初の段落を本文に、残りを子ブロックにする"""
+        children = self.convert_children(elem)
+        if not children:
+            return []
+        first = children[0]
+        if first["type"] == "paragraph":
+            rich_text = first["paragraph"]["rich_text"]
+            children = children[1:]
+        else:
+            rich_text = []
+        block = self.text_block(block_type, rich_text)
+        if children:
+            block[block_type]["children"] = children
+        return [block]
+
+    def convert_list(self, elem: Element) -> List[Dict[str, Any]]:
+        block_type = "numbered_list_item" if _local(elem.tag) == "ol" else "bulleted_list_item"
+        items = []
+        for li in elem:
+            if _local(li.tag) != "li":
+                continue
+            # 入れ子のリスト・段落以外のブロックは子ブロックにする
+            spans: List[Dict[str, Any]] = []
+            children: List[Dict[str, Any]] = []
+            self._inline(li.text, {}, None, spans)
+            for child in li:
+                tag = _local(child.tag)
+                if tag in ("ul", "ol", "table", "pre", AC_MACRO, AC_TASK_LIST):
+                    children.extend(self.convert(child))
+                elif tag == "p" and not spans:
+                    spans.extend(self.rich_text(child))
+                elif tag == "p":
+                    children.extend(self.convert_paragraph(child))
+                else:
+                    self._walk(child, {}, None, spans)
+                self._inline(child.tail, {}, None, spans)
+            item = self.text_block(block_type, self._merge(spans))
+            if children:
+                item[block_type]["children"] = children
+            items.append(item)
+        return items
+
+    def convert_task_list(self, elem: Element) -> List[Dict[str, Any]]:
+        items = []
+        for task in elem.iter(AC_TASK):
+            status = task.find(AC_TASK_STATUS)
+            body = task.find(AC_TASK_BODY)
+            item = self.text_block("to_do", self.rich_text(body) if body is not None else [])
+            item["to_do"]["checked"] = status is not None and (status.text or "").strip() == "complete"
+            items.append(item)
+        return items
+
+    def convert_table(self, elem: Element) -> List[Dict[str, Any]]:
+        """表を変換（appendの上限を超える行数は表を分けて、見出し行を繰り返す）"""
+        rows = [tr for tr in elem.iter("tr")]
+        if not rows:
+            return []
+        cells = [[cell for cell in tr if _local(cell.tag) in ("th", "td")] for tr in rows]
+        width = max((len(row) for row in cells), default=0)
+        if width == 0:
+            return []
+        has_header = all(_local(cell.tag) == "th" for cell in cells[0]) and len(cells) > 1
+
+        def row_block(row: List[Element]) -> Dict[str, Any]:
+            texts = [self.rich_text(cell) for cell in row]
+            texts += [[] for _ in range(width - len(texts))]
+            return {"object": "block", "type": "table_row", "table_row": {"cells": texts}}
+
+        header = row_block(cells[0]) if has_header else None
+        body = [row_block(row) for row in (cells[1:] if has_header else cells)]
+        per_table = APPEND_LIMIT - (1 if header else 0)
+        tables = []
+        for start in range(0, max(len(body), 1), per_table):
+            children = ([header] if header else []) + body[start:start + per_table]
+            tables.append({
+                "object": "block",
+                "type": "table",
+                "table": {
+                    "table_width": width,
+                    "has_column_header": has_header,
+                    "has_row_header": False,
+                    "children": children,
+                },
+            })
+        return tables
+
+    def convert_macro(self, elem: Element) -> List[Dict[str, Any]]:
+        name = elem.get(AC_NAME, "")
+        params = {
+            param.get(AC_NAME, ""): (param.text or "").strip()
+            for param in elem.findall(AC_PARAMETER)
+        }
+        if name in ("code", "noformat"):
+            body = elem.find(AC_PLAIN_BODY)
+            language = params.get("language", "") if name == "code" else ""
+            return self.code(body.text or "" if body is not None else "", language)
+
+        rich_body = elem.find(AC_RICH_BODY)
+        children = self.convert_children(rich_body) if rich_body is not None else []
+        if name in PANEL_ICONS:
+            title = params.get("title", "")
+            block = self.text_block("callout", [_span(title, {"bold": True}, None)] if title else [])
+            block["callout"]["icon"] = {"type": "emoji", "emoji": PANEL_ICONS[name]}
+            if not title and children and children[0]["type"] == "paragraph":
+                block["callout"]["rich_text"] = children.pop(0)["paragraph"]["rich_text"]
+            if children:
+                block["callout"]["children"] = children
+            return [block]
+        if name == "expand":
+            block = self.text_block("toggle", [_span(params.get("title") or "Click here to expand...", {}, None)])
+            if children:
+                block["toggle"]["children"] = children
+            return [block]
+        # その他のマクロは本文があれば本文だけを残す
+        return children
+
+    def convert_image(self, elem: Element) -> List[Dict[str, Any]]:
+        url_elem = elem.find(RI_URL)
+        if url_elem is not None:
+            url = url_elem.get(RI_VALUE)
+        else:
+            attachment = elem.find(RI_ATTACHMENT)
+            if attachment is None:
+                return []
+            filename = attachment.get(RI_FILENAME, "")
+            url = self.attachment_url(filename) if self.attachment_url else None
+            if not url:
+                return [self.paragraph([_span(f"🖼 {filename}", {}, None)])]
+        if not url:
+            return []
+        return [{
+            "object": "block",
+            "type": "image",
+            "image": {"type": "external", "external": {"url": url}},
+        }]
+
+    def file_block(self, filename: str) -> List[Dict[str, Any]]:
+        url = self.attachment_url(filename) if self.attachment_url and filename else None
+        if not url:
+            return []
+        return [{
+            "object": "block",
+            "type": "file",
+            "file": {"type": "external", "external": {"url": url}, "name": filename},
+        }]
+
+    def code(self, text: str, language: str) -> List[Dict[str, Any]]:
+        """コードブロック（rich_textの要素数の上限はtop_levelで分割する）"""
+        language = code_language(language) or "plain text"
+        spans = split_rich_text([_span(text.strip("\n"), {}, None)]) if text else []
+        return [{"object": "block", "type": "code", "code": {"rich_text": spans, "language": language}}]
+
+    # --- インライン要素 -------------------------------------------------
+
+    def paragraph(self, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return self.text_block("paragraph", spans)
+
+    @staticmethod
+    def text_block(block_type: str, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "object": "block",
+            "type": block_type,
+            block_type: {"rich_text": split_rich_text(spans)},
+        }
+
+    def rich_text(self, elem: Element) -> List[Dict[str, Any]]:
+        """要素の中身をrich_textに変換（同じ書式の隣り合う要素はまとめる）"""
+        spans: List[Dict[str, Any]] = []
+        self._inline(elem.text, {}, None, spans)
+        for child in elem:
+            self._walk(child, {}, None, spans)
+            self._inline(child.tail, {}, None, spans)
+        return self._merge(spans)
+
+    def plain_text(self, elem: Element) -> str:
+        return "".join(elem.itertext())
+
+    def _walk(
+        self,
+        elem: Element,
+        annotations: Dict[str, bool],
+        link: Optional[str],
+        spans: List[Dict[str, Any]],
+    ) -> None:
+        tag = _local(elem.tag)
+        if tag == "br":
+            spans.append(_span("\n", annotations, link))
+            return
+        if tag in (AC_IMAGE, AC_PARAMETER):
+            return
+        if tag == AC_EMOTICON:
+            fallback = elem.get(AC_EMOJI_FALLBACK)
+            if fallback:
+                spans.append(_span(fallback, annotations, link))
+            return
+        if tag == AC_LINK:
+            self._link(elem, annotations, spans)
+            return
+        if tag in INLINE_ANNOTATIONS:
+            annotations = {**annotations, INLINE_ANNOTATIONS[tag]: True}
+        elif tag == "a":
+            link = elem.get("href") or link
+
+        self._inline(elem.text, annotations, link, spans)
+        for child in elem:
+            self._walk(child, annotations, link, spans)
+            self._inline(child.tail, annotations, link, spans)
+
+    def _link(self, elem: Element, annotations: Dict[str, bool], spans: List[Dict[str, Any]]) -> None:
+        """ac:link（ページ・添付ファイルへのリンク）"""
+        body = elem.find(AC_LINK_BODY)
+        if body is None:
+            body = elem.find(AC_PLAIN_LINK_BODY)
+        target = elem.find(RI_PAGE)
+        attachment = elem.find(RI_ATTACHMENT)
+        url = None
+        if attachment is not None and self.attachment_url:
+            url = self.attachment_url(attachment.get(RI_FILENAME, ""))
+        if body is not None:
+            text = "".join(body.itertext())
+        elif target is not None:
+            text = target.get(RI_CONTENT_TITLE, "")
+        elif attachment is not None:
+            text = attachment.get(RI_FILENAME, "")
+        else:
+            text = ""
+        self._inline(text, annotations, url, spans)
+
+    @staticmethod
+    def _inline(
+        text: Optional[str],
+        annotations: Dict[str, bool],
+        link: Optional[str],
+        spans: List[Dict[str, Any]],
+    ) -> None:
+        if text:
+            # XHTMLの改行・字下げは空白1つとして扱う
+            text = re.sub(r"\s+", " ", text)
+            spans.append(_span(text, annotations, link))
+
+    @staticmethod
+    def _merge(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """同じ書式の隣り合う要素をまとめ、前後の空白を除く"""
+        merged: List[Dict[str, Any]] = []
+        for span in spans:
+            if merged and (
+                merged[-1].get("annotations") == span.get("annotations")
+                and merged[-1]["text"].get("link") == span["text"].get("link")
+            ):
+                merged[-1]["text"]["content"] += span["text"]["content"]
+            else:
+                merged.append({**span, "text": dict(span["text"])})
+        if merged:
+            merged[0]["text"]["content"] = merged[0]["text"]["content"].lstrip(" ")
+            merged[-1]["text"]["content"] = merged[-1]["text"]["content"].rstrip(" ")
+        return [span for span in merged if span["text"]["content"]]
+
+
+def convert_storage(
+    chunks: Union[str, Iterable[str]],
+    attachment_url: Optional[AttachmentResolver] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """ストレージ形式の本文をAPPEND_LIMIT個以下のブロックのまとまりに変換"""
+    return StorageConverter(attachment_url).iter_batches(chunks)
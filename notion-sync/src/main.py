@@ -1,13 +1,24 @@
 import os
 import asyncio
+from typing import TYPE_CHECKING
 import click
 from dotenv import load_dotenv
-from rich.console import Console
 
 from .types import Config
-from .sync.manager import SyncManager
 
-console = Console()
+# rich・watchdog・notion_clientの読み込みは重いため、コマンドの実行時まで遅らせる
+if TYPE_CHECKING:
+    from .sync.manager import SyncManager
+
+_console = None
+
+def get_console():
+    """rich.Consoleを初めて使う時に作成する"""
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
 
 def load_config() -> Config:
     """設定を読み込む"""
@@ -16,6 +27,7 @@ def load_config() -> Config:
     return {
         "notion": {
             "token": os.getenv("NOTION_TOKEN", ""),
+            "baseUrl": os.getenv("NOTION_BASE_URL", "https://api.notion.com"),
             "databases": {
                 "management": {
                     "rootPageId": os.getenv("NOTION_MANAGEMENT_ROOT_PAGE_ID", ""),
@@ -28,12 +40,68 @@ def load_config() -> Config:
         "markdown": {
             "managementDir": os.getenv("MARKDOWN_MANAGEMENT_DIR", "management"),
             "developmentDir": os.getenv("MARKDOWN_DEVELOPMENT_DIR", "development"),
+            "assetsDir": os.getenv("MARKDOWN_ASSETS_DIR", "assets"),
         },
         "sync": {
             "watchMode": os.getenv("SYNC_WATCH_MODE", "false").lower() == "true",
+            "concurrency": int(os.getenv("SYNC_CONCURRENCY", "8")),
+            "blockDepth": int(os.getenv("SYNC_BLOCK_DEPTH", "8")),
+            "rateLimit": float(os.getenv("NOTION_RATE_LIMIT", "3")),
+            "maxRetries": int(os.getenv("SYNC_MAX_RETRIES", "3")),
+            "retryDelay": int(os.getenv("SYNC_RETRY_DELAY", "1000")),
+            "stateFile": os.getenv("SYNC_STATE_FILE", ".notion-sync.db"),
+            "debounce": int(os.getenv("SYNC_DEBOUNCE", "500")),
+            "watchWorkers": int(os.getenv("SYNC_WATCH_WORKERS", "4")),
+            "assetConcurrency": int(os.getenv("SYNC_ASSET_CONCURRENCY", "4")),
+            "metricsFile": os.getenv("SYNC_METRICS_FILE", ""),
+            "metricsInterval": int(os.getenv("SYNC_METRICS_INTERVAL", "60")),
+            "interval": int(os.getenv("SYNC_INTERVAL", "300000")),
+            "issuesInterval": int(os.getenv("SYNC_ISSUES_INTERVAL", "0")),
+            "controlSocket": os.getenv("SYNC_CONTROL_SOCKET", ".notion-sync.sock"),
+            "discovery": os.getenv("SYNC_DISCOVERY", "tree"),
         }
     }
 
+def report_metrics(manager: "SyncManager"):
+    """APIの統計を表示し、計測値を書き出す"""
+    console = get_console()
+    console.print(f"[dim]Notion API: {manager.notion.limiter.stats.summary()}[/]")
+    console.print(f"[dim]{manager.metrics.summary()}[/]")
+    try:
+        manager.write_metrics()
+    except OSError as e:
+        console.print(f"[bold red]計測値の書き出しに失敗しました: {e}[/]")
+
+async def run_sync(manager: "SyncManager"):
+    """双方向の同期（監視モードでは続けて監視）を1つのイベントループで実行"""
+    try:
+        await manager.sync_from_notion()
+        await manager.sync_from_markdown()
+        if manager.config["sync"]["watchMode"]:
+            get_console().print("[bold green]同期が完了し、ファイル変更の監視を開始しました[/]")
+            await manager.watch()
+    finally:
+        await manager.close()
+        report_metrics(manager)
+
+async def run_watch(manager: "SyncManager"):
+    """記録済みの同期状態と索引を使い、初回の同期をせずに監視する"""
+    try:
+        await manager.watch()
+    finally:
+        await manager.close()
+        report_metrics(manager)
+
+async def run_daemon(manager: "SyncManager"):
+    """常駐モード（定期的な同期・監視・制御用ソケット）を1つのイベントループで実行"""
+    from .sync.daemon import SyncDaemon
+
+    try:
+        await SyncDaemon(manager, manager.config["sync"]["controlSocket"]).run()
+    finally:
+        await manager.close()
+        report_metrics(manager)
+
 @click.group()
 def cli():
     """NotionとMarkdownの同期ツール"""
@@ -43,6 +111,9 @@ def cli():
 @click.option("--watch", is_flag=True, help="ファイル変更を監視")
 def sync(watch: bool):
     """同期を実行"""
+    from .sync.manager import SyncManager
+
+    console = get_console()
     config = load_config()
     if watch:
         config["sync"]["watchMode"] = True
@@ -50,24 +121,83 @@ def sync(watch: bool):
     manager = SyncManager(config)
     
     try:
-        asyncio.run(manager.sync_from_notion())
-        asyncio.run(manager.sync_from_markdown())
-        
-        if watch:
-            manager.start_watching()
-            console.print("[bold green]同期が完了し、ファイル変更の監視を開始しました[/]")
-            try:
-                while True:
-                    asyncio.sleep(1)
-            except KeyboardInterrupt:
-                manager.stop()
-        else:
+        asyncio.run(run_sync(manager))
+        if not watch:
             console.print("[bold green]同期が完了しました[/]")
-            
+    except KeyboardInterrupt:
+        # 監視モードはCtrl+Cで終了する（後始末はrun_sync内で済んでいる）
+        pass
     except Exception as e:
-        console.error("[bold red]同期中にエラーが発生しました[/]")
-        console.error(e)
+        console.print(f"[bold red]同期中にエラーが発生しました: {e}[/]")
         raise click.Abort()
 
+@cli.command("watch")
+def watch_only():
+    """初回の同期を行わずにファイル変更の監視を開始"""
+    from .sync.manager import SyncManager
+
+    config = load_config()
+    config["sync"]["watchMode"] = True
+    manager = SyncManager(config)
+    try:
+        asyncio.run(run_watch(manager))
+    except KeyboardInterrupt:
+        pass
+
+@cli.command()
+def daemon():
+    """常駐して定期的に同期し、ファイル変更を監視
+
+    NotionからのpullはSYNC_INTERVAL、Issueの同期はSYNC_ISSUES_INTERVAL
+    （ミリ秒、0で無効）ごとに実行する。状態の確認と即時実行は
+    ctlコマンドで制御用ソケットを通して行う。
+    """
+    from .sync.manager import SyncManager
+
+    config = load_config()
+    config["sync"]["watchMode"] = True
+    manager = SyncManager(config)
+    try:
+        asyncio.run(run_daemon(manager))
+    except Exception as e:
+        get_console().print(f"[bold red]常駐中にエラーが発生しました: {e}[/]")
+        raise click.Abort()
+
+@cli.command()
+@click.argument("output")
+@click.option("--format", "archive_format", default=None,
+              help="アーカイブの形式（tar / tar.gz / zip / jsonl / jsonl.gz、省略時は拡張子から判断）")
+@click.option("--queue-size", type=int, default=16, help="取得済みで書き込み待ちにできるページ数の上限")
+def export(output: str, archive_format: str, queue_size: int):
+    """設定されたルートページ以下を1つのアーカイブに書き出す（バックアップ用）
+
+    各ページはMarkdownと、APIから取得したブロックのJSONの両方を含む。
+    """
+    from .sync.export import run_export
+
+    console = get_console()
+    try:
+        pages = asyncio.run(run_export(load_config(), output, archive_format, queue_size))
+    except Exception as e:
+        console.print(f"[bold red]エクスポート中にエラーが発生しました: {e}[/]")
+        raise click.Abort()
+    console.print(f"[bold green]{pages} ページを {output} に書き出しました[/]")
+
+@cli.command()
+@click.argument("command", nargs=-1, required=True)
+def ctl(command):
+    """常駐中のプロセスにコマンドを送る（status / trigger pull|push|issues / stop）"""
+    import json
+    from .sync.daemon import send_command
+
+    socket_path = load_config()["sync"]["controlSocket"]
+    try:
+        response = send_command(socket_path, " ".join(command))
+    except OSError as e:
+        raise click.ClickException(f"常駐中のプロセスに接続できません: {socket_path}: {e}")
+    click.echo(json.dumps(response, ensure_ascii=False, indent=2))
+    if not response.get("ok"):
+        raise SystemExit(1)
+
 if __name__ == "__main__":
     cli() 
\ No newline at end of file
@@ -0,0 +1,501 @@
+"""
+MarkdownをNotionブロックに変換するコンパイラ
+
+行を先頭から1回だけ読み、最上位のブロックが確定するたびに返す。
+保持するのは組み立て中のブロック（入れ子のリスト、表、コードブロック）
+だけなので、大きなファイルでも使用メモリは入力サイズに比例しない。
+"""
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..notion.diff import APPEND_LIMIT
+
+# rich_textの1要素あたりの最大文字数
+TEXT_LIMIT = 2000
+# 1ブロックあたりのrich_textの最大要素数
+RICH_TEXT_LIMIT = 100
+# 1回のappendで作成できる入れ子の深さ（最上位の下に2階層まで）
+MAX_NESTING = 2
+# rich_textが上限を超えた場合に、続きを同じ種類のブロックにするもの（それ以外は段落にする）
+CONTINUED_TYPES = {"paragraph", "quote", "code"}
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)(?:\s+#+)?\s*$")
+FENCE_RE = re.compile(r"^\s*(`{3,}|~{3,})\s*([^`]*?)\s*$")
+DIVIDER_RE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+LIST_RE = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+(.*)$")
+TASK_RE = re.compile(r"^\[([ xX])\]\s+(.*)$")
+IMAGE_RE = re.compile(r"^\s*!\[((?:\\.|[^\]\\])*)\]\(([^)\s]+)(?:\s+\"[^\"]*\")?\)\s*$")
+FILE_LINK_RE = re.compile(r"^\s*\[(?:\\.|[^\]\\])*\]\(([^)\s]+)\)\s*$")
+TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+COMMENT_RE = re.compile(r"^\s*<!--.*-->\s*$")
+
+# 書式の内側の1文字（エスケープされた記号は閉じの記号として扱わない）
+_CHAR = r"(?:\\.|[^\\])"
+INLINE_RE = re.compile(
+    r"\\(?P<escape>[!-/:-@\[-`{-~])"
+    r"|`(?P<code>[^`]+)`"
+    r"|\[(?P<link_text>(?:\\.|[^\]\\])+)\]\((?P<link_url>[^)\s]+)\)"
+    rf"|<u>(?P<underline>{_CHAR}+?)</u>"
+    rf"|\*\*\*(?P<bold_italic>{_CHAR}+?)\*\*\*"
+    rf"|\*\*(?P<bold>{_CHAR}+?)\*\*"
+    rf"|(?<!\w)__(?P<bold_u>{_CHAR}+?)__(?!\w)"
+    rf"|~~(?P<strike>{_CHAR}+?)~~"
+    r"|\*(?P<italic>(?:\\.|[^*\s\\])(?:(?:\\.|[^*\\])*(?:\\.|[^*\s\\]))?)\*"
+    r"|(?<!\w)_(?P<italic_u>(?:\\.|[^_\s\\])(?:(?:\\.|[^_\\])*(?:\\.|[^_\s\\]))?)_(?!\w)"
+)
+
+# Notionのコードブロックが受け付ける言語名への読み替え
+LANGUAGE_ALIASES = {
+    "": "plain text",
+    "text": "plain text",
+    "txt": "plain text",
+    "py": "python",
+    "js": "javascript",
+    "jsx": "javascript",
+    "ts": "typescript",
+    "tsx": "typescript",
+    "sh": "shell",
+    "zsh": "shell",
+    "console": "shell",
+    "yml": "yaml",
+    "md": "markdown",
+    "rb": "ruby",
+    "rs": "rust",
+    "kt": "kotlin",
+    "cs": "c#",
+    "csharp": "c#",
+    "cpp": "c++",
+    "golang": "go",
+    "dockerfile": "docker",
+    "proto": "protobuf",
+}
+# 空白を含むNotionの言語名（それ以外の情報文字列は最初の語を言語名とする）
+MULTIWORD_LANGUAGES = {"plain text", "visual basic"}
+
+
+def _span(content: str, annotations: Dict[str, bool], link: Optional[str]) -> Dict[str, Any]:
+    text: Dict[str, Any] = {"content": content}
+    if link:
+        text["link"] = {"url": link}
+    span: Dict[str, Any] = {"type": "text", "text": text}
+    if annotations:
+        span["annotations"] = dict(annotations)
+    return span
+
+
+def _append(
+    spans: List[Dict[str, Any]],
+    content: str,
+    annotations: Dict[str, bool],
+    link: Optional[str],
+) -> None:
+    """要素を追加する。直前の要素と書式が同じ場合は文字列をつなげる"""
+    span = _span(content, annotations, link)
+    if spans:
+        last = spans[-1]
+        if (
+            last.get("annotations") == span.get("annotations")
+            and last["text"].get("link") == span["text"].get("link")
+        ):
+            last["text"]["content"] += content
+            return
+    spans.append(span)
+
+
+def _parse_inline(
+    text: str,
+    annotations: Dict[str, bool],
+    link: Optional[str],
+    spans: List[Dict[str, Any]],
+) -> None:
+    position = 0
+    for match in INLINE_RE.finditer(text):
+        if match.start() > position:
+            _append(spans, text[position:match.start()], annotations, link)
+        position = match.end()
+
+        kind = match.lastgroup
+        if kind == "escape":
+            _append(spans, match.group(kind), annotations, link)
+        elif kind == "code":
+            _append(spans, match.group("code"), {**annotations, "code": True}, link)
+        elif kind == "link_url":
+            _parse_inline(match.group("link_text"), annotations, match.group("link_url"), spans)
+        elif kind == "bold_italic":
+            _parse_inline(match.group(kind), {**annotations, "bold": True, "italic": True}, link, spans)
+        elif kind in ("bold", "bold_u"):
+            _parse_inline(match.group(kind), {**annotations, "bold": True}, link, spans)
+        elif kind == "strike":
+            _parse_inline(match.group(kind), {**annotations, "strikethrough": True}, link, spans)
+        elif kind == "underline":
+            _parse_inline(match.group(kind), {**annotations, "underline": True}, link, spans)
+        else:
+            _parse_inline(match.group(kind), {**annotations, "italic": True}, link, spans)
+    if position < len(text):
+        _append(spans, text[position:], annotations, link)
+
+
+def split_rich_text(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """TEXT_LIMITを超える要素を同じ書式のまま分割"""
+    result = []
+    for span in spans:
+        content = span["text"]["content"]
+        if len(content) <= TEXT_LIMIT:
+            result.append(span)
+            continue
+        for start in range(0, len(content), TEXT_LIMIT):
+            result.append({
+                **span,
+                "text": {**span["text"], "content": content[start:start + TEXT_LIMIT]},
+            })
+    return result
+
+
+def rich_text(text: str) -> List[Dict[str, Any]]:
+    """インラインのMarkdown（太字・斜体・打ち消し・下線・コード・リンク、エスケープ）をrich_textに変換"""
+    spans: List[Dict[str, Any]] = []
+    _parse_inline(text, {}, None, spans)
+    return split_rich_text(spans)
+
+
+def plain_rich_text(text: str) -> List[Dict[str, Any]]:
+    """書式を解釈せずにrich_textに変換"""
+    return split_rich_text([_span(text, {}, None)]) if text else []
+
+
+def _text_block(block_type: str, text: str, **extra: Any) -> Dict[str, Any]:
+    return {
+        "object": "block",
+        "type": block_type,
+        block_type: {"rich_text": rich_text(text), **extra},
+    }
+
+
+def code_language(info: str) -> str:
+    """フェンスの情報文字列（```の後ろ）をNotionの言語名に変換
+
+    "plain text"のように空白を含む言語名は情報文字列全体で照合し、
+    それ以外（```python title="a.py"など）は最初の語を使う。
+    """
+    info = " ".join(info.lower().split())
+    if info in MULTIWORD_LANGUAGES:
+        return info
+    language = info.split(" ", 1)[0]
+    return LANGUAGE_ALIASES.get(language, language)
+
+
+def _code_blocks(lines: List[str], language: str) -> Iterator[Dict[str, Any]]:
+    """コードブロックを作成（rich_textの要素数の上限を超える場合は分割）"""
+    language = code_language(language)
+    spans = plain_rich_text("\n".join(lines))
+    for start in range(0, max(len(spans), 1), RICH_TEXT_LIMIT):
+        yield {
+            "object": "block",
+            "type": "code",
+            "code": {
+                "rich_text": spans[start:start + RICH_TEXT_LIMIT],
+                "language": language,
+            },
+        }
+
+
+def _table_cells(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in re.split(r"(?<!\\)\|", line)]
+
+
+def _table_block(header: List[str], rows: List[List[str]]) -> Dict[str, Any]:
+    width = len(header)
+    children = []
+    for cells in [header] + rows:
+        cells = (cells + [""] * width)[:width]
+        children.append({
+            "object": "block",
+            "type": "table_row",
+            "table_row": {"cells": [rich_text(cell) for cell in cells]},
+        })
+    return {
+        "object": "block",
+        "type": "table",
+        "table": {
+            "table_width": width,
+            "has_column_header": True,
+            "has_row_header": False,
+            "children": children,
+        },
+    }
+
+
+def fit_block(block: Dict[str, Any], depth: int = 0) -> List[Dict[str, Any]]:
+    """ブロックを1回のリクエストで作成できる形に整える
+
+    - rich_textがRICH_TEXT_LIMIT個を超える場合は、続きを後ろのブロックに分ける
+      （段落・引用・コードは同じ種類、見出しやリスト項目は段落）。
+      子ブロックは最後のブロックに付け替える。
+    - 表の行がAPPEND_LIMIT個を超える場合は、見出し行を繰り返した複数の表に分ける。
+    - 子ブロックは1階層あたりAPPEND_LIMIT個、深さMAX_NESTINGまで。超えた分
+      （行が深さの上限を超える表を含む）は親の後ろに兄弟として並べる。
+    """
+    block_type = block["type"]
+    if block_type == "table":
+        return _split_table(block)
+
+    blocks = _split_rich_text_block(block)
+    content = blocks[-1][blocks[-1]["type"]]
+    children = content.pop("children", None)
+    if not children:
+        return blocks
+    overflow: List[Dict[str, Any]] = []
+    if depth >= MAX_NESTING:
+        overflow = children
+    else:
+        kept: List[Dict[str, Any]] = []
+        for child in children:
+            for fitted in fit_block(child, depth + 1):
+                # 表の行が深さの上限を超える場合は、以降の子ブロックも含めて親の後ろに並べる
+                nested_table = fitted["type"] == "table" and depth + 1 >= MAX_NESTING
+                if overflow or nested_table or len(kept) >= APPEND_LIMIT:
+                    overflow.append(fitted)
+                else:
+                    kept.append(fitted)
+        content["children"] = kept
+    for child in overflow:
+        blocks.extend(fit_block(child, depth))
+    return blocks
+
+
+def _split_rich_text_block(block: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """rich_textの要素数がRICH_TEXT_LIMITを超えるブロックを続きのブロックに分ける"""
+    block_type = block["type"]
+    content = block[block_type]
+    spans = content.get("rich_text")
+    if spans is None or len(spans) <= RICH_TEXT_LIMIT:
+        return [block]
+    content["rich_text"] = spans[:RICH_TEXT_LIMIT]
+    blocks = [block]
+    continued_type = block_type if block_type in CONTINUED_TYPES else "paragraph"
+    for start in range(RICH_TEXT_LIMIT, len(spans), RICH_TEXT_LIMIT):
+        continued: Dict[str, Any] = {"rich_text": spans[start:start + RICH_TEXT_LIMIT]}
+        if continued_type == block_type:
+            continued.update(
+                (key, value) for key, value in content.items() if key not in ("rich_text", "children")
+            )
+        blocks.append({"object": "block", "type": continued_type, continued_type: continued})
+    children = content.pop("children", None)
+    if children:
+        blocks[-1][continued_type]["children"] = children
+    return blocks
+
+
+def _split_table(block: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """行がAPPEND_LIMIT個を超える表を、見出し行を繰り返した複数の表に分ける"""
+    content = block["table"]
+    rows = content.get("children") or []
+    header = rows[:1] if content.get("has_column_header") else []
+    body = rows[len(header):]
+    size = APPEND_LIMIT - len(header)
+    return [
+        {**block, "table": {**content, "children": header + body[start:start + size]}}
+        for start in range(0, max(len(body), 1), size)
+    ]
+
+
+class MarkdownCompiler:
+    """Markdownの行を順に受け取り、確定したブロックを返すコンパイラ"""
+
+    def __init__(self):
+        self.paragraph: List[str] = []
+        self.quote: List[str] = []
+        # 組み立て中のリスト: (字下げ, ブロック) のスタック
+        self.list_stack: List[Tuple[int, Dict[str, Any]]] = []
+        self.list_root: Optional[Dict[str, Any]] = None
+        self.code: Optional[List[str]] = None
+        self.code_fence = ""
+        self.code_language = ""
+        self.table_header: Optional[List[str]] = None
+        self.table_rows: List[List[str]] = []
+        self.pending_row: Optional[str] = None
+
+    def feed(self, line: str) -> Iterator[Dict[str, Any]]:
+        """1行を処理し、確定した最上位のブロックを返す"""
+        line = line.rstrip("\r\n")
+
+        if self.code is not None:
+            if line.strip().startswith(self.code_fence) and not line.strip().strip(self.code_fence[0]):
+                yield from self.finish_code()
+            else:
+                self.code.append(line)
+            return
+
+        if self.pending_row is not None:
+            header, self.pending_row = self.pending_row, None
+            if TABLE_SEPARATOR_RE.match(line):
+                yield from self.flush()
+                self.table_header = _table_cells(header)
+                return
+            yield from self.feed_text(header)
+
+        if self.table_header is not None:
+            if line.strip().startswith("|"):
+                self.table_rows.append(_table_cells(line))
+                return
+            yield from self.flush()
+
+        if line.strip().startswith("|") and not self.list_stack:
+            self.pending_row = line
+            return
+
+        yield from self.feed_text(line)
+
+    def feed_text(self, line: str) -> Iterator[Dict[str, Any]]:
+        stripped = line.strip()
+
+        if not stripped:
+            yield from self.flush_paragraph()
+            yield from self.flush_quote()
+            return
+
+        if COMMENT_RE.match(line):
+            return
+
+        fence = FENCE_RE.match(line)
+        if fence:
+            yield from self.flush()
+            self.code = []
+            self.code_fence = fence.group(1)
+            self.code_language = fence.group(2)
+            return
+
+        item = LIST_RE.match(line)
+        if item and not DIVIDER_RE.match(line):
+            yield from self.flush_paragraph()
+            yield from self.flush_quote()
+            yield from self.add_list_item(len(item.group(1).expandtabs(4)), item.group(2), item.group(3))
+            return
+
+        if self.list_stack and line[:1].isspace():
+            # リスト項目の継続行
+            block = self.list_stack[-1][1]
+            block[block["type"]]["rich_text"].extend(rich_text("\n" + stripped))
+            return
+
+        if stripped.startswith(">"):
+            yield from self.flush_paragraph()
+            yield from self.flush_list()
+            self.quote.append(stripped[1:].lstrip())
+            return
+
+        yield from self.flush_list()
+        yield from self.flush_quote()
+
+        heading = HEADING_RE.match(stripped)
+        if heading:
+            yield from self.flush_paragraph()
+            level = min(len(heading.group(1)), 3)
+            yield _text_block(f"heading_{level}", heading.group(2))
+            return
+
+        if DIVIDER_RE.match(line):
+            yield from self.flush_paragraph()
+            yield {"object": "block", "type": "divider", "divider": {}}
+            return
+
+        image = IMAGE_RE.match(line)
+        if image:
+            yield from self.flush_paragraph()
+            url = image.group(2)
+            # ローカルのファイルはNotionにアップロード済みの画像として扱い、作成しない
+            if url.startswith(("http://", "https://")):
+                yield {
+                    "object": "block",
+                    "type": "image",
+                    "image": {
+                        "type": "external",
+                        "external": {"url": url},
+                        "caption": rich_text(image.group(1)),
+                    },
+                }
+            return
+
+        # ローカルのファイルへのリンクだけの行はNotionにアップロード済みの添付ファイル
+        file_link = FILE_LINK_RE.match(line)
+        if file_link and not file_link.group(1).startswith(("http://", "https://", "mailto:", "#")):
+            yield from self.flush_paragraph()
+            return
+
+        self.paragraph.append(stripped)
+
+    def add_list_item(self, indent: int, marker: str, text: str) -> Iterator[Dict[str, Any]]:
+        task = TASK_RE.match(text)
+        if task:
+            block = _text_block("to_do", task.group(2), checked=task.group(1) != " ")
+        elif marker[0].isdigit():
+            block = _text_block("numbered_list_item", text)
+        else:
+            block = _text_block("bulleted_list_item", text)
+
+        while self.list_stack and self.list_stack[-1][0] >= indent:
+            self.list_stack.pop()
+        if not self.list_stack:
+            # 新しい最上位の項目が始まったので、前の項目は確定
+            yield from self.flush_list()
+            self.list_stack = [(indent, block)]
+            self.list_root = block
+            return
+
+        parent = self.list_stack[min(len(self.list_stack), MAX_NESTING) - 1][1]
+        parent[parent["type"]].setdefault("children", []).append(block)
+        self.list_stack.append((indent, block))
+
+    def flush_paragraph(self) -> Iterator[Dict[str, Any]]:
+        if self.paragraph:
+            yield _text_block("paragraph", "\n".join(self.paragraph))
+            self.paragraph = []
+
+    def flush_quote(self) -> Iterator[Dict[str, Any]]:
+        if self.quote:
+            yield _text_block("quote", "\n".join(self.quote))
+            self.quote = []
+
+    def flush_list(self) -> Iterator[Dict[str, Any]]:
+        self.list_stack = []
+        if self.list_root is not None:
+            root, self.list_root = self.list_root, None
+            yield root
+
+    def finish_code(self) -> Iterator[Dict[str, Any]]:
+        lines, self.code = self.code, None
+        yield from _code_blocks(lines, self.code_language)
+
+    def flush(self) -> Iterator[Dict[str, Any]]:
+        """組み立て中のブロックを全て確定"""
+        yield from self.flush_paragraph()
+        yield from self.flush_quote()
+        yield from self.flush_list()
+        if self.table_header is not None:
+            yield _table_block(self.table_header, self.table_rows)
+            self.table_header = None
+            self.table_rows = []
+
+    def close(self) -> Iterator[Dict[str, Any]]:
+        """入力の終わりで残りのブロックを確定"""
+        if self.code is not None:
+            yield from self.finish_code()
+        if self.pending_row is not None:
+            header, self.pending_row = self.pending_row, None
+            yield from self.feed_text(header)
+        yield from self.flush()
+
+
+def compile_markdown(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Markdownの行を順にNotionブロックに変換"""
+    compiler = MarkdownCompiler()
+    for line in lines:
+        for block in compiler.feed(line):
+            yield from fit_block(block)
+    for block in compiler.close():
+        yield from fit_block(block)
@@ -1,14 +1,121 @@
-from typing import Dict, Any, List
+import posixpath
+import re
+from typing import Dict, Any, List, Iterable, Iterator, AsyncIterable, AsyncIterator, Callable, Optional, TextIO
+from urllib.parse import urlsplit
+
+# 子ブロックを親のリスト項目の本文として字下げする幅
+CHILD_INDENT = {
+    "bulleted_list_item": "  ",
+    "numbered_list_item": "   ",
+    "to_do": "  ",
+}
+
+# (斜体, 太字, 打ち消し) -> (開始記号, 終了記号)。斜体を最も内側に付ける
+ANNOTATION_MARKS = {
+    (italic, bold, strike): (
+        "~~" * strike + "**" * bold + "*" * italic,
+        "*" * italic + "**" * bold + "~~" * strike,
+    )
+    for italic in (False, True)
+    for bold in (False, True)
+    for strike in (False, True)
+}
+
+# 文中で書式として解釈される文字（語中の"_"は書式にならないため除く）
+INLINE_SPECIAL_RE = re.compile(r"[\\`*\[\]<~]|(?<!\w)_|_(?!\w)")
+# 行頭で見出し・引用・リスト・表・区切り線として解釈される文字
+LINE_START_RE = re.compile(r"^([ \t]*)([#>+|-])|^([ \t]*\d+)([.)])", re.MULTILINE)
+
+# 続けて並ぶとリストとして扱われるブロック
+LIST_TYPES = {"bulleted_list_item", "numbered_list_item", "to_do"}
+
+
+def plain_text(span: Dict[str, Any]) -> str:
+    """rich_textの要素の文字列（作成前のブロックはtext.contentのみを持つ）"""
+    text = span.get("plain_text")
+    if text is None:
+        text = (span.get("text") or {}).get("content", "")
+    return text
+
+
+def escape_inline(text: str) -> str:
+    """書式として解釈される文字をバックスラッシュでエスケープ"""
+    return INLINE_SPECIAL_RE.sub(r"\\\g<0>", text)
+
+
+def escape_line_start(text: str) -> str:
+    """各行の先頭でブロックの記法として解釈される文字をエスケープ"""
+    return LINE_START_RE.sub(r"\1\3\\\2\4", text)
+
+
+def render_rich_text(rich_text: List[Dict[str, Any]]) -> str:
+    """rich_textをMarkdownに変換（太字・斜体・打ち消し・下線・コード・リンクを保持）
+
+    書式のない文字列に含まれるMarkdownの記号はエスケープする。
+    """
+    parts = []
+    for span in rich_text:
+        text = span.get("plain_text")
+        if text is None:
+            text = plain_text(span)
+        if not text:
+            continue
+
+        link = span.get("href")
+        if link is None:
+            link = ((span.get("text") or {}).get("link") or {}).get("url")
+        annotations = span.get("annotations") or {}
+        code = annotations.get("code")
+        italic = annotations.get("italic") is True
+        bold = annotations.get("bold") is True
+        strike = annotations.get("strikethrough") is True
+        underline = annotations.get("underline") is True
+        if not code:
+            text = escape_inline(text)
+        if not (link or code or italic or bold or strike or underline):
+            parts.append(text)
+            continue
+
+        body = f"`{text.strip()}`" if code else text.strip()
+        if body:
+            opening, closing = ANNOTATION_MARKS[(italic, bold, strike)]
+            # 記号の内側に空白があると書式として解釈されないため外に出す
+            leading = text[:len(text) - len(text.lstrip())]
+            trailing = text[len(text.rstrip()):]
+            text = f"{leading}{opening}{body}{closing}{trailing}"
+        if underline:
+            text = f"<u>{text}</u>"
+        if link:
+            text = f"[{text}]({link})"
+        parts.append(text)
+    return "".join(parts)
+
+
+def render_text_block(block: Dict[str, Any], indent: str = "") -> str:
+    """段落・リスト項目・引用の本文を変換
+
+    行頭の記号をエスケープし、2行目以降をindentで字下げする。
+    """
+    text = escape_line_start(render_rich_text(block[block["type"]]["rich_text"]))
+    return text.replace("\n", "\n" + indent) if indent else text
+
+
+def render_heading(block: Dict[str, Any]) -> str:
+    """見出しの本文を変換（末尾の"#"は閉じの記号と区別するためエスケープ）"""
+    text = render_rich_text(block[block["type"]]["rich_text"])
+    if text.endswith("#"):
+        text = text[:-1] + "\\#"
+    return text
+
 
 class BlockConverter:
+    # ブロックの種類 -> 変換関数（クラス定義の後で組み立てる）
+    CONVERTERS: Dict[str, Callable[[Dict[str, Any]], str]] = {}
+
     @staticmethod
     def to_markdown(block: Dict[str, Any]) -> str:
         """NotionブロックをMarkdownに変換"""
-        block_type = block.get("type")
-        if not block_type:
-            return ""
-
-        converter = getattr(BlockConverter, f"convert_{block_type}", None)
+        converter = BlockConverter.CONVERTERS.get(block.get("type"))
         if converter:
             return converter(block)
         return ""
@@ -16,84 +123,219 @@ class BlockConverter:
     @staticmethod
     def convert_paragraph(block: Dict[str, Any]) -> str:
         """段落ブロックを変換"""
-        text = "".join(
-            span.get("plain_text", "")
-            for span in block["paragraph"]["rich_text"]
-        )
-        return f"{text}\n\n"
+        return f"{render_text_block(block)}\n\n"
 
     @staticmethod
     def convert_heading_1(block: Dict[str, Any]) -> str:
         """見出し1を変換"""
-        text = "".join(
-            span.get("plain_text", "")
-            for span in block["heading_1"]["rich_text"]
-        )
-        return f"# {text}\n\n"
+        return f"# {render_heading(block)}\n\n"
 
     @staticmethod
     def convert_heading_2(block: Dict[str, Any]) -> str:
         """見出し2を変換"""
-        text = "".join(
-            span.get("plain_text", "")
-            for span in block["heading_2"]["rich_text"]
-        )
-        return f"## {text}\n\n"
+        return f"## {render_heading(block)}\n\n"
 
     @staticmethod
     def convert_heading_3(block: Dict[str, Any]) -> str:
         """見出し3を変換"""
-        text = "".join(
-            span.get("plain_text", "")
-            for span in block["heading_3"]["rich_text"]
-        )
-        return f"### {text}\n\n"
+        return f"### {render_heading(block)}\n\n"
 
     @staticmethod
     def convert_bulleted_list_item(block: Dict[str, Any]) -> str:
         """箇条書きリストを変換"""
-        text = "".join(
-            span.get("plain_text", "")
-            for span in block["bulleted_list_item"]["rich_text"]
-        )
-        return f"- {text}\n"
+        return f"- {render_text_block(block, CHILD_INDENT['bulleted_list_item'])}\n"
 
     @staticmethod
     def convert_numbered_list_item(block: Dict[str, Any]) -> str:
         """番号付きリストを変換"""
-        text = "".join(
-            span.get("plain_text", "")
-            for span in block["numbered_list_item"]["rich_text"]
-        )
-        return f"1. {text}\n"
+        return f"1. {render_text_block(block, CHILD_INDENT['numbered_list_item'])}\n"
+
+    @staticmethod
+    def convert_to_do(block: Dict[str, Any]) -> str:
+        """チェックボックスを変換"""
+        mark = "x" if block["to_do"].get("checked") else " "
+        return f"- [{mark}] {render_text_block(block, CHILD_INDENT['to_do'])}\n"
+
+    @staticmethod
+    def convert_quote(block: Dict[str, Any]) -> str:
+        """引用を変換"""
+        text = render_text_block(block)
+        return "".join(f"> {line}\n" for line in text.split("\n")) + "\n"
+
+    @staticmethod
+    def convert_divider(block: Dict[str, Any]) -> str:
+        """区切り線を変換"""
+        return "---\n\n"
 
     @staticmethod
     def convert_code(block: Dict[str, Any]) -> str:
-        """コードブロックを変換"""
-        text = "".join(
-            span.get("plain_text", "")
-            for span in block["code"]["rich_text"]
-        )
+        """コードブロックを変換（書式は付けない）"""
+        text = "".join(plain_text(span) for span in block["code"]["rich_text"])
         language = block["code"]["language"]
         return f"```{language}\n{text}\n```\n\n"
 
     @staticmethod
     def convert_image(block: Dict[str, Any]) -> str:
-        """画像ブロックを変換"""
-        caption = "".join(
-            span.get("plain_text", "")
-            for span in block["image"]["caption"]
-        )
-        url = block["image"]["file"]["url"]
+        """画像ブロックを変換（キャッシュ済みならローカルのパスを使う）"""
+        image = block["image"]
+        caption = render_rich_text(image.get("caption", []))
+        url = image.get("local_path") or image[image["type"]]["url"]
         return f"![{caption}]({url})\n\n"
 
+    @staticmethod
+    def convert_file(block: Dict[str, Any]) -> str:
+        """添付ファイルを変換
+
+        キャッシュ済みのファイルだけをローカルへのリンクとして残す。
+        Markdownから戻す際、ローカルへのリンクだけの行は無視される。
+        """
+        block_type = block["type"]
+        content = block[block_type]
+        path = content.get("local_path")
+        if not path:
+            return ""
+        name = content.get("name")
+        if name:
+            name = escape_inline(name)
+        else:
+            name = render_rich_text(content.get("caption", []))
+        if not name:
+            name = escape_inline(posixpath.basename(urlsplit(content[content["type"]]["url"]).path))
+        return f"[{name}]({path})\n\n"
+
+    convert_pdf = convert_file
+    convert_video = convert_file
+    convert_audio = convert_file
+
+    @staticmethod
+    def convert_table(block: Dict[str, Any]) -> str:
+        """表を変換（行は子ブロックとして続く）"""
+        return ""
+
+    @staticmethod
+    def convert_table_row(block: Dict[str, Any]) -> str:
+        """表の行を変換"""
+        cells = (
+            render_rich_text(cell).replace("|", "\\|").replace("\n", " ")
+            for cell in block["table_row"]["cells"]
+        )
+        return "| " + " | ".join(cells) + " |\n"
+
     @staticmethod
     def convert_child_page(block: Dict[str, Any]) -> str:
-        """子ページブロックを変換"""
+        """子ページブロックを変換
+
+        子ページは別ファイルとして同期するため、Markdownから
+        Notionへ戻す際に無視されるコメントとして残す。
+        """
         title = block["child_page"]["title"]
-        return f"## {title}\n\n"
+        return f"<!-- child_page: {title} -->\n\n"
+
+    @staticmethod
+    def iter_markdown(blocks: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """ブロックを順に変換し、Markdownの断片を返す"""
+        renderer = MarkdownRenderer()
+        for block in blocks:
+            yield renderer.render(block)
+        yield renderer.close()
+
+    @staticmethod
+    async def stream_markdown(blocks: AsyncIterable[Dict[str, Any]]) -> AsyncIterator[str]:
+        """ブロックのストリームを逐次Markdownに変換
+
+        ページ全体を保持せず、届いたブロックから順に変換する。
+        """
+        renderer = MarkdownRenderer()
+        async for block in blocks:
+            yield renderer.render(block)
+        yield renderer.close()
+
+    @staticmethod
+    def write_markdown(blocks: Iterable[Dict[str, Any]], file: TextIO) -> None:
+        """ブロックを変換しながらファイルに書き出す"""
+        for chunk in BlockConverter.iter_markdown(blocks):
+            if chunk:
+                file.write(chunk)
+
+    @staticmethod
+    async def stream_to_file(blocks: AsyncIterable[Dict[str, Any]], file: TextIO) -> None:
+        """ブロックのストリームを変換しながらファイルに書き出す"""
+        async for chunk in BlockConverter.stream_markdown(blocks):
+            if chunk:
+                file.write(chunk)
 
     @staticmethod
-    def blocks_to_markdown(blocks: List[Dict[str, Any]]) -> str:
+    def blocks_to_markdown(blocks: Iterable[Dict[str, Any]]) -> str:
         """複数のブロックをMarkdownに変換"""
-        return "".join(BlockConverter.to_markdown(block) for block in blocks) 
\ No newline at end of file
+        return "".join(BlockConverter.iter_markdown(blocks))
+
+
+BlockConverter.CONVERTERS = {
+    name[len("convert_"):]: getattr(BlockConverter, name)
+    for name in vars(BlockConverter)
+    if name.startswith("convert_")
+}
+
+
+class MarkdownRenderer:
+    """文書順に並んだブロック（"depth"付き）を入れ子を考慮して変換する
+
+    祖先ブロックごとの字下げや表の行数を保持する。変換できない
+    ブロックの子孫は、Markdownから戻した際に別のブロックとして
+    重複しないよう出力しない。
+    """
+
+    def __init__(self):
+        # 祖先ブロックごとの [字下げ, 種類, 子の数, 出力するか]
+        self.frames: List[List[Any]] = []
+        # 直前に出力したブロックの (種類, 深さ)
+        self.previous: Optional[tuple] = None
+
+    def render(self, block: Dict[str, Any]) -> str:
+        depth = block.get("depth", 0)
+        prefix = self.pop_to(depth)
+
+        parent = self.frames[-1] if self.frames else None
+        indent = parent[0] if parent else ""
+        block_type = block.get("type")
+        converter = BlockConverter.CONVERTERS.get(block_type)
+        visible = converter is not None and (parent is None or parent[3])
+        self.frames.append([indent + CHILD_INDENT.get(block_type, ""), block_type, 0, visible])
+        if not visible:
+            return prefix
+
+        # リストの直後に別のブロックが続く場合は空行で区切る
+        if (
+            self.previous is not None
+            and self.previous[0] in LIST_TYPES
+            and block_type not in LIST_TYPES
+            and depth <= self.previous[1]
+        ):
+            prefix += "\n"
+        self.previous = (block_type, depth)
+
+        markdown = converter(block)
+        if parent is not None:
+            parent[2] += 1
+            if parent[1] == "table" and parent[2] == 1 and block_type == "table_row":
+                width = len(block["table_row"]["cells"])
+                markdown += "|" + " --- |" * width + "\n"
+        if indent:
+            markdown = "".join(
+                indent + line if line.strip() else line
+                for line in markdown.splitlines(keepends=True)
+            )
+        return prefix + markdown
+
+    def pop_to(self, depth: int) -> str:
+        """depthより深い祖先を閉じ、閉じた表の後に空行を返す"""
+        suffix = ""
+        while len(self.frames) > depth:
+            frame = self.frames.pop()
+            if frame[1] == "table" and frame[3]:
+                suffix += "\n"
+        return suffix
+
+    def close(self) -> str:
+        """入力の終わりで開いている表を閉じる"""
+        return self.pop_to(0)
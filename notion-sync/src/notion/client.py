@@ -1,65 +1,202 @@
-from typing import List, Dict, Any, Optional
-from notion_client import Client
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Iterator, Optional, AsyncIterator, Union
+import httpx
+from notion_client import Client, AsyncClient
 from rich.console import Console
 
+from .diff import APPEND_LIMIT, BlockDiff, diff_blocks, nest_blocks, update_payload
+from .ratelimit import RateLimiter, shared_rate_limiter
+from ..utils.metrics import Metrics
+
 console = Console()
 
+# Notion APIのURL（ローカルのスタンドインに向ける場合に変更する）
+DEFAULT_BASE_URL = "https://api.notion.com"
+# 同時リクエスト数のデフォルト値
+DEFAULT_CONCURRENCY = 8
+# 子ブロックを展開する入れ子の深さのデフォルト値
+DEFAULT_BLOCK_DEPTH = 8
+# blocks.children.listの1回あたりの最大件数
+PAGE_SIZE = 100
+
+# 子ブロックを持っていても別ページとして扱うため展開しないブロック
+NON_EXPANDABLE_TYPES = {"child_page", "child_database"}
+
+
+def is_expandable(block: Dict[str, Any]) -> bool:
+    """子ブロックを展開すべきブロックか"""
+    return block.get("has_children", False) and block.get("type") not in NON_EXPANDABLE_TYPES
+
+
+def database_query(
+    query_filter: Optional[Dict[str, Any]] = None,
+    sorts: Optional[List[Dict[str, Any]]] = None,
+    filter_properties: Optional[Iterable[str]] = None,
+    edited_after: Union[str, datetime, None] = None,
+    page_size: int = PAGE_SIZE,
+) -> Dict[str, Any]:
+    """databases.queryの引数を組み立てる
+
+    edited_afterを指定すると、その日時より後に編集されたページだけを
+    サーバー側で絞り込む（query_filterとはandで組み合わせる）。
+    filter_propertiesには返すプロパティのIDを指定する。
+    """
+    filters = []
+    if edited_after is not None:
+        if isinstance(edited_after, datetime):
+            edited_after = edited_after.isoformat()
+        filters.append({"timestamp": "last_edited_time", "last_edited_time": {"after": edited_after}})
+    if query_filter:
+        filters.append(query_filter)
+
+    kwargs: Dict[str, Any] = {"page_size": min(page_size, PAGE_SIZE)}
+    if len(filters) == 1:
+        kwargs["filter"] = filters[0]
+    elif filters:
+        kwargs["filter"] = {"and": filters}
+    if sorts:
+        kwargs["sorts"] = sorts
+    if filter_properties is not None:
+        kwargs["filter_properties"] = list(filter_properties)
+    return kwargs
+
 class NotionClient:
-    def __init__(self, token: str):
-        self.client = Client(auth=token)
+    def __init__(
+        self,
+        token: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        base_url: str = DEFAULT_BASE_URL,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.limiter = rate_limiter or shared_rate_limiter()
+        self.http = None
+        if metrics is not None:
+            # エンドポイントごとの呼び出し数・レイテンシ・応答サイズを記録する
+            self.http = httpx.Client(event_hooks=metrics.httpx_event_hooks("notion", asynchronous=False))
+            metrics.track_rate_limiter("notion", self.limiter)
+        self.client = Client(auth=token, client=self.http, base_url=base_url)
 
     def get_page(self, page_id: str) -> Dict[str, Any]:
         """ページの情報を取得"""
         try:
-            return self.client.pages.retrieve(page_id=page_id)
+            return self.limiter.call(self.client.pages.retrieve, page_id=page_id)
         except Exception as e:
             console.error(f"ページの取得に失敗しました: {page_id}")
             console.error(e)
             raise
 
     def get_page_blocks(self, page_id: str) -> List[Dict[str, Any]]:
-        """ページのブロックを取得"""
+        """ページの直下のブロックを取得（next_cursorを最後まで辿る）"""
         try:
-            blocks = self.client.blocks.children.list(block_id=page_id)
-            return blocks["results"]
+            results = []
+            cursor = None
+            while True:
+                kwargs = {"block_id": page_id, "page_size": PAGE_SIZE}
+                if cursor:
+                    kwargs["start_cursor"] = cursor
+                response = self.limiter.call(self.client.blocks.children.list, **kwargs)
+                results.extend(response["results"])
+                if not response.get("has_more"):
+                    return results
+                cursor = response["next_cursor"]
         except Exception as e:
             console.error(f"ブロックの取得に失敗しました: {page_id}")
             console.error(e)
             raise
 
-    def update_page(self, page_id: str, blocks: List[Dict[str, Any]]) -> None:
-        """ページのブロックを更新"""
+    def update_page(self, page_id: str, blocks: List[Dict[str, Any]]) -> BlockDiff:
+        """ページのブロックを差分更新
+
+        直下のブロックだけを比較するため、子ブロックを持つ既存ブロックは
+        常に置き換える。削除・更新・挿入の順に適用する。
+        """
         try:
-            # 既存のブロックを削除
-            existing_blocks = self.get_page_blocks(page_id)
-            for block in existing_blocks:
-                self.client.blocks.delete(block_id=block["id"])
-
-            # 新しいブロックを追加
-            if blocks:
-                self.client.blocks.children.append(
-                    block_id=page_id,
-                    children=blocks
-                )
+            diff = diff_blocks(self.get_page_blocks(page_id), blocks)
+            for block_id in diff.deletes:
+                self.limiter.call(self.client.blocks.delete, block_id=block_id)
+            for block_id, block in diff.updates:
+                self.limiter.call(self.client.blocks.update, block_id=block_id, **update_payload(block))
+            for after, children in diff.inserts:
+                self.append_blocks(page_id, children, after)
+            return diff
         except Exception as e:
             console.error(f"ページの更新に失敗しました: {page_id}")
             console.error(e)
             raise
 
-    def get_database_pages(self, database_id: str) -> List[Dict[str, Any]]:
-        """データベースのページを取得"""
+    def append_blocks(
+        self,
+        block_id: str,
+        children: List[Dict[str, Any]],
+        after: Optional[str] = None,
+    ) -> None:
+        """ブロックを追加（afterを指定した場合はその直後に挿入）"""
+        for start in range(0, len(children), APPEND_LIMIT):
+            kwargs = {"block_id": block_id, "children": children[start:start + APPEND_LIMIT]}
+            if after:
+                kwargs["after"] = after
+            response = self.limiter.call(
+                self.client.blocks.children.append, idempotent=False, **kwargs
+            )
+            if after:
+                after = response["results"][-1]["id"]
+
+    def query_database(
+        self,
+        database_id: str,
+        kwargs: Dict[str, Any],
+        cursor: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """databases.queryを1ページ分呼び出す"""
+        if cursor:
+            kwargs = dict(kwargs, start_cursor=cursor)
+        return self.limiter.call(self.client.databases.query, database_id=database_id, **kwargs)
+
+    def get_database_pages(
+        self,
+        database_id: str,
+        query_filter: Optional[Dict[str, Any]] = None,
+        sorts: Optional[List[Dict[str, Any]]] = None,
+        filter_properties: Optional[Iterable[str]] = None,
+        edited_after: Union[str, datetime, None] = None,
+        page_size: int = PAGE_SIZE,
+    ) -> Iterator[Dict[str, Any]]:
+        """データベースのページを逐次取得
+
+        next_cursorを最後まで辿り、呼び出し側が現在のページを処理している
+        間に次のページを別スレッドで先読みする。絞り込み・並び順・返す
+        プロパティはdatabase_queryを参照。
+        """
+        kwargs = database_query(query_filter, sorts, filter_properties, edited_after, page_size)
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.query_database, database_id, kwargs)
         try:
-            response = self.client.databases.query(database_id=database_id)
-            return response["results"]
+            while future is not None:
+                response = future.result()
+                future = None
+                if response.get("has_more"):
+                    future = executor.submit(
+                        self.query_database, database_id, kwargs, response["next_cursor"]
+                    )
+                yield from response["results"]
         except Exception as e:
-            console.error(f"データベースの取得に失敗しました: {database_id}")
-            console.error(e)
+            console.print(f"[bold red]データベースの取得に失敗しました: {database_id}[/]")
+            console.print(e)
             raise
+        finally:
+            # 途中で打ち切られた場合は先読みを止める
+            if future is not None:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def create_page(self, database_id: str, properties: Dict[str, Any]) -> Dict[str, Any]:
         """新しいページを作成"""
         try:
-            return self.client.pages.create(
+            return self.limiter.call(
+                self.client.pages.create,
+                idempotent=False,
                 parent={"database_id": database_id},
                 properties=properties
             )
@@ -71,11 +208,334 @@ class NotionClient:
     def delete_page(self, page_id: str) -> None:
         """ページを削除（アーカイブ）"""
         try:
-            self.client.pages.update(
+            self.limiter.call(
+                self.client.pages.update,
                 page_id=page_id,
                 archived=True
             )
         except Exception as e:
             console.error(f"ページの削除に失敗しました: {page_id}")
             console.error(e)
-            raise 
\ No newline at end of file
+            raise
+
+
+class AsyncNotionClient:
+    """非同期版のNotionクライアント
+
+    keep-aliveのコネクションプールを1つ共有し、同時リクエスト数を
+    セマフォで、リクエスト頻度をRateLimiterで制限する。
+    """
+
+    def __init__(
+        self,
+        token: str,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_depth: int = DEFAULT_BLOCK_DEPTH,
+        base_url: str = DEFAULT_BASE_URL,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.limiter = rate_limiter or shared_rate_limiter()
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_depth = max_depth
+        event_hooks = {}
+        if metrics is not None:
+            # エンドポイントごとの呼び出し数・レイテンシ・応答サイズを記録する
+            event_hooks = metrics.httpx_event_hooks("notion")
+            metrics.track_rate_limiter("notion", self.limiter)
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+            event_hooks=event_hooks,
+        )
+        self.client = AsyncClient(auth=token, client=self.http, base_url=base_url)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def __aenter__(self) -> "AsyncNotionClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """コネクションプールを閉じる"""
+        await self.http.aclose()
+
+    async def request(self, endpoint, idempotent: bool = True, **kwargs) -> Any:
+        """同時実行数とレート制限の範囲内でAPIを呼び出す
+
+        作成・追加のように再送すると重複する呼び出しはidempotent=Falseにする。
+        """
+        async with self.semaphore:
+            return await self.limiter.acall(endpoint, idempotent=idempotent, **kwargs)
+
+    async def get_page(self, page_id: str) -> Dict[str, Any]:
+        """ページの情報を取得"""
+        try:
+            return await self.request(self.client.pages.retrieve, page_id=page_id)
+        except Exception as e:
+            console.print(f"[bold red]ページの取得に失敗しました: {page_id}[/]")
+            console.print(e)
+            raise
+
+    async def get_block(self, block_id: str) -> Dict[str, Any]:
+        """ブロックの情報を取得"""
+        return await self.request(self.client.blocks.retrieve, block_id=block_id)
+
+    async def search_pages(self, direction: str = "descending") -> AsyncIterator[Dict[str, Any]]:
+        """インテグレーションに共有されている全ページをsearchで逐次取得
+
+        last_edited_timeの順（既定は新しい順）に並べ、next_cursorを
+        最後まで辿る。次のページは呼び出し側の処理中に先読みする。
+        """
+        kwargs = {
+            "filter": {"property": "object", "value": "page"},
+            "sort": {"timestamp": "last_edited_time", "direction": direction},
+            "page_size": PAGE_SIZE,
+        }
+
+        async def search(cursor: Optional[str] = None) -> Dict[str, Any]:
+            if cursor:
+                return await self.request(self.client.search, start_cursor=cursor, **kwargs)
+            return await self.request(self.client.search, **kwargs)
+
+        next_page: Optional[asyncio.Future] = asyncio.ensure_future(search())
+        try:
+            while next_page is not None:
+                response = await next_page
+                next_page = None
+                if response.get("has_more"):
+                    next_page = asyncio.ensure_future(search(response["next_cursor"]))
+                for page in response["results"]:
+                    yield page
+        except Exception as e:
+            console.print("[bold red]ページの検索に失敗しました[/]")
+            console.print(e)
+            raise
+        finally:
+            # 途中で打ち切られた場合は先読みを止める
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+            elif next_page is not None and not next_page.cancelled():
+                next_page.exception()
+
+    async def list_block_children(self, block_id: str, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """blocks.children.listを1ページ分呼び出す"""
+        kwargs = {"block_id": block_id, "page_size": PAGE_SIZE}
+        if cursor:
+            kwargs["start_cursor"] = cursor
+        return await self.request(self.client.blocks.children.list, **kwargs)
+
+    async def get_page_blocks(
+        self,
+        page_id: str,
+        max_depth: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ページのブロックを文書順に逐次取得
+
+        next_cursorを辿り、has_childrenのブロックはmax_depthの深さまで
+        展開する。各ブロックには入れ子の深さを"depth"として付与する。
+        """
+        if max_depth is None:
+            max_depth = self.max_depth
+        try:
+            async for block in self.iter_block_children(page_id, 0, max_depth):
+                yield block
+        except Exception as e:
+            console.print(f"[bold red]ブロックの取得に失敗しました: {page_id}[/]")
+            console.print(e)
+            raise
+
+    async def iter_block_children(
+        self,
+        block_id: str,
+        depth: int,
+        max_depth: int,
+        first_page: Optional[asyncio.Future] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """子ブロックを逐次取得する
+
+        次のページと、先の兄弟ブロックの子ブロック（最大max_concurrency件）を
+        先読みしておき、呼び出し側が現在のブロックを処理している間に
+        取得を進める。
+        """
+        pending = set()
+        try:
+            if first_page is None:
+                first_page = asyncio.ensure_future(self.list_block_children(block_id))
+            pending.add(first_page)
+            response = await first_page
+            while True:
+                next_page = None
+                if response.get("has_more"):
+                    next_page = asyncio.ensure_future(
+                        self.list_block_children(block_id, response["next_cursor"])
+                    )
+                    pending.add(next_page)
+
+                results = response["results"]
+                expandable = (
+                    [block["id"] for block in results if is_expandable(block)]
+                    if depth < max_depth else []
+                )
+                prefetched: Dict[str, asyncio.Future] = {}
+
+                def prefetch_ahead():
+                    while expandable and len(prefetched) < self.max_concurrency:
+                        child_id = expandable.pop(0)
+                        task = asyncio.ensure_future(self.list_block_children(child_id))
+                        prefetched[child_id] = task
+                        pending.add(task)
+
+                prefetch_ahead()
+                for block in results:
+                    block["depth"] = depth
+                    yield block
+                    task = prefetched.pop(block["id"], None)
+                    if task is not None:
+                        prefetch_ahead()
+                        async for child in self.iter_block_children(
+                            block["id"], depth + 1, max_depth, task
+                        ):
+                            yield child
+                        pending.discard(task)
+
+                if next_page is None:
+                    return
+                response = await next_page
+                pending.discard(next_page)
+        finally:
+            # 途中で打ち切られた場合は先読み中の取得を止める
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    async def update_page(self, page_id: str, blocks: List[Dict[str, Any]]) -> BlockDiff:
+        """ページのブロックを差分更新
+
+        既存のブロックを子ブロックまで取得して比較し、変わった部分だけを
+        削除・更新・挿入する。同じ親への書き込みを並行させると409になったり、
+        同じブロックを基準にした挿入の順序が定まらなかったりするため、
+        削除・更新・挿入の順に1件ずつ適用する。
+        """
+        try:
+            existing = nest_blocks([block async for block in self.get_page_blocks(page_id)])
+            diff = diff_blocks(existing, blocks)
+            await self.apply_diff(page_id, diff)
+            return diff
+        except Exception as e:
+            console.print(f"[bold red]ページの更新に失敗しました: {page_id}[/]")
+            console.print(e)
+            raise
+
+    async def apply_diff(self, page_id: str, diff: BlockDiff) -> None:
+        """差分を削除・更新・挿入（文書順）の順に適用"""
+        for block_id in diff.deletes:
+            await self.request(self.client.blocks.delete, block_id=block_id)
+        for block_id, block in diff.updates:
+            await self.request(self.client.blocks.update, block_id=block_id, **update_payload(block))
+        for after, children in diff.inserts:
+            await self.append_blocks(page_id, children, after)
+
+    async def append_blocks(
+        self,
+        block_id: str,
+        children: List[Dict[str, Any]],
+        after: Optional[str] = None,
+    ) -> None:
+        """ブロックを追加（afterを指定した場合はその直後に挿入）"""
+        for start in range(0, len(children), APPEND_LIMIT):
+            kwargs = {"block_id": block_id, "children": children[start:start + APPEND_LIMIT]}
+            if after:
+                kwargs["after"] = after
+            response = await self.request(
+                self.client.blocks.children.append, idempotent=False, **kwargs
+            )
+            if after:
+                after = response["results"][-1]["id"]
+
+    async def update_page_title(self, page_id: str, title: str) -> Dict[str, Any]:
+        """ページのタイトルを変更"""
+        return await self.request(
+            self.client.pages.update,
+            page_id=page_id,
+            properties={"title": {"title": [{"type": "text", "text": {"content": title}}]}},
+        )
+
+    async def query_database(
+        self,
+        database_id: str,
+        kwargs: Dict[str, Any],
+        cursor: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """databases.queryを1ページ分呼び出す"""
+        if cursor:
+            kwargs = dict(kwargs, start_cursor=cursor)
+        return await self.request(self.client.databases.query, database_id=database_id, **kwargs)
+
+    async def get_database_pages(
+        self,
+        database_id: str,
+        query_filter: Optional[Dict[str, Any]] = None,
+        sorts: Optional[List[Dict[str, Any]]] = None,
+        filter_properties: Optional[Iterable[str]] = None,
+        edited_after: Union[str, datetime, None] = None,
+        page_size: int = PAGE_SIZE,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """データベースのページを逐次取得
+
+        next_cursorを最後まで辿り、呼び出し側が現在のページを処理している
+        間に次のページを先読みする。絞り込み・並び順・返すプロパティは
+        database_queryを参照。
+        """
+        kwargs = database_query(query_filter, sorts, filter_properties, edited_after, page_size)
+        next_page: Optional[asyncio.Future] = asyncio.ensure_future(
+            self.query_database(database_id, kwargs)
+        )
+        try:
+            while next_page is not None:
+                response = await next_page
+                next_page = None
+                if response.get("has_more"):
+                    next_page = asyncio.ensure_future(
+                        self.query_database(database_id, kwargs, response["next_cursor"])
+                    )
+                for page in response["results"]:
+                    yield page
+        except Exception as e:
+            console.print(f"[bold red]データベースの取得に失敗しました: {database_id}[/]")
+            console.print(e)
+            raise
+        finally:
+            # 途中で打ち切られた場合は先読みを止める
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+            elif next_page is not None and not next_page.cancelled():
+                next_page.exception()
+
+    async def create_page(self, database_id: str, properties: Dict[str, Any]) -> Dict[str, Any]:
+        """新しいページを作成"""
+        try:
+            return await self.request(
+                self.client.pages.create,
+                idempotent=False,
+                parent={"database_id": database_id},
+                properties=properties
+            )
+        except Exception as e:
+            console.print(f"[bold red]ページの作成に失敗しました: {database_id}[/]")
+            console.print(e)
+            raise
+
+    async def delete_page(self, page_id: str) -> None:
+        """ページを削除（アーカイブ）"""
+        try:
+            await self.request(self.client.pages.update, page_id=page_id, archived=True)
+        except Exception as e:
+            console.print(f"[bold red]ページの削除に失敗しました: {page_id}[/]")
+            console.print(e)
+            raise
@@ -0,0 +1,229 @@
+"""
+ブロック単位の差分更新
+
+既存のブロック列と更新後のブロック列を正規化した内容で突き合わせ
+（difflib.SequenceMatcher）、必要最小限の更新・挿入（after指定）・
+削除の操作を組み立てる。
+"""
+import difflib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# blocks.children.appendで一度に追加できるブロック数
+APPEND_LIMIT = 100
+
+# Markdownから生成できる＝同期で管理するブロックの種類
+MANAGED_TYPES = {
+    "paragraph",
+    "heading_1",
+    "heading_2",
+    "heading_3",
+    "bulleted_list_item",
+    "numbered_list_item",
+    "to_do",
+    "quote",
+    "code",
+    "image",
+    "divider",
+    "table",
+}
+
+
+def is_managed(block: Dict[str, Any]) -> bool:
+    """差分の対象にするブロックか
+
+    子ページやMarkdownで表現できないブロック、Notionにアップロードされた
+    画像、空の段落（Markdownでは空行になり戻せない）は更新・削除しない。
+    """
+    block_type = block.get("type")
+    if block_type not in MANAGED_TYPES:
+        return False
+    if block_type == "image" and block["image"].get("type") == "file":
+        return False
+    if block_type == "paragraph" and not block.get("has_children") and not any(
+        (span.get("text") or {}).get("content", span.get("plain_text"))
+        for span in block["paragraph"].get("rich_text", [])
+    ):
+        return False
+    return True
+
+
+def _rich_text_key(rich_text: List[Dict[str, Any]]) -> List[List[Any]]:
+    """rich_textを書式ごとにまとめた比較用の値に変換"""
+    spans: List[List[Any]] = []
+    for span in rich_text:
+        text = span.get("text") or {}
+        content = text.get("content", span.get("plain_text", ""))
+        link = (text.get("link") or {}).get("url") or span.get("href")
+        annotations = span.get("annotations") or {}
+        style = [
+            sorted(k for k, v in annotations.items() if v is True),
+            annotations.get("color", "default"),
+            link,
+        ]
+        if spans and spans[-1][1] == style:
+            spans[-1][0] += content
+        else:
+            spans.append([content, style])
+    return spans
+
+
+def block_key(block: Dict[str, Any]) -> str:
+    """ブロックの内容を比較用の文字列に正規化
+
+    APIから取得したブロックと、これから作成するブロックの
+    表現の違い（既定値の有無、書式の分割など）を吸収する。
+    """
+    block_type = block["type"]
+    payload = block.get(block_type) or {}
+    data = {}
+    for key, value in payload.items():
+        if key == "children" or value in (None, False, [], "default"):
+            continue
+        if key in ("rich_text", "caption"):
+            value = _rich_text_key(value)
+        elif key == "cells":
+            value = [_rich_text_key(cell) for cell in value]
+        data[key] = value
+
+    children = payload.get("children")
+    if children is not None:
+        children_key: Any = [block_key(child) for child in children]
+    elif block.get("has_children"):
+        # 子ブロックを取得していないため内容を比較できない
+        children_key = block["id"]
+    else:
+        children_key = []
+    return json.dumps([block_type, data, children_key], sort_keys=True, ensure_ascii=False)
+
+
+def nest_blocks(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """"depth"付きで文書順に並んだブロックを入れ子の構造に組み立てる
+
+    子ブロックは親ブロックの種類別の値の"children"に格納する。
+    """
+    roots: List[Dict[str, Any]] = []
+    stack: List[Dict[str, Any]] = []
+    for block in blocks:
+        depth = block.get("depth", 0)
+        del stack[depth:]
+        if stack:
+            parent = stack[-1]
+            parent[parent["type"]].setdefault("children", []).append(block)
+        else:
+            roots.append(block)
+        stack.append(block)
+    return roots
+
+
+def update_payload(block: Dict[str, Any]) -> Dict[str, Any]:
+    """blocks.updateに渡す値（子ブロックを除いた種類別の値）"""
+    block_type = block["type"]
+    return {
+        block_type: {
+            key: value for key, value in block[block_type].items() if key != "children"
+        }
+    }
+
+
+def _updatable(old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    """既存ブロックをその場で書き換えられるか（子ブロックは書き換えられない）"""
+    return (
+        old["type"] == new["type"]
+        and old["type"] != "table"
+        and not old.get("has_children")
+        and not new[new["type"]].get("children")
+    )
+
+
+@dataclass
+class BlockDiff:
+    """差分更新の操作"""
+    updates: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)
+    inserts: List[Tuple[Optional[str], List[Dict[str, Any]]]] = field(default_factory=list)
+    deletes: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    # 先頭への挿入はafterで表現できないため管理対象を全て置き換える
+    full_rewrite: bool = False
+    rewrite_calls: int = 0
+
+    @property
+    def api_calls(self) -> int:
+        """差分の適用に必要な書き込みAPIの呼び出し回数"""
+        appends = sum(
+            -(-len(blocks) // APPEND_LIMIT) for _, blocks in self.inserts
+        )
+        return len(self.updates) + len(self.deletes) + appends
+
+    @property
+    def saved_calls(self) -> int:
+        """全削除・全追加と比べて削減できた呼び出し回数"""
+        return self.rewrite_calls - self.api_calls
+
+    def summary(self) -> str:
+        return (
+            f"更新 {len(self.updates)} / "
+            f"追加 {sum(len(blocks) for _, blocks in self.inserts)} / "
+            f"削除 {len(self.deletes)} / "
+            f"変更なし {self.unchanged} "
+            f"(API {self.api_calls}回、全置換より {self.saved_calls}回削減)"
+        )
+
+
+def diff_blocks(existing: List[Dict[str, Any]], desired: List[Dict[str, Any]]) -> BlockDiff:
+    """既存のブロック（最上位）を更新後のブロックに揃える操作を求める"""
+    managed = [block for block in existing if is_managed(block)]
+    diff = BlockDiff(
+        rewrite_calls=len(managed) + -(-len(desired) // APPEND_LIMIT)
+    )
+
+    # 管理対象の直前にあるブロック（子ページなど）を挿入位置の基準にする
+    anchor: Optional[str] = None
+    if managed:
+        first_index = next(i for i, block in enumerate(existing) if block is managed[0])
+        if first_index > 0:
+            anchor = existing[first_index - 1]["id"]
+    elif existing:
+        anchor = existing[-1]["id"]
+
+    def insert(block: Dict[str, Any]):
+        if diff.inserts and diff.inserts[-1][0] == anchor:
+            diff.inserts[-1][1].append(block)
+        else:
+            diff.inserts.append((anchor, [block]))
+
+    matcher = difflib.SequenceMatcher(
+        None,
+        [block_key(block) for block in managed],
+        [block_key(block) for block in desired],
+        autojunk=False,
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            diff.unchanged += i2 - i1
+            anchor = managed[i2 - 1]["id"]
+            continue
+
+        old_blocks = managed[i1:i2]
+        new_blocks = desired[j1:j2]
+        for index in range(max(len(old_blocks), len(new_blocks))):
+            old = old_blocks[index] if index < len(old_blocks) else None
+            new = new_blocks[index] if index < len(new_blocks) else None
+            if old is not None and new is not None and _updatable(old, new):
+                diff.updates.append((old["id"], new))
+                anchor = old["id"]
+                continue
+            if old is not None:
+                diff.deletes.append(old["id"])
+            if new is not None:
+                insert(new)
+
+    if existing and any(after is None for after, _ in diff.inserts):
+        diff = BlockDiff(
+            inserts=[(None, list(desired))] if desired else [],
+            deletes=[block["id"] for block in managed],
+            full_rewrite=True,
+            rewrite_calls=diff.rewrite_calls,
+        )
+    return diff
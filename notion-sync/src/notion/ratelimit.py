@@ -0,0 +1,358 @@
+"""
+Notion APIのレート制限
+
+トークンバケットで平均リクエスト数をNotionの上限（約3回/秒）に揃え、
+429のRetry-After、5xx・通信エラーのジッター付き指数バックオフ、
+連続失敗時のサーキットブレーカーをまとめて扱う。
+ページの作成とブロックの追加（idempotent=False）は、送信済みの
+リクエストが反映されている可能性があるため、429と接続の失敗
+（リクエストを送る前の失敗）でだけ再試行する。
+1つのインスタンスを同期（requests / notion_client.Client）と
+非同期（notion_client.AsyncClient）の両方の呼び出し経路で共有できる。
+"""
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from notion_client.errors import RequestTimeoutError
+
+# Notionの平均リクエスト上限（回/秒）
+DEFAULT_RATE = 3.0
+DEFAULT_BURST = 3
+
+# 再試行の対象とする通信系の例外（requestsの例外はOSErrorの派生）
+RETRYABLE_EXCEPTIONS = (OSError, httpx.TransportError, RequestTimeoutError)
+# 接続の確立中の失敗（リクエストはまだ送られていない）
+CONNECT_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, ConnectionRefusedError)
+# requestsは接続の失敗をurllib3のConnectTimeoutError（NewConnectionErrorの基底）で表す
+CONNECT_REASONS = ("ConnectTimeoutError", "NewConnectionError")
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出しを中止した"""
+
+
+@dataclass
+class RateLimitStats:
+    """レート制限の統計"""
+    requests: int = 0
+    throttled_seconds: float = 0.0  # トークン待ちの合計時間
+    backoff_seconds: float = 0.0  # 429/5xx後の待機の合計時間
+    rate_limited: int = 0  # 429の回数
+    server_errors: int = 0  # 5xx・通信エラーの回数
+    retries: int = 0
+    circuit_opens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def summary(self) -> str:
+        return (
+            f"requests={self.requests} "
+            f"throttled={self.throttled_seconds:.1f}s "
+            f"backoff={self.backoff_seconds:.1f}s "
+            f"429={self.rate_limited} "
+            f"5xx={self.server_errors} "
+            f"retries={self.retries} "
+            f"circuit_opens={self.circuit_opens}"
+        )
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット
+
+    reserve()はトークンを1つ先取りし、使えるようになるまでの秒数を返す。
+    待ち方（time.sleep / asyncio.sleep）は呼び出し側が決める。
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            if now > self.updated:
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+            self.tokens -= 1
+            ready_at = self.updated + max(0.0, -self.tokens) / self.rate
+            return max(0.0, ready_at - now)
+
+    def pause(self, seconds: float) -> None:
+        """指定秒数、全呼び出しのトークン補充を止める（429のRetry-After用）"""
+        with self.lock:
+            resume_at = time.monotonic() + seconds
+            if resume_at > self.updated:
+                self.tokens = min(self.tokens, 0.0)
+                self.updated = resume_at
+
+
+class CircuitBreaker:
+    """連続失敗でAPI呼び出しを一時停止するサーキットブレーカー"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def check(self) -> None:
+        """開いている間はCircuitOpenErrorを送出する"""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"Notion APIの失敗が続いたため呼び出しを停止中です（残り{remaining:.0f}秒）"
+                )
+            # 半開状態: 次の呼び出しを試行として通す
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self) -> bool:
+        """失敗を記録し、ブレーカーが開いた場合はTrueを返す"""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+def _response_status(result: Any = None, error: Optional[BaseException] = None) -> Optional[int]:
+    """レスポンスまたは例外からHTTPステータスを取り出す"""
+    if error is not None:
+        status = getattr(error, "status", None)
+        if status is None:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+        return status
+    return getattr(result, "status_code", None)
+
+
+def _response_headers(result: Any = None, error: Optional[BaseException] = None) -> Any:
+    if error is not None:
+        headers = getattr(error, "headers", None)
+        if headers is None:
+            headers = getattr(getattr(error, "response", None), "headers", None)
+        return headers or {}
+    return getattr(result, "headers", None) or {}
+
+
+def is_connect_error(error: Optional[BaseException]) -> bool:
+    """接続の確立中の失敗か（リクエストが送られていないため再送しても重複しない）"""
+    while error is not None:
+        if isinstance(error, CONNECT_EXCEPTIONS):
+            return True
+        # requests: ConnectionError(MaxRetryError(reason=NewConnectionError(...)))
+        for arg in getattr(error, "args", ()):
+            reason = getattr(arg, "reason", None)
+            if reason is not None and any(
+                cls.__name__ in CONNECT_REASONS for cls in type(reason).__mro__
+            ):
+                return True
+        # notion_clientはhttpxのタイムアウトをRequestTimeoutErrorに置き換える
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def is_idempotent(method: str, path: str) -> bool:
+    """同じ内容で再送しても結果が変わらない呼び出しか
+
+    Notion APIでは、ページの作成（POST /pages）とブロックの追加
+    （PATCH /blocks/{id}/children）だけが再送すると重複する。
+    """
+    method = method.upper()
+    path = path.split("?", 1)[0].rstrip("/")
+    if method == "POST" and path.endswith("/pages"):
+        return False
+    if method == "PATCH" and path.endswith("/children"):
+        return False
+    return True
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-Afterヘッダー（秒数またはHTTP日付）を秒数に変換"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    """Notion APIの全呼び出しに共通のレート制限・再試行レイヤー
+
+    call()は同期関数、acall()はコルーチン関数を受け取る。
+    再送すると重複する呼び出しにはidempotent=Falseを指定する。
+    戻り値がrequests.Responseのようにstatus_codeを持つ場合は
+    そのステータスで、例外の場合は例外のstatusで判定する。
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = RateLimitStats()
+        self.lock = threading.Lock()
+
+    def _count(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            setattr(self.stats, name, getattr(self.stats, name) + value)
+
+    def _before_call(self) -> float:
+        """ブレーカーを確認してトークンを予約し、待ち時間を返す"""
+        self.breaker.check()
+        wait = self.bucket.reserve()
+        self._count("requests")
+        if wait > 0:
+            self._count("throttled_seconds", wait)
+        return wait
+
+    def _backoff(self, attempt: int) -> float:
+        """ジッター付き指数バックオフ"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _retry_delay(
+        self,
+        attempt: int,
+        result: Any = None,
+        error: Optional[BaseException] = None,
+        idempotent: bool = True,
+    ) -> Optional[float]:
+        """再試行までの待ち時間を返す。再試行しない場合はNone"""
+        status = _response_status(result, error)
+        if status == 429:
+            self._count("rate_limited")
+            delay = parse_retry_after(_response_headers(result, error).get("Retry-After"))
+            if delay is None:
+                delay = self._backoff(attempt)
+            # 同じ上限を共有する他の呼び出しもまとめて待たせる
+            self.bucket.pause(delay)
+        elif (status is not None and status >= 500) or (
+            status is None and isinstance(error, RETRYABLE_EXCEPTIONS)
+        ):
+            self._count("server_errors")
+            if self.breaker.record_failure():
+                self._count("circuit_opens")
+                return None
+            if not idempotent and not is_connect_error(error):
+                # 作成・追加がサーバー側で反映済みかもしれないため再送しない
+                return None
+            delay = self._backoff(attempt)
+        else:
+            if status is not None or error is None:
+                self.breaker.record_success()
+            return None
+
+        if attempt >= self.max_retries:
+            return None
+        self._count("retries")
+        self._count("backoff_seconds", delay)
+        return delay
+
+    def call(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        idempotent: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        """同期関数をレート制限付きで呼び出す"""
+        attempt = 0
+        while True:
+            wait = self._before_call()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(attempt, error=e, idempotent=idempotent)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, result=result, idempotent=idempotent)
+                if delay is None:
+                    return result
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        idempotent: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        """コルーチン関数をレート制限付きで呼び出す"""
+        attempt = 0
+        while True:
+            wait = self._before_call()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(attempt, error=e, idempotent=idempotent)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, result=result, idempotent=idempotent)
+                if delay is None:
+                    return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_shared_limiter: Optional[RateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter(**kwargs: Any) -> RateLimiter:
+    """プロセス内で共有するRateLimiterを返す
+
+    最初の呼び出し時の引数で生成し、以降は同じインスタンスを返す。
+    """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter(**kwargs)
+        return _shared_limiter
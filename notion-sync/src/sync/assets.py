@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import posixpath
+import tempfile
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+from urllib.parse import quote, urlsplit, urlunsplit
+
+import httpx
+from rich.console import Console
+
+from .state import AssetState, SyncStateStore
+from ..utils.fs import CHUNK_SIZE, file_mode
+
+console = Console()
+
+# ファイルを持つブロックの種類
+ASSET_TYPES = {"image", "file", "pdf", "video", "audio"}
+
+DEFAULT_CONCURRENCY = 4
+DOWNLOAD_TIMEOUT = 60.0
+
+
+def asset_key(url: str) -> str:
+    """署名（クエリ文字列）を除いたURL
+
+    Notionにアップロードされたファイルの署名付きURLは取得のたびに
+    変わるが、パスはファイルごとに固定されている。
+    """
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+def hosted_file_url(block: Dict[str, Any]) -> Optional[str]:
+    """Notionにアップロードされたファイルの（期限付き）URL
+
+    外部URLのファイルは期限がなく、Markdownから戻す際にも外部の
+    画像として扱うため、キャッシュせずにそのまま残す。
+    """
+    block_type = block.get("type")
+    if block_type not in ASSET_TYPES:
+        return None
+    content = block.get(block_type) or {}
+    if content.get("type") != "file":
+        return None
+    return (content.get("file") or {}).get("url")
+
+
+class AssetCache:
+    """画像・添付ファイルをハッシュ名で保存するキャッシュ
+
+    ファイルはassets_dirに内容のSHA-256を名前として保存し、
+    ページをまたいで重複を除く。取得済みのURL（署名を除く）と
+    ETagを記録し、キャッシュにあるファイルは再取得しない。
+    """
+
+    def __init__(
+        self,
+        assets_dir: str,
+        state: SyncStateStore,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        self.assets_dir = assets_dir
+        self.state = state
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=DOWNLOAD_TIMEOUT,
+            limits=httpx.Limits(max_connections=concurrency),
+        )
+        # key -> 取得中のタスク（同じファイルを並行して取得しない）
+        self.fetching: Dict[str, asyncio.Task] = {}
+        self.downloaded = 0
+        self.downloaded_bytes = 0
+        self.cached = 0
+        self.failed = 0
+
+    def path_of(self, asset: AssetState) -> str:
+        return os.path.join(self.assets_dir, asset.file_name)
+
+    def cached_path(self, asset: Optional[AssetState]) -> Optional[str]:
+        if asset is not None and os.path.exists(self.path_of(asset)):
+            return self.path_of(asset)
+        return None
+
+    async def fetch(self, url: str) -> Optional[str]:
+        """ファイルをキャッシュに取り込み、保存先のパスを返す（失敗時はNone）"""
+        key = asset_key(url)
+        path = self.cached_path(self.state.get_asset(key))
+        if path is not None:
+            self.cached += 1
+            return path
+
+        task = self.fetching.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.download(url, key))
+            self.fetching[key] = task
+            task.add_done_callback(lambda _: self.fetching.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def download(self, url: str, key: str) -> Optional[str]:
+        """ハッシュを計算しながら一時ファイルに保存し、ハッシュ名に置き換える"""
+        os.makedirs(self.assets_dir, exist_ok=True)
+        tmp_path = None
+        try:
+            async with self.semaphore, self.client.stream("GET", url) as response:
+                response.raise_for_status()
+                etag = response.headers.get("ETag")
+                if etag:
+                    # 別のURLで取得済みの同じファイルなら本文を読まない
+                    known = self.state.find_asset_by_etag(etag)
+                    path = self.cached_path(known)
+                    if path is not None:
+                        self.state.save_asset(AssetState(key, known.content_hash, known.file_name, etag))
+                        self.cached += 1
+                        return path
+
+                fd, tmp_path = tempfile.mkstemp(dir=self.assets_dir, suffix=".part")
+                digest = hashlib.sha256()
+                size = 0
+                with os.fdopen(fd, "wb") as f:
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                extension = self.extension(url, response.headers.get("Content-Type"))
+
+            content_hash = digest.hexdigest()
+            asset = AssetState(key, content_hash, content_hash + extension, etag)
+            path = self.path_of(asset)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                self.cached += 1
+            else:
+                os.chmod(tmp_path, file_mode(path))
+                os.replace(tmp_path, path)
+                self.downloaded += 1
+                self.downloaded_bytes += size
+            tmp_path = None
+            self.state.save_asset(asset)
+            return path
+        except (httpx.HTTPError, OSError) as e:
+            self.failed += 1
+            console.print(f"[yellow]ファイルを取得できませんでした: {key}: {e}[/]")
+            return None
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def extension(url: str, content_type: Optional[str]) -> str:
+        """保存するファイルの拡張子（URLのパス、なければContent-Typeから）"""
+        extension = posixpath.splitext(urlsplit(url).path)[1].lower()
+        if extension and len(extension) <= 10:
+            return extension
+        if content_type:
+            return mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+        return ""
+
+    async def localize(
+        self,
+        blocks: AsyncIterator[Dict[str, Any]],
+        file_path: str,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ブロックを順に流しつつ、ファイルをキャッシュ済みの相対パスに置き換える
+
+        後続のブロックのファイル（最大concurrency件）を先に取得し始め、
+        ブロックは届いた順に返す。
+        """
+        base_dir = os.path.dirname(os.path.abspath(file_path))
+        pending: Deque[Tuple[Dict[str, Any], Optional[asyncio.Task]]] = deque()
+        try:
+            async for block in blocks:
+                url = hosted_file_url(block)
+                task = asyncio.ensure_future(self.fetch(url)) if url else None
+                pending.append((block, task))
+                while pending and (pending[0][1] is None or pending[0][1].done()
+                                   or len(pending) > self.concurrency):
+                    yield await self.resolve(*pending.popleft(), base_dir)
+            while pending:
+                yield await self.resolve(*pending.popleft(), base_dir)
+        finally:
+            for _, task in pending:
+                if task is not None:
+                    task.cancel()
+
+    @staticmethod
+    async def resolve(
+        block: Dict[str, Any],
+        task: Optional[asyncio.Task],
+        base_dir: str,
+    ) -> Dict[str, Any]:
+        """取得が終わったファイルの相対パスをブロックに記録（local_path）"""
+        if task is None:
+            return block
+        path = await task
+        if path is None:
+            return block
+        block_type = block["type"]
+        relative = os.path.relpath(path, base_dir).replace(os.sep, "/")
+        return {**block, block_type: {**block[block_type], "local_path": quote(relative)}}
+
+    def summary(self) -> str:
+        return (
+            f"ファイル取得 {self.downloaded} 件（{self.downloaded_bytes / 1024 / 1024:.1f} MB） / "
+            f"キャッシュ済み {self.cached} 件 / 失敗 {self.failed} 件"
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
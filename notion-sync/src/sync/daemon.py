@@ -0,0 +1,258 @@
+"""
+常駐モード
+
+1つのイベントループでSyncManager（keep-aliveのコネクションプール）を
+使い続け、次のジョブを内部のスケジューラーで実行する。
+
+- pull: SYNC_INTERVALごとにNotionからMarkdownへ同期
+- push: Markdownのスキャン（起動時と、トリガーされた場合）
+- issues: SYNC_ISSUES_INTERVALごとにGitHubのIssueをNotionへ同期
+- Markdownの変更監視（常時）
+
+ローカルのUnixドメインソケットで、状態の確認とジョブの即時実行を
+受け付ける。1行のコマンド（"status"・"trigger pull"・"stop"）を送ると
+1行のJSONが返る。
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+from rich.console import Console
+
+# ctlコマンドはソケットに接続するだけなので、同期処理のモジュールを読み込まない
+if TYPE_CHECKING:
+    from .manager import SyncManager
+
+console = Console()
+
+# ソケットのパスの既定値
+DEFAULT_CONTROL_SOCKET = ".notion-sync.sock"
+# Issueの同期に使うスクリプト（リポジトリの直下）
+DEFAULT_ISSUES_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))),
+    "sync_issues_to_notion.py",
+)
+
+
+@dataclass
+class Job:
+    """定期的に（またはトリガーで）実行するジョブと直近の結果"""
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    # 実行間隔（秒、0なら起動時とトリガーされた場合のみ実行する）
+    interval: float
+    # 同時に実行できないジョブで共有するロック
+    lock: Optional[asyncio.Lock] = None
+    runs: int = 0
+    failures: int = 0
+    running: bool = False
+    last_started: Optional[float] = None
+    last_duration: Optional[float] = None
+    last_error: Optional[str] = None
+    next_run: Optional[float] = None
+    trigger: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "running": self.running,
+            "last_started": self.last_started,
+            "last_duration": None if self.last_duration is None else round(self.last_duration, 3),
+            "last_error": self.last_error,
+            "next_run": self.next_run,
+        }
+
+
+class SyncDaemon:
+    """ジョブのスケジューラーと制御用ソケット"""
+
+    def __init__(self, manager: "SyncManager", socket_path: str = DEFAULT_CONTROL_SOCKET):
+        self.manager = manager
+        self.socket_path = socket_path
+        self.started = time.time()
+        self.stopping = asyncio.Event()
+        # pullとpushは同じファイルと同期状態を扱うため、同時に実行しない
+        files_lock = asyncio.Lock()
+        sync_config = manager.config["sync"]
+        self.jobs: Dict[str, Job] = {
+            "pull": Job("pull", manager.sync_from_notion, sync_config["interval"] / 1000, files_lock),
+            "push": Job("push", manager.sync_from_markdown, 0, files_lock),
+        }
+        issues_interval = sync_config["issuesInterval"] / 1000
+        if issues_interval > 0:
+            self.jobs["issues"] = Job("issues", self.sync_issues, issues_interval)
+        self.issues_module = None
+
+    async def run(self) -> None:
+        """stopを受け付けるかシグナルを受けるまで常駐する"""
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+
+        server = await self.start_control_server()
+        tasks: List[asyncio.Task] = [
+            asyncio.create_task(self.schedule(job)) for job in self.jobs.values()
+        ]
+        tasks.append(asyncio.create_task(self.manager.watch()))
+        console.print(
+            f"[bold green]常駐モードを開始しました（制御用ソケット: {self.socket_path}）[/]"
+        )
+        try:
+            await self.stopping.wait()
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            server.close()
+            await server.wait_closed()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            console.print("[bold yellow]常駐モードを終了しました[/]")
+
+    # --- スケジューラー -------------------------------------------------
+
+    async def schedule(self, job: Job) -> None:
+        """起動時に1回、その後は間隔ごと、またはトリガーされるたびにジョブを実行"""
+        while True:
+            await self.run_job(job)
+            job.next_run = time.time() + job.interval if job.interval else None
+            try:
+                await asyncio.wait_for(job.trigger.wait(), timeout=job.interval or None)
+            except asyncio.TimeoutError:
+                pass
+            job.trigger.clear()
+
+    async def run_job(self, job: Job) -> None:
+        """ジョブを1回実行し、結果を記録する（失敗しても常駐は続ける）"""
+        lock = job.lock or asyncio.Lock()
+        async with lock:
+            job.running = True
+            job.last_started = time.time()
+            started = time.perf_counter()
+            try:
+                with self.manager.metrics.phase(f"daemon.{job.name}"):
+                    await job.run()
+                job.last_error = None
+            except Exception as e:
+                job.failures += 1
+                job.last_error = str(e)
+                console.print(f"[bold red]ジョブ {job.name} が失敗しました: {e}[/]")
+            finally:
+                job.runs += 1
+                job.running = False
+                job.last_duration = time.perf_counter() - started
+
+    async def sync_issues(self) -> None:
+        """sync_issues_to_notionをこのプロセス内で実行
+
+        スクリプトは初回だけ読み込み、レート制限と計測値を共有する。
+        ブロッキングするHTTPクライアントを使うため別スレッドで実行する。
+        """
+        if self.issues_module is None:
+            path = os.getenv("SYNC_ISSUES_SCRIPT", DEFAULT_ISSUES_SCRIPT)
+            # スクリプトと同じディレクトリのnotion_sync_pathを読み込めるようにする
+            script_dir = os.path.dirname(os.path.abspath(path))
+            if script_dir not in sys.path:
+                sys.path.insert(0, script_dir)
+            spec = importlib.util.spec_from_file_location("sync_issues_to_notion", path)
+            if spec is None or spec.loader is None:
+                raise RuntimeError(f"Issueの同期スクリプトを読み込めません: {path}")
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self.issues_module = module
+        try:
+            await asyncio.to_thread(self.issues_module.main)
+        except SystemExit as e:
+            if e.code:
+                raise RuntimeError(f"Issueの同期が終了コード {e.code} で終了しました") from None
+
+    # --- 制御用ソケット -------------------------------------------------
+
+    async def start_control_server(self) -> asyncio.AbstractServer:
+        """制御用のUnixドメインソケットを開く（前回の残りは削除する）"""
+        if os.path.exists(self.socket_path):
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                os.remove(self.socket_path)
+            else:
+                writer.close()
+                raise RuntimeError(f"既に常駐しています: {self.socket_path}")
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        return server
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = self.handle_command(line.decode("utf-8").split())
+                writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    def handle_command(self, words: List[str]) -> Dict[str, Any]:
+        """1行のコマンドを処理して応答を返す"""
+        if not words:
+            return {"ok": False, "error": "コマンドがありません"}
+        command, args = words[0], words[1:]
+        if command == "status":
+            return {"ok": True, "status": self.status()}
+        if command == "trigger":
+            names = args or ["pull"]
+            unknown = [name for name in names if name not in self.jobs]
+            if unknown:
+                return {"ok": False, "error": f"不明なジョブです: {', '.join(unknown)}"}
+            for name in names:
+                self.jobs[name].trigger.set()
+            return {"ok": True, "triggered": names}
+        if command == "stop":
+            self.stopping.set()
+            return {"ok": True}
+        return {"ok": False, "error": f"不明なコマンドです: {command}"}
+
+    def status(self) -> Dict[str, Any]:
+        manager = self.manager
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "jobs": {name: job.status() for name, job in self.jobs.items()},
+            "pages": {
+                "written": manager.written_pages,
+                "skipped": manager.skipped_pages,
+                "identical": manager.identical_pages,
+            },
+            "files": {
+                "pushed": manager.pushed_files,
+                "unchanged": manager.unchanged_files,
+                "suppressed": manager.suppressed_changes,
+            },
+            "notion_api": manager.notion.limiter.stats.to_dict(),
+            "metrics": manager.metrics.summary(),
+        }
+
+
+def send_command(socket_path: str, command: str, timeout: float = 10.0) -> Dict[str, Any]:
+    """常駐中のプロセスにコマンドを送り、応答を返す"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(command.encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
@@ -0,0 +1,102 @@
+"""
+検索APIによるページの列挙
+
+ページごとにpages.retrieveとblocks.children.listを呼んで木を辿る代わりに、
+searchの結果（各ページのparent）から階層を組み立てる。
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from ..notion.client import AsyncNotionClient
+
+# ブロックの親を辿ってページを探す最大の深さ
+MAX_BLOCK_ANCESTORS = 16
+
+
+@dataclass
+class PageTree:
+    """Search APIの結果から組み立てたページの階層"""
+    # ページID -> ページの情報（pages.retrieveと同じ形式）
+    pages: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # 親ページID -> 子ページIDの一覧
+    children: Dict[str, List[str]] = field(default_factory=dict)
+    # アーカイブ・削除済みのページID
+    removed: Set[str] = field(default_factory=set)
+
+    def children_of(self, page_id: str, known: List[str]) -> List[str]:
+        """子ページIDの一覧
+
+        検索のインデックスは遅れることがあるため、前回記録した子ページのうち
+        検索結果にない（削除もされていない）ものも残す。
+        """
+        children = list(self.children.get(page_id, []))
+        children.extend(
+            child_id for child_id in known
+            if child_id not in self.pages and child_id not in self.removed
+        )
+        return children
+
+
+async def discover_pages(notion: AsyncNotionClient) -> PageTree:
+    """インテグレーションに共有されている全ページを検索し、親子関係を組み立てる
+
+    ページ1件ごとにpages.retrieveとblocks.children.listを呼ぶ代わりに、
+    searchを100件ずつ（新しい順に）辿る。トグルや列の中にあるページは
+    親がブロックになるため、ブロックの親を辿ってページを探す（並行して取得し、
+    途中のブロックの結果は他のページと共有する）。
+    データベースの行とワークスペース直下のページは子ページとして扱わない
+    （ツリーを辿る場合と同じ）。
+    """
+    tree = PageTree()
+    async for page in notion.search_pages():
+        if page.get("archived") or page.get("in_trash"):
+            tree.removed.add(page["id"])
+            continue
+        tree.pages[page["id"]] = page
+
+    # ブロックID -> そのブロックを含むページIDを求めるタスク
+    # （同じブロックを親に持つページが並行して問い合わせても取得は1回）
+    block_pages: Dict[str, "asyncio.Task[Optional[str]]"] = {}
+    page_ids = list(tree.pages)
+    parent_ids = await asyncio.gather(*(
+        parent_page_id(notion, tree.pages[page_id]["parent"], block_pages)
+        for page_id in page_ids
+    ))
+    for page_id, parent_id in zip(page_ids, parent_ids):
+        if parent_id is not None:
+            tree.children.setdefault(parent_id, []).append(page_id)
+    return tree
+
+
+async def parent_page_id(
+    notion: AsyncNotionClient,
+    parent: Dict[str, Any],
+    block_pages: Dict[str, "asyncio.Task[Optional[str]]"],
+    depth: int = 0,
+) -> Optional[str]:
+    """親がページならそのID、ブロックならそれを含むページのID
+
+    ブロックの取得はクライアントの同時実行数の範囲で並行して行われる。
+    """
+    if parent.get("type") == "page_id":
+        return parent["page_id"]
+    if parent.get("type") != "block_id" or depth >= MAX_BLOCK_ANCESTORS:
+        return None
+
+    block_id = parent["block_id"]
+    task = block_pages.get(block_id)
+    if task is None:
+        task = asyncio.ensure_future(_block_page_id(notion, block_id, block_pages, depth))
+        block_pages[block_id] = task
+    return await task
+
+
+async def _block_page_id(
+    notion: AsyncNotionClient,
+    block_id: str,
+    block_pages: Dict[str, "asyncio.Task[Optional[str]]"],
+    depth: int,
+) -> Optional[str]:
+    block = await notion.get_block(block_id)
+    return await parent_page_id(notion, block["parent"], block_pages, depth + 1)
@@ -0,0 +1,368 @@
+"""
+ワークスペースのエクスポート
+
+設定されたルートページ以下を1つのアーカイブ（tar・zip・JSONL）に
+書き出す。各ページはMarkdown（同期と同じ形式）と、APIから取得した
+ブロックのJSONの両方を含むため、復元や変換のやり直しにAPIを使わない。
+
+ページの取得はSYNC_CONCURRENCY個のワーカーが並行して行い、
+アーカイブへの書き込みは1つのタスクが順に行う。両者の間のキューに
+上限を設け、書き込みが追いつかない間はワーカーを待たせるため、
+メモリ上に保持するページは「ワーカー数＋キューの長さ」件までになる。
+"""
+import asyncio
+import gzip
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from rich.console import Console
+
+from ..notion.block import BlockConverter
+from ..notion.client import AsyncNotionClient
+from ..utils.fs import file_mode
+from ..utils.metrics import Metrics, shared_metrics
+from ..types import Config
+from .discovery import PageTree, discover_pages
+from .manager import SyncManager, create_notion_client
+
+console = Console()
+
+ARCHIVE_FORMATS = ("tar", "tar.gz", "zip", "jsonl", "jsonl.gz")
+# 取得済みで書き込み待ちのページ数の既定値
+DEFAULT_QUEUE_SIZE = 16
+
+
+def archive_format(path: str) -> str:
+    """出力先の拡張子からアーカイブの形式を決める"""
+    name = path.lower()
+    if name.endswith(".tgz"):
+        return "tar.gz"
+    # 長い拡張子（.tar.gz）を先に調べる
+    for fmt in sorted(ARCHIVE_FORMATS, key=len, reverse=True):
+        if name.endswith(f".{fmt}"):
+            return fmt
+    raise ValueError(f"アーカイブの形式を判別できません（{' / '.join(ARCHIVE_FORMATS)}）: {path}")
+
+
+@dataclass
+class ExportedPage:
+    """アーカイブに書き出す1ページ分の内容"""
+    # アーカイブ内のパス（拡張子なし、同期した場合のファイルの位置と同じ）
+    path: str
+    page: Dict[str, Any]
+    markdown: str
+    # get_page_blocksが返したブロック（文書順、入れ子の深さを"depth"に持つ）
+    blocks: List[Dict[str, Any]]
+
+    @property
+    def mtime(self) -> float:
+        edited = self.page["last_edited_time"].replace("Z", "+00:00")
+        return datetime.fromisoformat(edited).timestamp()
+
+    def raw_json(self) -> bytes:
+        return json.dumps(
+            {"page": self.page, "blocks": self.blocks}, ensure_ascii=False
+        ).encode("utf-8")
+
+
+class ArchiveWriter(ABC):
+    """アーカイブの書き込み
+
+    同じディレクトリの一時ファイルに書き、commitで置き換える。
+    途中で失敗した場合（abort）は既存のアーカイブを残す。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".export.tmp"
+        )
+        os.close(fd)
+
+    @abstractmethod
+    def write_page(self, exported: ExportedPage) -> None:
+        """1ページを書き込む"""
+
+    @abstractmethod
+    def write_manifest(self, manifest: Dict[str, Any]) -> None:
+        """マニフェストを書き込む（最後に1回）"""
+
+    @abstractmethod
+    def close(self) -> None:
+        """一時ファイルへの書き込みを終える"""
+
+    def commit(self) -> None:
+        self.close()
+        os.chmod(self.tmp_path, file_mode(self.path))
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        try:
+            self.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+class FileArchiveWriter(ArchiveWriter):
+    """ページごとに<path>.mdと<path>.json、最後にmanifest.jsonを持つアーカイブ"""
+
+    def write_page(self, exported: ExportedPage) -> None:
+        mtime = exported.mtime
+        self.add(f"{exported.path}.md", exported.markdown.encode("utf-8"), mtime)
+        self.add(f"{exported.path}.json", exported.raw_json(), mtime)
+
+    def write_manifest(self, manifest: Dict[str, Any]) -> None:
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+        self.add("manifest.json", data, time.time())
+
+    @abstractmethod
+    def add(self, name: str, data: bytes, mtime: float) -> None:
+        """1ファイルを追加する"""
+
+
+class TarArchiveWriter(FileArchiveWriter):
+    def __init__(self, path: str, compress: bool = False):
+        super().__init__(path)
+        self.tar = tarfile.open(self.tmp_path, "w:gz" if compress else "w")
+
+    def add(self, name: str, data: bytes, mtime: float) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self) -> None:
+        self.tar.close()
+
+
+class ZipArchiveWriter(FileArchiveWriter):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.zip = zipfile.ZipFile(self.tmp_path, "w", zipfile.ZIP_DEFLATED)
+
+    def add(self, name: str, data: bytes, mtime: float) -> None:
+        # zipの日時は1980年以降のみ表現できる
+        info = zipfile.ZipInfo(name, time.gmtime(max(mtime, 315532800))[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self.zip.writestr(info, data)
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+class JsonlArchiveWriter(ArchiveWriter):
+    """1行に1ページ（"type": "page"）、最後の行にマニフェスト（"type": "manifest"）"""
+
+    def __init__(self, path: str, compress: bool = False):
+        super().__init__(path)
+        if compress:
+            self.file = gzip.open(self.tmp_path, "wt", encoding="utf-8")
+        else:
+            self.file = open(self.tmp_path, "w", encoding="utf-8")
+
+    def write_page(self, exported: ExportedPage) -> None:
+        self.write_line({
+            "type": "page",
+            "path": f"{exported.path}.md",
+            "page": exported.page,
+            "markdown": exported.markdown,
+            "blocks": exported.blocks,
+        })
+
+    def write_manifest(self, manifest: Dict[str, Any]) -> None:
+        self.write_line({"type": "manifest", **manifest})
+
+    def write_line(self, record: Dict[str, Any]) -> None:
+        self.file.write(json.dumps(record, ensure_ascii=False))
+        self.file.write("\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def open_archive(path: str, fmt: Optional[str] = None) -> ArchiveWriter:
+    """形式（省略時は拡張子から判断）に応じたアーカイブを開く"""
+    fmt = fmt or archive_format(path)
+    if fmt in ("tar", "tar.gz"):
+        return TarArchiveWriter(path, compress=fmt == "tar.gz")
+    if fmt == "zip":
+        return ZipArchiveWriter(path)
+    if fmt in ("jsonl", "jsonl.gz"):
+        return JsonlArchiveWriter(path, compress=fmt == "jsonl.gz")
+    raise ValueError(f"未対応のアーカイブ形式です: {fmt}")
+
+
+class WorkspaceExporter:
+    """ページの取得（複数のワーカー）とアーカイブへの書き込み（1つのタスク）"""
+
+    def __init__(
+        self,
+        notion: AsyncNotionClient,
+        archive: ArchiveWriter,
+        workers: int,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        metrics: Optional[Metrics] = None,
+        tree: Optional[PageTree] = None,
+    ):
+        self.notion = notion
+        self.archive = archive
+        self.workers = max(1, workers)
+        self.metrics = metrics or shared_metrics()
+        self.tree = tree
+        # 取得待ちのページ（ID・ディレクトリ・子ページか）、IDだけなので上限は設けない
+        self.pending: asyncio.Queue = asyncio.Queue()
+        # 取得済みで書き込み待ちのページ
+        self.exported: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        # アーカイブ内のパス（同じ名前の兄弟ページを区別する）
+        self.paths: Set[str] = set()
+        self.pages = 0
+        self.blocks = 0
+
+    async def run(self, roots: Dict[str, str]) -> int:
+        """ルートページ（名前 -> ページID）以下を書き出し、ページ数を返す"""
+        for name, root_id in roots.items():
+            self.pending.put_nowait((root_id, name, False))
+        writer = asyncio.create_task(self.write_pages())
+        fetchers = [asyncio.create_task(self.fetch_pages()) for _ in range(self.workers)]
+        joined = asyncio.create_task(self.pending.join())
+        try:
+            # 全ページを取得し終えるか、いずれかのタスクが失敗するまで待つ
+            await asyncio.wait([joined, writer, *fetchers], return_when=asyncio.FIRST_COMPLETED)
+            for task in [writer, *fetchers]:
+                if task.done():
+                    task.result()
+            await self.exported.put(None)
+            await writer
+            self.archive.write_manifest({
+                "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "roots": roots,
+                "pages": self.pages,
+                "blocks": self.blocks,
+            })
+        finally:
+            for task in [joined, writer, *fetchers]:
+                task.cancel()
+            await asyncio.gather(joined, writer, *fetchers, return_exceptions=True)
+        return self.pages
+
+    async def fetch_pages(self) -> None:
+        """取得待ちのページを取り出して取得し、書き込み待ちのキューへ渡す"""
+        while True:
+            page_id, dir_path, own_dir = await self.pending.get()
+            try:
+                exported, child_dir, child_ids = await self.fetch_page(page_id, dir_path, own_dir)
+                # キューが一杯なら書き込みが追いつくまで待つ
+                await self.exported.put(exported)
+                for child_id in child_ids:
+                    self.pending.put_nowait((child_id, child_dir, True))
+            finally:
+                self.pending.task_done()
+
+    async def fetch_page(
+        self,
+        page_id: str,
+        dir_path: str,
+        own_dir: bool,
+    ) -> Tuple[ExportedPage, str, List[str]]:
+        """ページとブロックを取得してMarkdownに変換
+
+        パスは同期と同じく、ルートページは<dir>/<タイトル>、
+        子ページは<dir>/<タイトル>/<タイトル>とする。
+        """
+        page = self.tree.pages.get(page_id) if self.tree is not None else None
+        if page is None:
+            page = await self.notion.get_page(page_id)
+        title = SyncManager.page_title(page)
+        if own_dir:
+            dir_path = os.path.join(dir_path, title)
+        path = os.path.join(dir_path, title)
+        if path in self.paths:
+            path = f"{path} ({page['id'][:8]})"
+        self.paths.add(path)
+
+        child_ids: List[str] = []
+        blocks: List[Dict[str, Any]] = []
+        markdown = io.StringIO()
+        markdown.write(SyncManager.add_metadata("", {
+            "notionId": page["id"],
+            "lastEdited": page["last_edited_time"],
+        }))
+        stream = SyncManager.collect_child_pages(self.notion.get_page_blocks(page["id"]), child_ids)
+        stream = self.metrics.timed_aiter(self.keep(stream, blocks), "export.fetch")
+        await BlockConverter.stream_to_file(stream, markdown)
+        return ExportedPage(path, page, markdown.getvalue(), blocks), dir_path, child_ids
+
+    @staticmethod
+    async def keep(
+        blocks: AsyncIterator[Dict[str, Any]],
+        kept: List[Dict[str, Any]],
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ブロックをそのまま流しつつ、アーカイブ用に残す"""
+        async for block in blocks:
+            kept.append(block)
+            yield block
+
+    async def write_pages(self) -> None:
+        """書き込み待ちのページを順にアーカイブへ書き込む（Noneで終了）"""
+        while True:
+            exported = await self.exported.get()
+            if exported is None:
+                return
+            # 圧縮と書き込みでイベントループを止めないよう別スレッドで行う
+            with self.metrics.phase("export.write"):
+                await asyncio.to_thread(self.archive.write_page, exported)
+            self.pages += 1
+            self.blocks += len(exported.blocks)
+
+
+async def run_export(
+    config: Config,
+    output: str,
+    fmt: Optional[str] = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> int:
+    """設定されたルートページ以下をアーカイブに書き出し、ページ数を返す"""
+    metrics = shared_metrics()
+    archive = open_archive(output, fmt)
+    notion = create_notion_client(config, metrics)
+    exporter = WorkspaceExporter(
+        notion,
+        archive,
+        workers=config["sync"]["concurrency"],
+        queue_size=queue_size,
+        metrics=metrics,
+    )
+    roots = {
+        name: db_config["rootPageId"]
+        for name, db_config in config["notion"]["databases"].items()
+    }
+    try:
+        if config["sync"]["discovery"] == "search":
+            with metrics.phase("export.discover"):
+                exporter.tree = await discover_pages(notion)
+        with metrics.phase("export"):
+            pages = await exporter.run(roots)
+        archive.commit()
+    except BaseException:
+        archive.abort()
+        raise
+    finally:
+        await notion.aclose()
+        console.print(f"[dim]Notion API: {notion.limiter.stats.summary()}[/]")
+        console.print(f"[dim]{metrics.summary()}[/]")
+        if config["sync"]["metricsFile"]:
+            metrics.set_value("exported_pages", exporter.pages)
+            metrics.set_value("exported_blocks", exporter.blocks)
+            metrics.write(config["sync"]["metricsFile"])
+    return pages
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+from typing import Optional
+
+
+class PageIndex:
+    """ページIDとMarkdownファイルのパスを相互に引ける索引
+
+    同期状態と同じSQLiteに永続化し、起動時に全体を読み込まず
+    必要な行だけを問い合わせる。親ページのIDも記録する。
+    移動はSyncState.move_pathが他の記録と同じトランザクションで反映する。
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS page_index (
+                page_id TEXT PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                parent_id TEXT
+            )
+        """)
+
+    def path_of(self, page_id: str) -> Optional[str]:
+        """ページのファイルパス"""
+        row = self.conn.execute(
+            "SELECT path FROM page_index WHERE page_id = ?", (page_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def page_at(self, path: str) -> Optional[str]:
+        """ファイルパスに対応するページID"""
+        row = self.conn.execute(
+            "SELECT page_id FROM page_index WHERE path = ?", (path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, page_id: str, path: str, parent_id: Optional[str]) -> None:
+        """ページの位置を記録（同じパスを指していた古い行は置き換わる）"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO page_index (page_id, path, parent_id) VALUES (?, ?, ?)",
+            (page_id, path, parent_id)
+        )
+
+
+def move_paths(conn: sqlite3.Connection, table: str, old_path: str, new_path: str) -> None:
+    """tableのpath列のうちold_path自身とその配下をnew_pathへ書き換える"""
+    prefix = old_path.rstrip(os.sep) + os.sep
+    conn.execute(
+        f"UPDATE OR REPLACE {table} SET path = ? WHERE path = ?",
+        (new_path, old_path)
+    )
+    conn.execute(
+        f"UPDATE OR REPLACE {table} SET path = ? || substr(path, ?)"
+        " WHERE substr(path, 1, ?) = ?",
+        (new_path.rstrip(os.sep) + os.sep, len(prefix) + 1, len(prefix), prefix)
+    )
@@ -1,139 +1,459 @@
+import io
 import os
-from typing import Dict, Any, List
+import hashlib
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, AsyncIterator, Iterator, Optional, Tuple
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 from rich.console import Console
 
-from ..notion.client import NotionClient
+from ..notion.client import AsyncNotionClient
+from ..notion.ratelimit import shared_rate_limiter
 from ..notion.block import BlockConverter
+from ..markdown.compiler import compile_markdown
+from .state import FileState, PageState, SyncStateStore
+from .watcher import MarkdownHandler, WatchPipeline
+from .assets import AssetCache
+from .discovery import PageTree, discover_pages
+from ..utils.fs import HashingWriter, SpooledFile, replace_if_changed
+from ..utils.metrics import Metrics, TimedWriter, shared_metrics
 from ..types import Config
 
 console = Console()
 
-class MarkdownHandler(FileSystemEventHandler):
-    def __init__(self, manager: 'SyncManager'):
-        self.manager = manager
-
-    def on_modified(self, event):
-        if event.src_path.endswith('.md'):
-            self.manager.handle_markdown_change(event.src_path)
+def create_notion_client(config: Config, metrics: Metrics) -> AsyncNotionClient:
+    """設定（同時リクエスト数・レート制限・リトライ）に従ったNotionクライアント"""
+    return AsyncNotionClient(
+        config["notion"]["token"],
+        max_concurrency=config["sync"]["concurrency"],
+        max_depth=config["sync"]["blockDepth"],
+        base_url=config["notion"]["baseUrl"],
+        rate_limiter=shared_rate_limiter(
+            rate=config["sync"]["rateLimit"],
+            max_retries=config["sync"]["maxRetries"],
+            base_delay=config["sync"]["retryDelay"] / 1000,
+        ),
+        metrics=metrics,
+    )
 
 class SyncManager:
     def __init__(self, config: Config):
         self.config = config
-        self.notion = NotionClient(config["notion"]["token"])
-        self.page_map: Dict[str, str] = {}  # UUID -> filePath
+        # API呼び出し・処理段階の計測（SYNC_METRICS_FILEに書き出す）
+        self.metrics = shared_metrics()
+        self.notion = create_notion_client(config, self.metrics)
+        # 同時に処理するページ数（子ページの数によらず、開くファイルとメモリを抑える）
+        self.page_slots = asyncio.Semaphore(max(1, config["sync"]["concurrency"]))
+        self.state = SyncStateStore(config["sync"]["stateFile"])
+        # ページID <-> filePath と親子関係（永続化済み、必要な分だけ問い合わせる）
+        self.index = self.state.index
+        # pageId -> ローカルでのファイル名変更に合わせて送信するタイトル
+        self.pending_titles: Dict[str, str] = {}
+        # filePath -> 同期で最後に書き込んだ（または送信した）ファイルの状態
+        self.files: Dict[str, FileState] = self.state.load_files()
+        # 画像・添付ファイルのキャッシュ（署名付きURLの期限切れを避ける）
+        self.assets = AssetCache(
+            config["markdown"]["assetsDir"],
+            self.state,
+            concurrency=config["sync"]["assetConcurrency"],
+        )
+        self.written_pages = 0
+        self.skipped_pages = 0
+        self.identical_pages = 0
+        self.pushed_files = 0
+        self.unchanged_files = 0
+        self.suppressed_changes = 0
+        # SYNC_DISCOVERY=searchの場合に、同期の開始時に検索したページの階層
+        self.tree: Optional[PageTree] = None
         self.observer = Observer()
 
     async def sync_from_notion(self):
         """NotionからMarkdownへの同期"""
         try:
+            if self.config["sync"]["discovery"] == "search":
+                with self.metrics.phase("pull.discover"):
+                    self.tree = await discover_pages(self.notion)
+                console.print(f"[bold blue]検索で {len(self.tree.pages)} ページを検出[/]")
             for db_name, db_config in self.config["notion"]["databases"].items():
                 console.print(f"[bold blue]データベース {db_name} の同期を開始[/]")
                 await self.sync_database(db_name, db_config)
+            console.print(
+                f"[bold blue]更新 {self.written_pages} ページ / "
+                f"変更なし {self.skipped_pages} ページ / "
+                f"内容が同じため書き込みを省略 {self.identical_pages} ページ[/]"
+            )
+            console.print(f"[bold blue]{self.assets.summary()}[/]")
         except Exception as e:
-            console.error("Notionからの同期中にエラーが発生しました")
-            console.error(e)
+            console.print(f"[bold red]Notionからの同期中にエラーが発生しました: {e}[/]")
             raise
+        finally:
+            self.tree = None
 
     async def sync_database(self, db_name: str, db_config: Dict[str, Any]):
         """データベースの同期"""
-        root_page = self.notion.get_page(db_config["rootPageId"])
-        blocks = self.notion.get_page_blocks(db_config["rootPageId"])
-        
-        # ページの内容をMarkdownに変換
-        markdown = BlockConverter.blocks_to_markdown(blocks)
-        
-        # ファイルパスを生成
-        file_name = f"{root_page['properties']['title']['title'][0]['plain_text']}.md"
-        file_path = os.path.join(self.config["markdown"][f"{db_name}Dir"], file_name)
-        
-        # メタデータを追加
-        content = self.add_metadata(markdown, {
-            "notionId": root_page["id"],
-            "lastSynced": "now",
-        })
-        
-        # ファイルを保存
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-        
-        self.page_map[root_page["id"]] = file_path
-        
-        # 子ページを同期
-        for block in blocks:
+        dir_path = self.config["markdown"][f"{db_name}Dir"]
+        os.makedirs(dir_path, exist_ok=True)
+        await self.sync_page(db_config["rootPageId"], dir_path)
+
+    async def sync_page(
+        self,
+        page_id: str,
+        dir_path: str,
+        page: Optional[Dict[str, Any]] = None,
+        parent_id: Optional[str] = None,
+    ):
+        """ページの同期
+
+        前回の同期からlast_edited_timeが変わっていないページは
+        ブロックを取得せず、記録済みの子ページ（検索した場合は検索で
+        分かった子ページ）だけを辿る。
+        子ページ（parent_idあり）はdir_path（親のディレクトリ）の下に
+        自身のディレクトリを持つ。
+        ページ自体の処理はpage_slotsの数までに制限し、子ページの同期は
+        枠を返してから行う（親が枠を持ったまま子を待たない）。
+        """
+        async with self.page_slots:
+            if page is None:
+                page = await self.fetch_page(page_id)
+            page_id = page["id"]
+            if parent_id is not None:
+                dir_path = os.path.join(dir_path, self.page_title(page))
+            file_path = os.path.join(dir_path, f"{self.page_title(page)}.md")
+            self.relocate(page_id, file_path, own_dir=parent_id is not None)
+            os.makedirs(dir_path, exist_ok=True)
+
+            state = self.state.get(page_id)
+            if (
+                state is not None
+                and state.path == file_path
+                and state.is_current(page["last_edited_time"])
+                and os.path.exists(file_path)
+            ):
+                self.skipped_pages += 1
+                child_ids = state.child_ids
+                if self.tree is not None:
+                    child_ids = self.tree.children_of(page_id, child_ids)
+            else:
+                child_ids = await self.write_page(page, file_path)
+
+            self.index.put(page_id, file_path, parent_id)
+
+        await self.sync_child_pages(child_ids, dir_path, page_id)
+
+    def relocate(self, page_id: str, file_path: str, own_dir: bool) -> None:
+        """Notion側で名前や親が変わったページのファイルを新しい位置へ移す
+
+        子ページはディレクトリごと移動し、配下のページの記録も
+        パスの書き換えだけで追従させる（再取得しない）。
+        """
+        old_path = self.index.path_of(page_id)
+        if (
+            old_path is None
+            or old_path == file_path
+            or not os.path.exists(old_path)
+            or os.path.exists(file_path)
+        ):
+            return
+
+        moved_from = old_path
+        old_dir, new_dir = os.path.dirname(old_path), os.path.dirname(file_path)
+        if own_dir and old_dir != new_dir and not os.path.exists(new_dir):
+            os.makedirs(os.path.dirname(new_dir), exist_ok=True)
+            os.replace(old_dir, new_dir)
+            self.move_path(old_dir, new_dir)
+            old_path = os.path.join(new_dir, os.path.basename(old_path))
+        if old_path != file_path:
+            os.makedirs(new_dir, exist_ok=True)
+            os.replace(old_path, file_path)
+            self.move_path(old_path, file_path)
+        console.print(f"[yellow]移動: {moved_from} -> {file_path}[/]")
+
+    def move_path(self, old_path: str, new_path: str) -> None:
+        """ファイルまたはディレクトリの移動を同期状態に反映"""
+        self.state.move_path(old_path, new_path)
+        prefix = old_path.rstrip(os.sep) + os.sep
+        for path in [p for p in self.files if p == old_path or p.startswith(prefix)]:
+            state = self.files.pop(path)
+            state.path = new_path + path[len(old_path):]
+            self.files[state.path] = state
+
+    async def write_page(self, page: Dict[str, Any], file_path: str) -> List[str]:
+        """ページのブロックを逐次変換してファイルに書き出し、子ページのIDを返す
+
+        Notionにアップロードされた画像・添付ファイルはキャッシュに
+        取り込み、ローカルの相対パスで参照する。
+        取得中の内容はメモリに溜め（大きなページを除く）、揃ってから
+        一時ファイルに書き出して置き換えるため、応答を待つ間はファイルを
+        開かず、途中で失敗しても既存のファイルは壊れない。内容が既存のファイルと同じ場合は
+        置き換えず、更新日時も変えない。
+        """
+        synced_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        child_ids: List[str] = []
+        started = time.perf_counter()
+        fetched: List[float] = []
+
+        spooled = SpooledFile(file_path, suffix=".md.tmp")
+        try:
+            timed = TimedWriter(spooled)
+            # 同期日時はファイルに含めない（同じ内容なら同じバイト列にする）
+            whole = HashingWriter(timed)
+            whole.write(self.add_metadata("", {
+                "notionId": page["id"],
+                "lastEdited": page["last_edited_time"],
+            }))
+            body = HashingWriter(whole)
+            blocks = self.assets.localize(
+                self.collect_child_pages(self.notion.get_page_blocks(page["id"]), child_ids),
+                file_path,
+            )
+            # ブロック（と画像・添付ファイル）の取得を待った時間
+            blocks = self.metrics.timed_aiter(blocks, "pull.fetch", fetched.append)
+            await BlockConverter.stream_to_file(blocks, body)
+            started_write = time.perf_counter()
+            tmp_path = spooled.finish()
+            timed.seconds += time.perf_counter() - started_write
+            if replace_if_changed(tmp_path, file_path, whole.hexdigest(), self.known_digest(file_path)):
+                self.written_pages += 1
+            else:
+                self.identical_pages += 1
+        except BaseException:
+            spooled.discard()
+            raise
+        self.record_file(file_path, os.stat(file_path), whole.hexdigest())
+        elapsed = time.perf_counter() - started
+        self.metrics.add_phase("pull.write", timed.seconds)
+        self.metrics.add_phase("pull.convert", max(0.0, elapsed - sum(fetched) - timed.seconds))
+        self.metrics.add_phase("pull.page", elapsed)
+
+        self.state.save(PageState(
+            page_id=page["id"],
+            last_edited_time=page["last_edited_time"],
+            content_hash=body.hexdigest(),
+            path=file_path,
+            synced_at=synced_at,
+            child_ids=child_ids,
+        ))
+        return child_ids
+
+    @staticmethod
+    async def collect_child_pages(
+        blocks: AsyncIterator[Dict[str, Any]],
+        child_ids: List[str],
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ブロックをそのまま流しつつ、子ページのIDを記録"""
+        async for block in blocks:
             if block["type"] == "child_page":
-                child_dir = os.path.join(
-                    self.config["markdown"][f"{db_name}Dir"],
-                    block["child_page"]["title"]
-                )
-                os.makedirs(child_dir, exist_ok=True)
-                await self.sync_page(block["id"], child_dir)
-
-    async def sync_page(self, page_id: str, dir_path: str):
-        """ページの同期"""
-        page = self.notion.get_page(page_id)
-        blocks = self.notion.get_page_blocks(page_id)
-        
-        markdown = BlockConverter.blocks_to_markdown(blocks)
-        file_name = f"{page['properties']['title']['title'][0]['plain_text']}.md"
-        file_path = os.path.join(dir_path, file_name)
-        
-        content = self.add_metadata(markdown, {
-            "notionId": page_id,
-            "lastSynced": "now",
-        })
-        
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-        
-        self.page_map[page_id] = file_path
+                child_ids.append(block["id"])
+            yield block
+
+    async def sync_child_pages(self, child_ids: List[str], parent_dir: str, parent_id: str):
+        """子ページを並行して同期
+
+        兄弟ページはまとめて投入し、同時に処理するページ数は
+        sync_pageのpage_slots、同時リクエスト数はNotionClient側の
+        セマフォで制限する。
+        """
+        await asyncio.gather(*(
+            self.sync_page(child_id, parent_dir, parent_id=parent_id) for child_id in child_ids
+        ))
+
+    async def fetch_page(self, page_id: str) -> Dict[str, Any]:
+        """ページの情報（検索済みならその結果を使い、APIを呼ばない）"""
+        if self.tree is not None:
+            page = self.tree.pages.get(page_id)
+            if page is not None:
+                return page
+        return await self.notion.get_page(page_id)
+
+    @staticmethod
+    def page_title(page: Dict[str, Any]) -> str:
+        """ページのタイトルを取得"""
+        return page["properties"]["title"]["title"][0]["plain_text"]
 
     async def sync_from_markdown(self):
-        """MarkdownからNotionへの同期"""
+        """MarkdownからNotionへの同期
+
+        更新日時とサイズが前回の同期時と同じファイルは読まずに飛ばす。
+        """
         try:
             for db_name in self.config["notion"]["databases"]:
                 dir_path = self.config["markdown"][f"{db_name}Dir"]
-                for root, _, files in os.walk(dir_path):
-                    for file in files:
-                        if file.endswith('.md'):
-                            file_path = os.path.join(root, file)
-                            await self.handle_markdown_change(file_path)
+                for file_path, stat in self.scan_markdown(dir_path):
+                    known = self.files.get(file_path)
+                    if known is not None and known.matches(stat):
+                        self.unchanged_files += 1
+                        continue
+                    await self.handle_markdown_change(file_path)
+            console.print(
+                f"[bold blue]送信 {self.pushed_files} ファイル / "
+                f"変更なし {self.unchanged_files} ファイル[/]"
+            )
         except Exception as e:
-            console.error("Markdownからの同期中にエラーが発生しました")
-            console.error(e)
+            console.print(f"[bold red]Markdownからの同期中にエラーが発生しました: {e}[/]")
             raise
 
+    @staticmethod
+    def scan_markdown(dir_path: str) -> Iterator[Tuple[str, os.stat_result]]:
+        """ディレクトリ以下のMarkdownファイルとそのstatを列挙
+
+        os.scandirのエントリが持つstatを使い、ファイルを開かずに済ませる。
+        """
+        pending = [dir_path]
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.endswith('.md'):
+                    yield entry.path, entry.stat()
+
+    def known_digest(self, file_path: str) -> Optional[str]:
+        """前回の同期から変更されていないファイルなら、記録済みのハッシュを返す"""
+        known = self.files.get(file_path)
+        if known is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return known.content_hash if known.matches(stat) else None
+
+    def record_file(self, file_path: str, stat: os.stat_result, content_hash: str):
+        """ファイルの同期状態を記録"""
+        state = FileState(file_path, stat.st_mtime_ns, stat.st_size, content_hash)
+        self.files[file_path] = state
+        self.state.save_file(state)
+
     async def handle_markdown_change(self, file_path: str):
-        """Markdownファイルの変更を処理"""
+        """Markdownファイルの変更を処理
+
+        同期自身が最後に書き込んだ（または送信した）内容と同じファイルは
+        Notionへ送らない。
+        """
+        try:
+            with self.metrics.phase("push.read"), open(file_path, "rb") as f:
+                # 読み込み中の変更を次回検出できるよう、読む前のstatを記録する
+                stat = os.fstat(f.fileno())
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        content_hash = hashlib.sha256(data).hexdigest()
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            
-            metadata, markdown = self.parse_metadata(content)
-            if "notionId" in metadata:
-                blocks = self.markdown_to_blocks(markdown)
-                self.notion.update_page(metadata["notionId"], blocks)
+            page_id = self.index.page_at(file_path)
+            if page_id in self.pending_titles:
+                await self.notion.update_page_title(page_id, self.pending_titles.pop(page_id))
+                console.print(f"[green]{file_path}: タイトルを変更[/]")
+
+            known = self.files.get(file_path)
+            if known is not None and known.content_hash == content_hash:
+                self.suppressed_changes += 1
+                self.unchanged_files += 1
+                self.record_file(file_path, stat, content_hash)
+                return
+
+            metadata, markdown = self.parse_metadata(data.decode("utf-8"))
+            page_id = metadata.get("notionId") or page_id
+            if page_id:
+                with self.metrics.phase("push.compile"):
+                    blocks = self.markdown_to_blocks(markdown)
+                with self.metrics.phase("push.update"):
+                    diff = await self.notion.update_page(page_id, blocks)
+                console.print(f"[green]{file_path}: {diff.summary()}[/]")
+                self.pushed_files += 1
+            self.record_file(file_path, stat, content_hash)
         except Exception as e:
-            console.error(f"ファイルの変更処理中にエラーが発生しました: {file_path}")
-            console.error(e)
+            console.print(f"[bold red]ファイルの変更処理中にエラーが発生しました: {file_path}: {e}[/]")
+
+    def handle_markdown_move(self, src_path: str, dest_path: str):
+        """Markdownファイルの移動・名前変更を記録に反映
+
+        索引にあるページなら、ツリーを走査し直さずにパスを書き換える。
+        同じディレクトリ内での名前変更は、次の変更処理でNotionの
+        タイトルにも反映する（Notion APIではページの親を変更できない
+        ため、別のディレクトリへの移動は次回の同期で元に戻る）。
+        """
+        page_id = self.index.page_at(src_path)
+        if page_id is None:
+            return
+        self.move_path(src_path, dest_path)
+        if os.path.dirname(src_path) == os.path.dirname(dest_path):
+            self.pending_titles[page_id] = os.path.splitext(os.path.basename(dest_path))[0]
+        console.print(f"[yellow]移動を検出: {src_path} -> {dest_path}[/]")
 
-    def start_watching(self):
-        """ファイル変更の監視を開始"""
+    async def watch(self):
+        """ファイル変更を監視し、キャンセルされるまでNotionへ反映する
+
+        監視スレッドのイベントはWatchPipelineで間引き、
+        ワーカーが並行してhandle_markdown_changeを呼ぶ。
+        """
         if not self.config["sync"]["watchMode"]:
             return
 
+        pipeline = WatchPipeline(
+            self.handle_markdown_change,
+            on_move=self.handle_markdown_move,
+            debounce=self.config["sync"]["debounce"] / 1000,
+            workers=self.config["sync"]["watchWorkers"],
+        )
         for db_name in self.config["notion"]["databases"]:
             dir_path = self.config["markdown"][f"{db_name}Dir"]
             self.observer.schedule(
-                MarkdownHandler(self),
+                MarkdownHandler(pipeline),
                 dir_path,
                 recursive=True
             )
-        
+
         self.observer.start()
         console.print("[bold green]ファイル変更の監視を開始[/]")
+        exporter = None
+        if self.config["sync"]["metricsFile"]:
+            exporter = asyncio.ensure_future(self.export_metrics_periodically())
+        try:
+            await pipeline.run()
+        finally:
+            if exporter is not None:
+                exporter.cancel()
+            self.stop()
+            console.print(
+                f"[dim]{pipeline.summary()} / 自身の書き込み {self.suppressed_changes} 件を除外[/]"
+            )
+
+    async def export_metrics_periodically(self):
+        """監視中、SYNC_METRICS_INTERVAL秒ごとに計測値を書き出す"""
+        interval = max(1, self.config["sync"]["metricsInterval"])
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.write_metrics()
+            except OSError as e:
+                console.print(f"[bold red]計測値の書き出しに失敗しました: {e}[/]")
+
+    def write_metrics(self):
+        """同期の件数を含めた計測値をSYNC_METRICS_FILEに書き出す（未設定なら何もしない）"""
+        path = self.config["sync"]["metricsFile"]
+        if not path:
+            return
+        for name in (
+            "written_pages", "skipped_pages", "identical_pages",
+            "pushed_files", "unchanged_files", "suppressed_changes",
+        ):
+            self.metrics.set_value(name, getattr(self, name))
+        self.metrics.set_value("assets_downloaded", self.assets.downloaded)
+        self.metrics.set_value("assets_downloaded_bytes", self.assets.downloaded_bytes)
+        self.metrics.set_value("assets_cached", self.assets.cached)
+        self.metrics.set_value("assets_failed", self.assets.failed)
+        self.metrics.write(path)
+
+    async def close(self):
+        """Notionクライアントの接続と同期状態のストアを閉じる"""
+        await self.notion.aclose()
+        await self.assets.aclose()
+        self.state.close()
 
     def stop(self):
         """監視を停止"""
@@ -171,5 +491,4 @@ class SyncManager:
     @staticmethod
     def markdown_to_blocks(markdown: str) -> List[Dict[str, Any]]:
         """MarkdownをNotionブロックに変換"""
-        # この部分は必要に応じて実装
-        return [] 
\ No newline at end of file
+        return list(compile_markdown(io.StringIO(markdown)))
@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from .index import PageIndex, move_paths
+
+# Notionのlast_edited_timeは分単位に丸められるため、
+# 同じ分の間に同期した場合は変更の有無を判定できない
+EDIT_TIME_RESOLUTION = timedelta(minutes=1)
+
+
+def parse_time(value: str) -> datetime:
+    """NotionのISO 8601形式の日時を解析"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+@dataclass
+class PageState:
+    """ページごとの同期状態"""
+    page_id: str
+    last_edited_time: str
+    content_hash: str
+    path: str
+    synced_at: str
+    child_ids: List[str] = field(default_factory=list)
+
+    def is_current(self, last_edited_time: str) -> bool:
+        """前回の同期以降にページが編集されていないか"""
+        if last_edited_time != self.last_edited_time:
+            return False
+        return parse_time(self.synced_at) >= parse_time(last_edited_time) + EDIT_TIME_RESOLUTION
+
+
+@dataclass
+class FileState:
+    """Markdownファイルごとの同期状態（最後に読み書きした時点の内容）"""
+    path: str
+    mtime_ns: int
+    size: int
+    content_hash: str
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """ファイルを読まずに、記録時から変更されていないと判断できるか"""
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+
+@dataclass
+class AssetState:
+    """キャッシュ済みの画像・添付ファイル
+
+    keyは署名を除いたURL。同じ内容のファイルはcontent_hashで共有する。
+    """
+    key: str
+    content_hash: str
+    file_name: str
+    etag: Optional[str] = None
+
+
+class SyncStateStore:
+    """同期状態をSQLiteに永続化するストア"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                page_id TEXT PRIMARY KEY,
+                last_edited_time TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                path TEXT NOT NULL,
+                synced_at TEXT NOT NULL,
+                child_ids TEXT NOT NULL DEFAULT '[]'
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS assets (
+                key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                etag TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS assets_etag ON assets (etag)")
+        self.index = PageIndex(self.conn)
+
+    def get(self, page_id: str) -> Optional[PageState]:
+        """ページの同期状態を取得"""
+        row = self.conn.execute(
+            "SELECT page_id, last_edited_time, content_hash, path, synced_at, child_ids"
+            " FROM pages WHERE page_id = ?",
+            (page_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return PageState(*row[:5], child_ids=json.loads(row[5]))
+
+    def save(self, state: PageState) -> None:
+        """ページの同期状態を保存"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pages"
+            " (page_id, last_edited_time, content_hash, path, synced_at, child_ids)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                state.page_id,
+                state.last_edited_time,
+                state.content_hash,
+                state.path,
+                state.synced_at,
+                json.dumps(state.child_ids),
+            )
+        )
+
+    def load_files(self) -> Dict[str, FileState]:
+        """全ファイルの同期状態を一度に読み込む"""
+        rows = self.conn.execute(
+            "SELECT path, mtime_ns, size, content_hash FROM files"
+        )
+        return {row[0]: FileState(*row) for row in rows}
+
+    def save_file(self, state: FileState) -> None:
+        """ファイルの同期状態を保存"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, mtime_ns, size, content_hash)"
+            " VALUES (?, ?, ?, ?)",
+            (state.path, state.mtime_ns, state.size, state.content_hash)
+        )
+
+    def get_asset(self, key: str) -> Optional[AssetState]:
+        """キャッシュ済みのファイルを取得"""
+        row = self.conn.execute(
+            "SELECT key, content_hash, file_name, etag FROM assets WHERE key = ?",
+            (key,)
+        ).fetchone()
+        return AssetState(*row) if row else None
+
+    def find_asset_by_etag(self, etag: str) -> Optional[AssetState]:
+        """同じETagのファイル（別のURLで取得済みのもの）を取得"""
+        row = self.conn.execute(
+            "SELECT key, content_hash, file_name, etag FROM assets WHERE etag = ? LIMIT 1",
+            (etag,)
+        ).fetchone()
+        return AssetState(*row) if row else None
+
+    def save_asset(self, state: AssetState) -> None:
+        """キャッシュ済みのファイルを記録"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO assets (key, content_hash, file_name, etag)"
+            " VALUES (?, ?, ?, ?)",
+            (state.key, state.content_hash, state.file_name, state.etag)
+        )
+
+    def move_path(self, old_path: str, new_path: str) -> None:
+        """ファイルまたはディレクトリの移動を全ての記録に反映"""
+        self.conn.execute("BEGIN")
+        try:
+            for table in ("pages", "files", "page_index"):
+                move_paths(self.conn, table, old_path, new_path)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        self.conn.close()
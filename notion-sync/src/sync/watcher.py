@@ -0,0 +1,126 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from watchdog.events import FileSystemEventHandler
+from rich.console import Console
+
+console = Console()
+
+# 最後の変更からこの時間（秒）だけ待ってから処理する
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_WORKERS = 4
+
+
+class MarkdownHandler(FileSystemEventHandler):
+    """watchdogのイベントをWatchPipelineへ渡す（監視スレッドで呼ばれる）"""
+
+    def __init__(self, pipeline: 'WatchPipeline'):
+        self.pipeline = pipeline
+
+    def on_modified(self, event):
+        if not event.is_directory and event.src_path.endswith('.md'):
+            self.pipeline.submit(event.src_path)
+
+    def on_created(self, event):
+        self.on_modified(event)
+
+    def on_moved(self, event):
+        # 一時ファイルからの置き換え（os.replace）は移動として通知される
+        if not event.is_directory and event.dest_path.endswith('.md'):
+            self.pipeline.submit(event.dest_path, moved_from=event.src_path)
+
+
+class WatchPipeline:
+    """ファイル変更を間引いてから少数のワーカーで並行に処理する
+
+    監視スレッドからのイベントはイベントループのキューに移し、
+    ファイルごとにdebounce秒の間イベントが途切れるまで待ってから
+    1回だけhandlerを呼ぶ。処理中のファイルに届いた変更は、処理が
+    終わった後にもう一度まとめて扱う。ファイルの移動は届いた順に
+    すぐon_moveへ渡す。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str], Awaitable[Any]],
+        on_move: Optional[Callable[[str, str], Any]] = None,
+        debounce: float = DEFAULT_DEBOUNCE,
+        workers: int = DEFAULT_WORKERS,
+    ):
+        self.handler = handler
+        self.on_move = on_move
+        self.debounce = debounce
+        self.workers = workers
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.events: Optional[asyncio.Queue] = None
+        self.ready: Optional[asyncio.Queue] = None
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
+        self.running: Set[str] = set()
+        self.dirty: Set[str] = set()
+        self.received = 0
+        self.processed = 0
+
+    def submit(self, path: str, moved_from: Optional[str] = None) -> None:
+        """ファイルの変更を通知（任意のスレッドから呼べる）"""
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.events.put_nowait, (path, moved_from))
+
+    async def run(self) -> None:
+        """キャンセルされるまでイベントを処理"""
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.ready = asyncio.Queue()
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        try:
+            while True:
+                path, moved_from = await self.events.get()
+                self.received += 1
+                if moved_from is not None and self.on_move is not None:
+                    try:
+                        self.on_move(moved_from, path)
+                    except Exception as e:
+                        console.print(f"[bold red]ファイルの移動処理中にエラーが発生しました: {path}: {e}[/]")
+                self.schedule(path)
+        finally:
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers.clear()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.loop = None
+
+    def schedule(self, path: str) -> None:
+        """ファイルの処理をdebounce秒後に予約（既存の予約は延期する）"""
+        timer = self.timers.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+        self.timers[path] = self.loop.call_later(self.debounce, self.release, path)
+
+    def release(self, path: str) -> None:
+        """待ち時間が過ぎたファイルをワーカーに渡す"""
+        self.timers.pop(path, None)
+        if path in self.running:
+            self.dirty.add(path)
+            return
+        self.running.add(path)
+        self.ready.put_nowait(path)
+
+    async def worker(self) -> None:
+        while True:
+            path = await self.ready.get()
+            try:
+                await self.handler(path)
+                self.processed += 1
+            except Exception as e:
+                console.print(f"[bold red]ファイルの変更処理中にエラーが発生しました: {path}: {e}[/]")
+            finally:
+                self.running.discard(path)
+                # 処理中に届いた変更（新しい予約がまだ無いもの）を処理し直す
+                if path in self.dirty:
+                    self.dirty.discard(path)
+                    if path not in self.timers:
+                        self.release(path)
+
+    def summary(self) -> str:
+        return f"イベント {self.received} 件 / 処理 {self.processed} 件"
@@ -5,14 +5,31 @@ class DatabaseConfig(TypedDict):
 
 class NotionConfig(TypedDict):
     token: str
+    baseUrl: str
     databases: Dict[str, DatabaseConfig]
 
 class MarkdownConfig(TypedDict):
     managementDir: str
     developmentDir: str
+    assetsDir: str
 
 class SyncConfig(TypedDict):
     watchMode: bool
+    concurrency: int
+    blockDepth: int
+    rateLimit: float
+    maxRetries: int
+    retryDelay: int
+    stateFile: str
+    debounce: int
+    watchWorkers: int
+    assetConcurrency: int
+    metricsFile: str
+    metricsInterval: int
+    interval: int
+    issuesInterval: int
+    controlSocket: str
+    discovery: str
 
 class Config(TypedDict):
     notion: NotionConfig
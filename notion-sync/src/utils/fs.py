@@ -0,0 +1,119 @@
+import hashlib
+import io
+import os
+import stat
+import tempfile
+from typing import Optional, TextIO
+
+# ファイルのハッシュを計算する際の読み込み単位
+CHUNK_SIZE = 1 << 16
+# SpooledFileがメモリに溜める上限（文字数、超えたら一時ファイルに書き出す）
+SPOOL_LIMIT = 1 << 20
+
+# 新しく作るファイルの権限の既定値（umaskはスレッドを起動する前、読み込み時に調べる）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def file_mode(path: str) -> int:
+    """pathを置き換える際の権限
+
+    既存のファイルがあればその権限、なければumaskを適用した0o666。
+    mkstempの一時ファイル（0o600）をそのまま置き換えないために使う。
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def file_digest(path: str) -> str:
+    """ファイルの内容のSHA-256を計算"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def replace_if_changed(
+    tmp_path: str,
+    path: str,
+    digest: str,
+    current_digest: Optional[str] = None,
+) -> bool:
+    """一時ファイルの内容がpathと異なる場合だけ置き換える
+
+    digestは一時ファイルのハッシュ。pathのハッシュ（current_digest）が
+    分かっていればpathを読まずに比較する。同じ内容なら一時ファイルを
+    削除し、pathの更新日時も変えない。置き換えた場合はTrueを返す。
+    """
+    if current_digest is None and os.path.exists(path):
+        current_digest = file_digest(path)
+    if current_digest == digest:
+        os.remove(tmp_path)
+        return False
+    os.chmod(tmp_path, file_mode(path))
+    os.replace(tmp_path, path)
+    return True
+
+
+class SpooledFile:
+    """書き込みをメモリに溜め、確定時に同じディレクトリの一時ファイルへ書き出す
+
+    ブロックの取得を待つ間はファイルを開かないため、並行して同期する
+    ページの数だけファイル記述子を消費しない。SPOOL_LIMITを超える
+    大きなページは、その時点で一時ファイルに切り替える。
+    """
+
+    def __init__(self, path: str, suffix: str = ".tmp", spool_limit: int = SPOOL_LIMIT):
+        self.path = path
+        self.suffix = suffix
+        self.spool_limit = spool_limit
+        self.buffer: Optional[io.StringIO] = io.StringIO()
+        self.file: Optional[TextIO] = None
+        self.tmp_path: Optional[str] = None
+
+    def write(self, text: str) -> int:
+        if self.file is not None:
+            return self.file.write(text)
+        written = self.buffer.write(text)
+        if self.buffer.tell() > self.spool_limit:
+            self.spill()
+        return written
+
+    def spill(self) -> None:
+        """溜めた内容を一時ファイルに書き出し、以降は直接書き込む"""
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=self.suffix)
+        self.file = os.fdopen(fd, "w", encoding="utf-8")
+        self.file.write(self.buffer.getvalue())
+        self.buffer = None
+
+    def finish(self) -> str:
+        """一時ファイルを閉じてそのパスを返す"""
+        if self.file is None:
+            self.spill()
+        self.file.close()
+        return self.tmp_path
+
+    def discard(self) -> None:
+        """一時ファイルを閉じて削除する"""
+        if self.file is not None:
+            self.file.close()
+        if self.tmp_path is not None and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class HashingWriter:
+    """書き込んだ内容のSHA-256を計算しながらファイルに書き出す"""
+
+    def __init__(self, file: TextIO):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def write(self, text: str) -> int:
+        self.hash.update(text.encode("utf-8"))
+        return self.file.write(text)
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
@@ -0,0 +1,390 @@
+"""
+API呼び出しと処理段階の計測
+
+エンドポイントごとのリクエスト数（ステータス別）・レイテンシの
+ヒストグラム・応答サイズ、再試行や429などのイベント、処理段階
+（取得・変換・書き込みなど）ごとの所要時間を1か所に集計する。
+
+httpx（notion_client）にはevent_hooksで、requestsにはSessionの
+responseフックで組み込む。集計結果は実行の最後に（監視モードでは
+定期的に）JSONまたはPrometheusのテキスト形式でファイルに書き出す。
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+T = TypeVar("T")
+
+# レイテンシ・処理時間のヒストグラムの境界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# パスに含まれるIDを置き換えて、エンドポイントごとに集計する
+ID_SEGMENT_RE = re.compile(r"/(?:[0-9a-fA-F]{8}-?(?:[0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}|\d+)(?=/|$)")
+# ConfluenceのスペースキーもIDと同様に置き換える
+SPACE_KEY_RE = re.compile(r"(/space/)[^/]+")
+
+DEFAULT_PREFIX = "notion_sync"
+
+
+def endpoint_of(method: str, url: str) -> str:
+    """"GET /v1/blocks/{id}/children"のような集計用のエンドポイント名"""
+    path = urlsplit(str(url)).path or "/"
+    path = SPACE_KEY_RE.sub(r"\1{key}", ID_SEGMENT_RE.sub("/{id}", path))
+    return f"{method.upper()} {path}"
+
+
+class Histogram:
+    """累積しない（境界ごとの）カウントを持つヒストグラム"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """q分位点を含む区間の上限（最後の区間は+Inf）"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Prometheusの形式（le, 累積数）"""
+        result = []
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            result.append((f"{bound:g}", seen))
+        result.append(("+Inf", self.count))
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class TimedWriter:
+    """書き込みにかかった時間を累積するファイルのラッパー"""
+
+    def __init__(self, file):
+        self.file = file
+        self.seconds = 0.0
+
+    def write(self, text: str) -> int:
+        started = time.perf_counter()
+        try:
+            return self.file.write(text)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def _escape_label(value: Any) -> str:
+    """ラベルの値をPrometheusのテキスト形式に合わせてエスケープ"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+class Metrics:
+    """1回の実行の計測値（スレッドセーフ）
+
+    serviceは"notion"・"github"・"confluence"など呼び出し先の名前。
+    """
+
+    def __init__(self, prefix: str = DEFAULT_PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # (service, endpoint, status) -> リクエスト数
+        self.requests: Counter = Counter()
+        # (service, endpoint) -> レイテンシ
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        # (service, endpoint) -> 応答の合計バイト数
+        self.response_bytes: Counter = Counter()
+        # (service, event) -> 回数（retries, rate_limitedなど）
+        self.events: Counter = Counter()
+        # 処理段階 -> 所要時間
+        self.phases: Dict[str, Histogram] = {}
+        # 実行結果の値（処理したページ数など）
+        self.values: Dict[str, float] = {}
+        # service -> statsを持つレート制限（書き出す時点の値を含める）
+        self.limiters: Dict[str, Any] = {}
+
+    # --- 記録 -----------------------------------------------------------
+
+    def observe_request(
+        self,
+        service: str,
+        endpoint: str,
+        status: int,
+        seconds: float,
+        size: int = 0,
+    ) -> None:
+        with self.lock:
+            self.requests[(service, endpoint, str(status))] += 1
+            histogram = self.latency.get((service, endpoint))
+            if histogram is None:
+                histogram = self.latency[(service, endpoint)] = Histogram()
+            histogram.observe(seconds)
+            self.response_bytes[(service, endpoint)] += size
+            if status == 429:
+                self.events[(service, "http_429")] += 1
+
+    def count(self, service: str, event: str, value: int = 1) -> None:
+        with self.lock:
+            self.events[(service, event)] += value
+
+    def add_phase(self, phase: str, seconds: float) -> None:
+        with self.lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """with文の中の所要時間を処理段階として記録"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(phase, time.perf_counter() - started)
+
+    def set_value(self, name: str, value: float) -> None:
+        with self.lock:
+            self.values[name] = value
+
+    def track_rate_limiter(self, service: str, limiter: Any) -> None:
+        """RateLimiterの統計（再試行・429・待ち時間）を書き出しに含める"""
+        with self.lock:
+            self.limiters[service] = limiter
+
+    # --- 組み込み -------------------------------------------------------
+
+    def httpx_event_hooks(self, service: str, asynchronous: bool = True) -> Dict[str, List[Callable[..., Any]]]:
+        """httpxのClient（asynchronous=Trueの場合はAsyncClient）のevent_hooks
+
+        応答フックで本文を読み込み、本文の受信までをレイテンシとする。
+        ファイルのダウンロードなどストリーミングするクライアントには使わない。
+        """
+        def on_request(request):
+            request.extensions["metrics_started"] = time.perf_counter()
+
+        def record(response):
+            started = response.request.extensions.get("metrics_started", time.perf_counter())
+            self.observe_request(
+                service,
+                endpoint_of(response.request.method, response.request.url),
+                response.status_code,
+                time.perf_counter() - started,
+                len(response.content),
+            )
+
+        def on_response(response):
+            response.read()
+            record(response)
+
+        if not asynchronous:
+            return {"request": [on_request], "response": [on_response]}
+
+        async def on_request_async(request):
+            on_request(request)
+
+        async def on_response_async(response):
+            await response.aread()
+            record(response)
+
+        return {"request": [on_request_async], "response": [on_response_async]}
+
+    def requests_hook(self, service: str) -> Callable[..., Any]:
+        """requests.Sessionのresponseフック（session.hooks["response"]に追加する）"""
+        def on_response(response, *args, **kwargs):
+            self.observe_request(
+                service,
+                endpoint_of(response.request.method, response.request.url),
+                response.status_code,
+                response.elapsed.total_seconds(),
+                len(response.content),
+            )
+        return on_response
+
+    def instrument_session(self, session: Any, service: str) -> Any:
+        """requests.Sessionに計測を組み込んで返す"""
+        session.hooks["response"].append(self.requests_hook(service))
+        return session
+
+    async def timed_aiter(
+        self,
+        items: AsyncIterator[T],
+        phase: str,
+        on_done: Optional[Callable[[float], None]] = None,
+    ) -> AsyncIterator[T]:
+        """非同期イテレーターの次の要素を待った時間を処理段階として記録
+
+        on_doneには待った時間の合計を渡す。
+        """
+        waited = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = await items.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    waited += time.perf_counter() - started
+                yield item
+        finally:
+            self.add_phase(phase, waited)
+            if on_done is not None:
+                on_done(waited)
+
+    # --- 書き出し -------------------------------------------------------
+
+    def snapshot_limiters(self) -> Dict[str, Dict[str, Any]]:
+        return {service: limiter.stats.to_dict() for service, limiter in self.limiters.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            endpoints: Dict[str, Dict[str, Any]] = {}
+            for (service, endpoint, status), count in sorted(self.requests.items()):
+                entry = endpoints.setdefault(f"{service} {endpoint}", {
+                    "service": service,
+                    "endpoint": endpoint,
+                    "requests": 0,
+                    "status": {},
+                    "response_bytes": self.response_bytes[(service, endpoint)],
+                    "latency": self.latency[(service, endpoint)].to_dict(),
+                })
+                entry["requests"] += count
+                entry["status"][status] = count
+            events: Dict[str, Dict[str, int]] = {}
+            for (service, event), count in sorted(self.events.items()):
+                events.setdefault(service, {})[event] = count
+            return {
+                "started_at": self.started,
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "endpoints": list(endpoints.values()),
+                "events": events,
+                "rate_limiters": self.snapshot_limiters(),
+                "phases": {name: h.to_dict() for name, h in sorted(self.phases.items())},
+                "values": dict(self.values),
+            }
+
+    def to_prometheus(self) -> str:
+        """Prometheusのテキスト形式（node_exporterのtextfile collector向け）"""
+        p = self.prefix
+        lines: List[str] = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+
+        def histogram(name: str, value: Histogram, **labels: Any) -> None:
+            for le, count in value.cumulative():
+                lines.append(f"{p}_{name}_bucket{_labels(**labels, le=le)} {count}")
+            lines.append(f"{p}_{name}_sum{_labels(**labels)} {value.sum:.6f}")
+            lines.append(f"{p}_{name}_count{_labels(**labels)} {value.count}")
+
+        with self.lock:
+            header("requests_total", "counter", "API requests by service, endpoint and status")
+            for (service, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f"{p}_requests_total{_labels(service=service, endpoint=endpoint, status=status)} {count}"
+                )
+            header("request_duration_seconds", "histogram", "API request latency including the body")
+            for (service, endpoint), value in sorted(self.latency.items()):
+                histogram("request_duration_seconds", value, service=service, endpoint=endpoint)
+            header("response_bytes_total", "counter", "API response body bytes")
+            for (service, endpoint), size in sorted(self.response_bytes.items()):
+                lines.append(f"{p}_response_bytes_total{_labels(service=service, endpoint=endpoint)} {size}")
+            header("events_total", "counter", "Retries, rate limits and other events")
+            for (service, event), count in sorted(self.events.items()):
+                lines.append(f"{p}_events_total{_labels(service=service, event=event)} {count}")
+            header("phase_duration_seconds", "histogram", "Time spent in each processing phase")
+            for name, value in sorted(self.phases.items()):
+                histogram("phase_duration_seconds", value, phase=name)
+            values = dict(self.values)
+
+        header("rate_limiter", "gauge", "Rate limiter statistics")
+        for service, stats in sorted(self.snapshot_limiters().items()):
+            for stat, value in sorted(stats.items()):
+                lines.append(f"{p}_rate_limiter{_labels(service=service, stat=stat)} {value}")
+        header("run_value", "gauge", "Values reported by the run")
+        for name, value in sorted(values.items()):
+            lines.append(f"{p}_run_value{_labels(name=name)} {value}")
+        header("run_elapsed_seconds", "gauge", "Seconds since the run started")
+        lines.append(f"{p}_run_elapsed_seconds {time.time() - self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """拡張子が.jsonならJSON、それ以外はPrometheusのテキスト形式で書き出す
+
+        一時ファイルに書いてから置き換えるため、収集側が途中の内容を読まない。
+        """
+        if path.endswith(".json"):
+            content = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        else:
+            content = self.to_prometheus()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def summary(self) -> str:
+        """主要な値の1行の要約"""
+        with self.lock:
+            total = sum(self.requests.values())
+            errors = sum(count for (_, _, status), count in self.requests.items() if status >= "400")
+            slowest = sorted(
+                ((h.quantile(0.95), f"{service} {endpoint}") for (service, endpoint), h in self.latency.items()),
+                reverse=True,
+            )[:1]
+            size = sum(self.response_bytes.values())
+        text = f"API {total} リクエスト（エラー {errors}） / 応答 {size / 1024 / 1024:.1f} MB"
+        if slowest:
+            text += f" / p95最大 {slowest[0][1]} {slowest[0][0]:g}s"
+        return text
+
+
+_shared_metrics: Optional[Metrics] = None
+_shared_lock = threading.Lock()
+
+
+def shared_metrics() -> Metrics:
+    """プロセス内で共有するMetricsを返す"""
+    global _shared_metrics
+    with _shared_lock:
+        if _shared_metrics is None:
+            _shared_metrics = Metrics()
+        return _shared_metrics
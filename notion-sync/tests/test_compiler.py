@@ -0,0 +1,144 @@
+"""compile_markdownのテスト"""
+import copy
+
+import pytest
+
+from src.markdown.compiler import compile_markdown
+from src.notion.block import BlockConverter
+from src.notion.diff import diff_blocks, nest_blocks
+
+
+def compile_text(text):
+    return list(compile_markdown(text.splitlines(True)))
+
+
+@pytest.mark.parametrize("info, language", [
+    ("", "plain text"),
+    ("plain text", "plain text"),
+    ("text", "plain text"),
+    ("python", "python"),
+    ("Python title=\"a.py\"", "python"),
+    ("visual basic", "visual basic"),
+    ("js", "javascript"),
+])
+def test_code_fence_language(info, language):
+    blocks = compile_text(f"```{info}\nx = 1\n```\n")
+    assert [block["type"] for block in blocks] == ["code"]
+    assert blocks[0]["code"]["language"] == language
+
+
+def test_code_block_round_trip_keeps_notion_default_language():
+    block = {"type": "code", "code": {
+        "language": "plain text",
+        "rich_text": [{"type": "text", "text": {"content": "a b"}, "plain_text": "a b"}],
+    }}
+    blocks = compile_text(BlockConverter.to_markdown(block))
+    assert blocks[0]["code"]["language"] == "plain text"
+
+
+def rich_text_of(block):
+    return block[block["type"]]["rich_text"]
+
+
+def test_large_table_is_split_with_repeated_header():
+    text = "| a | b |\n|---|---|\n" + "".join(f"| {i} | x |\n" for i in range(150))
+    blocks = compile_text(text)
+    assert [block["type"] for block in blocks] == ["table", "table"]
+    rows = [block["table"]["children"] for block in blocks]
+    assert [len(r) for r in rows] == [100, 52]
+    assert all(r[0] == rows[0][0] for r in rows)
+    assert sum(len(r) - 1 for r in rows) == 150
+
+
+def test_list_item_children_are_capped_and_hoisted():
+    text = "- top\n" + "".join(f"  - sub {i}\n" for i in range(150))
+    blocks = compile_text(text)
+    assert len(blocks[0]["bulleted_list_item"]["children"]) == 100
+    assert len(blocks) == 51
+    assert rich_text_of(blocks[1])[0]["text"]["content"] == "sub 100"
+
+
+def test_long_rich_text_is_split_into_continuation_blocks():
+    line = " ".join(f"**b{i}** p{i}" for i in range(120))
+    blocks = compile_text(line + "\n")
+    assert [block["type"] for block in blocks] == ["paragraph"] * 3
+    assert all(len(rich_text_of(block)) <= 100 for block in blocks)
+    content = "".join(span["text"]["content"] for block in blocks for span in rich_text_of(block))
+    assert content.startswith("b0 p0 b1") and content.endswith("b119 p119")
+
+
+ANNOTATIONS = ("bold", "italic", "strikethrough", "underline", "code")
+
+
+def span(text, *marks, link=None):
+    """APIから取得した形式のrich_textの要素"""
+    annotations = {name: name in marks for name in ANNOTATIONS}
+    annotations["color"] = "default"
+    return {
+        "type": "text",
+        "text": {"content": text, "link": {"url": link} if link else None},
+        "plain_text": text,
+        "annotations": annotations,
+        "href": link,
+    }
+
+
+def pulled(block_type, *spans, depth=0, **payload):
+    """APIから取得した形式のブロック（文書順、depth付き）"""
+    if block_type != "table_row":
+        payload.setdefault("rich_text", list(spans))
+    return {"object": "block", "type": block_type, "depth": depth, block_type: payload}
+
+
+ROUND_TRIP_CASES = {
+    "line-start markers": [
+        pulled("paragraph", span("# not a heading")),
+        pulled("paragraph", span("- not a list")),
+        pulled("paragraph", span("+ not a list")),
+        pulled("paragraph", span("1. not a list")),
+        pulled("paragraph", span("> not a quote")),
+        pulled("paragraph", span("| not | a table |")),
+        pulled("paragraph", span("---")),
+        pulled("paragraph", span("```")),
+        pulled("paragraph", span("<!-- not a comment -->")),
+        pulled("paragraph", span("![not](https://example.com/image.png)")),
+        pulled("paragraph", span("[not a file](notes.pdf)")),
+    ],
+    "inline markers": [
+        pulled("paragraph", span("a *b* _c_ `d` [e](f) <u>g</u> ~~h~~ C:\\path\\ snake_case")),
+        pulled("paragraph", span("2 * 3 * 4"), span("x*", "bold"), span(" "), span("_y_", "italic")),
+        pulled("paragraph", span("[a]", link="https://example.com")),
+    ],
+    "underline": [
+        pulled("paragraph", span("plain "), span("under", "underline"), span(" "),
+               span("both", "underline", "bold")),
+    ],
+    "multiline": [
+        pulled("paragraph", span("first\n- second\n2) third")),
+        pulled("quote", span("# a\n> b")),
+        pulled("bulleted_list_item", span("item\n- continued")),
+        pulled("to_do", span("[x] not checked"), checked=False),
+    ],
+    "headings": [
+        pulled("heading_1", span("C#")),
+        pulled("heading_2", span("ends with #")),
+    ],
+    "empty paragraphs": [
+        pulled("paragraph", span("before")),
+        pulled("paragraph"),
+        pulled("paragraph", span("after")),
+    ],
+    "table cells": [
+        pulled("table", table_width=2, has_column_header=True, has_row_header=False),
+        pulled("table_row", depth=1, cells=[[span("a|b")], [span("c\\")]]),
+        pulled("table_row", depth=1, cells=[[span("- d")], [span("*e*", "bold")]]),
+    ],
+}
+
+
+@pytest.mark.parametrize("blocks", ROUND_TRIP_CASES.values(), ids=ROUND_TRIP_CASES.keys())
+def test_pull_compile_round_trip(blocks):
+    markdown = BlockConverter.blocks_to_markdown(blocks)
+    existing = nest_blocks([{**copy.deepcopy(block), "id": f"b{n}"} for n, block in enumerate(blocks)])
+    diff = diff_blocks(existing, compile_text(markdown))
+    assert (diff.updates, diff.inserts, diff.deletes) == ([], [], []), markdown
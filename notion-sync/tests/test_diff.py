@@ -0,0 +1,234 @@
+"""diff_blocks・nest_blocksのテスト"""
+import asyncio
+
+import pytest
+
+from src.notion.client import AsyncNotionClient
+from src.notion.diff import BlockDiff, diff_blocks, nest_blocks
+from src.notion.ratelimit import RateLimiter
+
+
+def api_block(block_id, block_type, text="", depth=0, has_children=False, **payload):
+    """APIから取得した形式のブロック"""
+    if block_type in ("paragraph", "heading_1", "bulleted_list_item"):
+        payload["rich_text"] = [{
+            "type": "text",
+            "text": {"content": text, "link": None},
+            "plain_text": text,
+            "annotations": {"bold": False, "italic": False, "color": "default"},
+        }]
+    return {
+        "object": "block",
+        "id": block_id,
+        "type": block_type,
+        "has_children": has_children,
+        "depth": depth,
+        block_type: payload,
+    }
+
+
+def new_block(block_type, text="", **payload):
+    """Markdownから生成した形式のブロック"""
+    if block_type in ("paragraph", "heading_1", "bulleted_list_item"):
+        payload["rich_text"] = [{"type": "text", "text": {"content": text}}]
+    return {"object": "block", "type": block_type, block_type: payload}
+
+
+def child_page(block_id):
+    return api_block(block_id, "child_page", title=block_id)
+
+
+def api_table(block_id, rows, depth=0):
+    """表と行（depth付きの文書順）"""
+    blocks = [api_block(block_id, "table", depth=depth, has_children=True,
+                        table_width=len(rows[0]), has_column_header=True, has_row_header=False)]
+    for n, row in enumerate(rows):
+        blocks.append(api_block(f"{block_id}-r{n}", "table_row", depth=depth + 1, cells=[
+            [{"type": "text", "text": {"content": cell}, "plain_text": cell, "annotations": {}}]
+            for cell in row
+        ]))
+    return blocks
+
+
+def new_table(rows):
+    return new_block(
+        "table",
+        table_width=len(rows[0]),
+        has_column_header=True,
+        has_row_header=False,
+        children=[
+            new_block("table_row", cells=[[{"type": "text", "text": {"content": cell}}] for cell in row])
+            for row in rows
+        ],
+    )
+
+
+def text_of(block):
+    return "".join(span["text"]["content"] for span in block[block["type"]]["rich_text"])
+
+
+def summarize(diff):
+    """比較しやすい形（挿入は基準のIDと「種類:本文」の一覧）"""
+    return {
+        "updates": [(block_id, text_of(block)) for block_id, block in diff.updates],
+        "inserts": [
+            (after, [f"{block['type']}:{text_of(block) if 'rich_text' in block[block['type']] else ''}"
+                     for block in blocks])
+            for after, blocks in diff.inserts
+        ],
+        "deletes": diff.deletes,
+        "full_rewrite": diff.full_rewrite,
+    }
+
+
+CASES = [
+    pytest.param(
+        [api_block("a", "paragraph", "A"), api_block("b", "paragraph", "B")],
+        [new_block("paragraph", "A"), new_block("paragraph", "B")],
+        {"updates": [], "inserts": [], "deletes": [], "full_rewrite": False},
+        id="unchanged",
+    ),
+    pytest.param(
+        [api_block("a", "paragraph", "A"), api_block("b", "paragraph", "B")],
+        [new_block("paragraph", "A"), new_block("paragraph", "B2")],
+        {"updates": [("b", "B2")], "inserts": [], "deletes": [], "full_rewrite": False},
+        id="update-in-place",
+    ),
+    pytest.param(
+        [api_block("a", "paragraph", "A"), api_block("b", "paragraph", "B")],
+        [new_block("paragraph", "A"), new_block("paragraph", "X"), new_block("paragraph", "B")],
+        {"updates": [], "inserts": [("a", ["paragraph:X"])], "deletes": [], "full_rewrite": False},
+        id="insert-in-middle",
+    ),
+    pytest.param(
+        # 先頭への挿入はafterで表せないため、管理対象を全て置き換える
+        [api_block("a", "paragraph", "A"), api_block("b", "paragraph", "B")],
+        [new_block("paragraph", "X"), new_block("paragraph", "A"), new_block("paragraph", "B")],
+        {
+            "updates": [],
+            "inserts": [(None, ["paragraph:X", "paragraph:A", "paragraph:B"])],
+            "deletes": ["a", "b"],
+            "full_rewrite": True,
+        },
+        id="insert-at-head",
+    ),
+    pytest.param(
+        # 先頭が子ページなら、その直後を基準に挿入できる
+        [child_page("c1"), api_block("a", "paragraph", "A")],
+        [new_block("paragraph", "X"), new_block("paragraph", "A")],
+        {"updates": [], "inserts": [("c1", ["paragraph:X"])], "deletes": [], "full_rewrite": False},
+        id="insert-at-head-after-child-page",
+    ),
+    pytest.param(
+        [child_page("c1"), api_block("a", "paragraph", "A"), child_page("c2")],
+        [new_block("paragraph", "A"), new_block("paragraph", "B")],
+        {"updates": [], "inserts": [("a", ["paragraph:B"])], "deletes": [], "full_rewrite": False},
+        id="between-unmanaged-children",
+    ),
+    pytest.param(
+        [child_page("c1"), child_page("c2")],
+        [new_block("paragraph", "A")],
+        {"updates": [], "inserts": [("c2", ["paragraph:A"])], "deletes": [], "full_rewrite": False},
+        id="only-unmanaged-children",
+    ),
+    pytest.param(
+        [api_block("x", "paragraph", "X"), api_block("a", "paragraph", "A"), api_block("y", "paragraph", "Y")],
+        [new_block("paragraph", "X"), new_block("heading_1", "A"), new_block("paragraph", "Y")],
+        {"updates": [], "inserts": [("x", ["heading_1:A"])], "deletes": ["a"], "full_rewrite": False},
+        id="type-change",
+    ),
+    pytest.param(
+        [api_block("x", "paragraph", "X"), api_block("a", "paragraph", "A")],
+        [new_block("paragraph", "X")],
+        {"updates": [], "inserts": [], "deletes": ["a"], "full_rewrite": False},
+        id="delete",
+    ),
+    pytest.param(
+        [api_block("x", "paragraph", "X"), *api_table("t", [["h1", "h2"], ["1", "2"]])],
+        [new_block("paragraph", "X"), new_table([["h1", "h2"], ["1", "2"]])],
+        {"updates": [], "inserts": [], "deletes": [], "full_rewrite": False},
+        id="table-unchanged",
+    ),
+    pytest.param(
+        # 表はその場で更新できないため、削除して同じ位置に作り直す
+        [api_block("x", "paragraph", "X"), *api_table("t", [["h1", "h2"], ["1", "2"]])],
+        [new_block("paragraph", "X"), new_table([["h1", "h2"], ["1", "3"]])],
+        {"updates": [], "inserts": [("x", ["table:"])], "deletes": ["t"], "full_rewrite": False},
+        id="table-changed",
+    ),
+]
+
+
+@pytest.mark.parametrize("existing, desired, expected", CASES)
+def test_diff_blocks(existing, desired, expected):
+    diff = diff_blocks(nest_blocks(existing), desired)
+    assert summarize(diff) == expected
+    # 削除するブロックを挿入の基準にしない
+    assert not {after for after, _ in diff.inserts} & set(diff.deletes)
+
+
+def test_unchanged_diff_has_no_api_calls():
+    existing = [api_block("a", "paragraph", "A"), *api_table("t", [["h"], ["v"]])]
+    diff = diff_blocks(nest_blocks(existing), [new_block("paragraph", "A"), new_table([["h"], ["v"]])])
+    assert diff.api_calls == 0
+    assert diff.unchanged == 2
+
+
+@pytest.mark.parametrize("blocks, expected", [
+    pytest.param([], [], id="empty"),
+    pytest.param(
+        [("a", 0), ("b", 0)],
+        [("a", []), ("b", [])],
+        id="flat",
+    ),
+    pytest.param(
+        [("a", 0), ("a1", 1), ("a1x", 2), ("a2", 1), ("b", 0)],
+        [("a", [("a1", [("a1x", [])]), ("a2", [])]), ("b", [])],
+        id="nested",
+    ),
+    pytest.param(
+        # 深い階層から最上位に戻る
+        [("a", 0), ("a1", 1), ("a1x", 2), ("b", 0), ("b1", 1)],
+        [("a", [("a1", [("a1x", [])])]), ("b", [("b1", [])])],
+        id="dedent",
+    ),
+])
+def test_nest_blocks(blocks, expected):
+    def shape(block):
+        children = block["bulleted_list_item"].get("children", [])
+        return (block["id"], [shape(child) for child in children])
+
+    flat = [api_block(block_id, "bulleted_list_item", block_id, depth=depth) for block_id, depth in blocks]
+    assert [shape(block) for block in nest_blocks(flat)] == expected
+
+
+
+def test_apply_diff_runs_deletes_updates_then_appends_sequentially():
+    client = AsyncNotionClient("test", rate_limiter=RateLimiter(rate=1000.0))
+    calls = []
+    running = []
+
+    async def request(endpoint, idempotent=True, **kwargs):
+        assert not running, "同じページへの書き込みが並行している"
+        running.append(endpoint)
+        await asyncio.sleep(0)
+        running.pop()
+        calls.append((endpoint, kwargs.get("block_id"), kwargs.get("after")))
+        return {"results": [{"id": f"new-{len(calls)}"}]}
+
+    client.request = request
+    diff = BlockDiff(
+        updates=[("u", new_block("paragraph", "U"))],
+        inserts=[("a", [new_block("paragraph", "1")]), ("b", [new_block("paragraph", "2")])],
+        deletes=["d1", "d2"],
+    )
+    asyncio.run(client.apply_diff("page", diff))
+    asyncio.run(client.aclose())
+    endpoints = client.client
+    assert calls == [
+        (endpoints.blocks.delete, "d1", None),
+        (endpoints.blocks.delete, "d2", None),
+        (endpoints.blocks.update, "u", None),
+        (endpoints.blocks.children.append, "page", "a"),
+        (endpoints.blocks.children.append, "page", "b"),
+    ]
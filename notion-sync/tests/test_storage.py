@@ -0,0 +1,35 @@
+"""convert_storageのテスト"""
+from src.confluence.storage import convert_storage
+
+
+def convert(xhtml):
+    return [block for batch in convert_storage(xhtml) for block in batch]
+
+
+def depths(block, depth=0):
+    """ブロックと子孫の (種類, 深さ) を文書順に返す"""
+    content = block[block["type"]]
+    yield block["type"], depth
+    for child in content.get("children", []):
+        yield from depths(child, depth + 1)
+
+
+def test_table_in_nested_list_is_hoisted():
+    blocks = convert(
+        "<ul><li>a<ul><li>b<ul><li>c"
+        "<table><tbody><tr><th>h</th></tr><tr><td>r</td></tr></tbody></table>"
+        "</li></ul></li></ul></li></ul>"
+    )
+    nested = [item for block in blocks for item in depths(block)]
+    assert ("table", 1) in nested
+    # 深さMAX_NESTING（2）のブロックは子を持てない
+    assert max(depth for _, depth in nested) == 2
+    assert all(depth < 2 for block_type, depth in nested if block_type == "table")
+
+
+def test_long_rich_text_continues_in_paragraphs():
+    blocks = convert("<p>" + "".join(f"<strong>b{i}</strong> p{i} " for i in range(150)) + "</p>")
+    assert [block["type"] for block in blocks] == ["paragraph"] * 3
+    assert all(len(block["paragraph"]["rich_text"]) <= 100 for block in blocks)
+    text = "".join(span["text"]["content"] for block in blocks for span in block["paragraph"]["rich_text"])
+    assert text.startswith("b0 p0 b1") and text.rstrip().endswith("b149 p149")
@@ -0,0 +1,16 @@
+"""
+Make the notion-sync modules (the ``src`` package) importable from the
+scripts at the repository root.
+
+Import this module before any ``from src... import ...``:
+
+    import notion_sync_path  # noqa: F401
+    from src.notion.ratelimit import shared_rate_limiter
+"""
+import os
+import sys
+
+NOTION_SYNC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'notion-sync')
+
+if NOTION_SYNC_DIR not in sys.path:
+    sys.path.insert(0, NOTION_SYNC_DIR)
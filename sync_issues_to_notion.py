@@ -1,9 +1,19 @@
 import os
+import json
+import time
+import threading
 import requests
-from typing import List, Dict, Any
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 
+# notion-syncの共通モジュール（レート制限）を利用する
+import notion_sync_path  # noqa: F401
+from src.notion.ratelimit import shared_rate_limiter
+from src.utils.metrics import shared_metrics
+
 # 環境変数の読み込み
 load_dotenv()
 
@@ -14,6 +24,21 @@ NOTION_DATABASE_ID = os.getenv('NOTION_DATABASE_ID')
 ORGANIZATION = os.getenv('GITHUB_ORGANIZATION', 'NexA-LLC')
 REPO = os.getenv('GITHUB_REPO', 'antracing')
 PROJECT_NUMBER = 6
+GITHUB_GRAPHQL_URL = os.getenv('GITHUB_GRAPHQL_URL', 'https://api.github.com/graphql')
+# Notion APIのURL（ベンチマークではローカルのスタンドインを指定する）
+NOTION_API_URL = os.getenv('NOTION_API_URL', 'https://api.notion.com/v1').rstrip('/')
+GITHUB_PAGE_SIZE = 100
+# GraphQLの残りポイントがこれを下回ったらリセットまで待つ
+GITHUB_RATE_LIMIT_RESERVE = 100
+# 前回の同期時刻（これ以降に更新されたIssueだけを取得する）の保存先
+GITHUB_SYNC_STATE_FILE = os.getenv('GITHUB_SYNC_STATE_FILE', '.github-sync-state.json')
+NOTION_RATE_LIMIT = float(os.getenv('NOTION_RATE_LIMIT', '3'))
+# 既存ページの探し方（index: データベースを一度だけ走査して索引を作る、query: Issueごとに検索）
+NOTION_LOOKUP = os.getenv('NOTION_LOOKUP', 'index')
+# Notionへの作成・更新を並行して行うワーカー数（実際の呼び出し頻度はレート制限に従う）
+NOTION_CONCURRENCY = int(os.getenv('NOTION_CONCURRENCY', '4'))
+# API呼び出し・処理段階の計測値の書き出し先（.jsonならJSON、それ以外はPrometheusのテキスト形式）
+SYNC_METRICS_FILE = os.getenv('SYNC_METRICS_FILE', '')
 
 # APIヘッダー
 GITHUB_HEADERS = {
@@ -27,40 +52,108 @@ NOTION_HEADERS = {
     'Content-Type': 'application/json'
 }
 
-def get_github_issues() -> List[Dict[str, Any]]:
-    """GitHubのプロジェクトからIssueを取得"""
-    query = """
-    query($org: String!, $number: Int!) {
-        organization(login: $org) {
-            projectV2(number: $number) {
-                items(first: 100) {
-                    nodes {
-                        content {
-                            ... on Issue {
-                                number
-                                title
-                                state
-                                labels(first: 10) {
-                                    nodes {
-                                        name
-                                    }
-                                }
-                            }
+# GraphQLのレート制限の消費状況
+GITHUB_RATE_LIMIT = {'requests': 0, 'cost': 0, 'remaining': None}
+
+RATE_LIMIT_FIELDS = """
+    rateLimit {
+        cost
+        remaining
+        resetAt
+    }
+"""
+
+PROJECT_ITEMS_QUERY = """
+query($org: String!, $number: Int!, $cursor: String) {
+    organization(login: $org) {
+        projectV2(number: $number) {
+            items(first: 100, after: $cursor) {
+                pageInfo {
+                    hasNextPage
+                    endCursor
+                }
+                nodes {
+                    updatedAt
+                    content {
+                        ... on Issue {
+                            id
+                            updatedAt
                         }
                     }
                 }
             }
         }
     }
-    """
-    
-    variables = {
-        'org': ORGANIZATION,
-        'number': PROJECT_NUMBER
+""" + RATE_LIMIT_FIELDS + """
+}
+"""
+
+ISSUE_DETAILS_QUERY = """
+query($ids: [ID!]!) {
+    nodes(ids: $ids) {
+        ... on Issue {
+            id
+            number
+            title
+            state
+            labels(first: 100) {
+                pageInfo {
+                    hasNextPage
+                    endCursor
+                }
+                nodes {
+                    name
+                }
+            }
+        }
     }
-    
-    response = requests.post(
-        'https://api.github.com/graphql',
+""" + RATE_LIMIT_FIELDS + """
+}
+"""
+
+ISSUE_LABELS_QUERY = """
+query($id: ID!, $cursor: String) {
+    node(id: $id) {
+        ... on Issue {
+            labels(first: 100, after: $cursor) {
+                pageInfo {
+                    hasNextPage
+                    endCursor
+                }
+                nodes {
+                    name
+                }
+            }
+        }
+    }
+""" + RATE_LIMIT_FIELDS + """
+}
+"""
+
+def notion_limiter():
+    """Notion APIの呼び出しに共通のレート制限"""
+    return shared_rate_limiter(rate=NOTION_RATE_LIMIT)
+
+_sessions = threading.local()
+
+def notion_session() -> requests.Session:
+    """スレッドごとのNotion API用セッション（接続を使い回す）"""
+    if not hasattr(_sessions, 'session'):
+        _sessions.session = shared_metrics().instrument_session(requests.Session(), 'notion')
+    return _sessions.session
+
+def github_graphql(
+    session: requests.Session,
+    query: str,
+    variables: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """GraphQLを実行し、(data, サーバーの現在時刻)を返す
+
+    クエリにはrateLimitを含め、消費したコストを集計する。残りが少なく
+    なったらリセットされるまで待つ。
+    """
+    response = session.post(
+        GITHUB_GRAPHQL_URL,
         json={'query': query, 'variables': variables},
         headers=GITHUB_HEADERS
     )
@@ -68,22 +161,115 @@ def get_github_issues() -> List[Dict[str, Any]]:
     if response.status_code != 200:
         raise Exception(f'GitHub API error: {response.text}')
     
-    data = response.json()
-    issues = []
+    body = response.json()
+    if body.get('errors'):
+        raise Exception(f'GitHub API error: {body["errors"]}')
+    
+    data = body['data']
+    rate_limit = data.get('rateLimit')
+    if rate_limit:
+        GITHUB_RATE_LIMIT['requests'] += 1
+        GITHUB_RATE_LIMIT['cost'] += rate_limit['cost']
+        GITHUB_RATE_LIMIT['remaining'] = rate_limit['remaining']
+        if rate_limit['remaining'] < GITHUB_RATE_LIMIT_RESERVE:
+            reset_at = datetime.fromisoformat(rate_limit['resetAt'].replace('Z', '+00:00'))
+            wait = (reset_at - datetime.now(timezone.utc)).total_seconds()
+            if wait > 0:
+                print(f'GitHub APIの残りポイントが少ないため {wait:.0f} 秒待機します')
+                time.sleep(wait)
+    
+    server_time = None
+    if response.headers.get('Date'):
+        server_time = parsedate_to_datetime(response.headers['Date']).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return data, server_time
+
+def list_project_items(session: requests.Session, since: Optional[str]) -> Tuple[List[str], Optional[str]]:
+    """プロジェクトのアイテムをカーソルで全件走査し、since以降に更新されたIssueのIDを返す
+
+    走査では更新日時だけを取得する（軽量）。sinceがNoneなら全Issueを返す。
+    戻り値の2つ目は走査を始めた時点のサーバー時刻で、次回のsinceになる。
+    """
+    issue_ids = []
+    started_at = None
+    cursor = None
+    while True:
+        data, server_time = github_graphql(session, PROJECT_ITEMS_QUERY, {
+            'org': ORGANIZATION,
+            'number': PROJECT_NUMBER,
+            'cursor': cursor
+        })
+        started_at = started_at or server_time
+        
+        items = data['organization']['projectV2']['items']
+        for node in items['nodes']:
+            issue = node['content'] or {}
+            if 'id' not in issue:
+                # Issue以外（Pull Request、ドラフトなど）は同期しない
+                continue
+            updated_at = max(node['updatedAt'], issue['updatedAt'])
+            # 同じ秒の更新を取りこぼさないよう、境界のアイテムも含める
+            if since is None or updated_at >= since:
+                issue_ids.append(issue['id'])
+        
+        if not items['pageInfo']['hasNextPage']:
+            return issue_ids, started_at
+        cursor = items['pageInfo']['endCursor']
+
+def get_issue_labels(session: requests.Session, issue: Dict[str, Any]) -> List[str]:
+    """Issueのラベルを全件取得（1ページに収まらない場合は続きを取得）"""
+    labels = issue['labels']
+    names = [label['name'] for label in labels['nodes']]
+    while labels['pageInfo']['hasNextPage']:
+        data, _ = github_graphql(session, ISSUE_LABELS_QUERY, {
+            'id': issue['id'],
+            'cursor': labels['pageInfo']['endCursor']
+        })
+        labels = data['node']['labels']
+        names.extend(label['name'] for label in labels['nodes'])
+    return names
+
+def get_github_issues(since: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """GitHubのプロジェクトからIssueを取得
+
+    since（前回の同期時刻）以降に更新されたIssueだけを、IDで
+    まとめて詳細取得する。戻り値は(Issueの一覧, 次回のsince)。
+    """
+    session = shared_metrics().instrument_session(requests.Session(), 'github')
+    issue_ids, started_at = list_project_items(session, since)
     
-    for node in data['data']['organization']['projectV2']['items']['nodes']:
-        if node['content']:
-            issue = node['content']
+    issues = []
+    for start in range(0, len(issue_ids), GITHUB_PAGE_SIZE):
+        data, _ = github_graphql(session, ISSUE_DETAILS_QUERY, {
+            'ids': issue_ids[start:start + GITHUB_PAGE_SIZE]
+        })
+        for issue in data['nodes']:
+            if not issue:
+                continue
             issues.append({
                 'number': issue['number'],
                 'title': issue['title'],
                 'state': issue['state'],
-                'labels': [label['name'] for label in issue['labels']['nodes']]
+                'labels': get_issue_labels(session, issue)
             })
     
-    return issues
+    return issues, started_at
+
+def load_sync_state() -> Dict[str, Any]:
+    """前回の同期状態（プロジェクトごとの同期時刻）を読み込む"""
+    try:
+        with open(GITHUB_SYNC_STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
 
-def get_existing_page(notion_client: requests.Session, title: str) -> str:
+def save_sync_state(state: Dict[str, Any]) -> None:
+    """同期状態を保存（一時ファイルに書いてから置き換える）"""
+    tmp_path = f'{GITHUB_SYNC_STATE_FILE}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, GITHUB_SYNC_STATE_FILE)
+
+def get_existing_page(notion_client: requests.Session, title: str) -> Optional[Dict[str, Any]]:
     """Notionデータベースから既存のページを検索"""
     query = {
         'filter': {
@@ -94,8 +280,9 @@ def get_existing_page(notion_client: requests.Session, title: str) -> str:
         }
     }
     
-    response = notion_client.post(
-        f'https://api.notion.com/v1/databases/{NOTION_DATABASE_ID}/query',
+    response = notion_limiter().call(
+        notion_client.post,
+        f'{NOTION_API_URL}/databases/{NOTION_DATABASE_ID}/query',
         json=query,
         headers=NOTION_HEADERS
     )
@@ -104,15 +291,81 @@ def get_existing_page(notion_client: requests.Session, title: str) -> str:
         raise Exception(f'Notion API error: {response.text}')
     
     results = response.json()['results']
-    return results[0]['id'] if results else None
+    return results[0] if results else None
+
+def get_issue_url(number: int) -> str:
+    """IssueのURL（Notionのページとの対応付けに使う）"""
+    return f'https://github.com/{ORGANIZATION}/{REPO}/issues/{number}'
+
+def build_page_index(notion_client: requests.Session) -> Dict[str, Dict[str, Any]]:
+    """データベースの全ページを一度だけ走査し、IssueのURL -> ページの索引を作る
+
+    同じURLのページが複数ある場合は最も古いページを使う。
+    """
+    index = {}
+    body = {
+        'page_size': 100,
+        'sorts': [{'timestamp': 'created_time', 'direction': 'ascending'}]
+    }
+    while True:
+        response = notion_limiter().call(
+            notion_client.post,
+            f'{NOTION_API_URL}/databases/{NOTION_DATABASE_ID}/query',
+            json=body,
+            headers=NOTION_HEADERS
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f'Notion API error: {response.text}')
+        
+        data = response.json()
+        for page in data['results']:
+            url = (page['properties'].get('URL') or {}).get('url')
+            if url:
+                index.setdefault(url.rstrip('/'), page)
+        
+        if not data.get('has_more'):
+            return index
+        body['start_cursor'] = data['next_cursor']
+
+def property_values(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """同期するプロパティを比較用の値に変換
 
-def sync_issue_to_notion(notion_client: requests.Session, issue: Dict[str, Any]) -> None:
-    """IssueをNotionに同期"""
+    作成・更新時の形式（text.content）と取得時の形式（plain_text）の
+    違いを吸収する。ラベルの順序は区別しない。
+    """
+    def text(items: List[Dict[str, Any]]) -> str:
+        return ''.join(
+            (item.get('text') or {}).get('content', item.get('plain_text', ''))
+            for item in items
+        )
+    
+    status = (properties.get('Status') or {}).get('status') or {}
+    return {
+        'Name': text((properties.get('Name') or {}).get('title', [])),
+        'Status': status.get('name'),
+        'Labels': sorted(
+            option['name'] for option in (properties.get('Labels') or {}).get('multi_select', [])
+        ),
+        'URL': (properties.get('URL') or {}).get('url'),
+    }
+
+def sync_issue_to_notion(
+    notion_client: requests.Session,
+    issue: Dict[str, Any],
+    page_index: Optional[Dict[str, Dict[str, Any]]] = None
+) -> str:
+    """IssueをNotionに同期し、結果（created / updated / skipped）を返す
+
+    page_indexを渡した場合は索引で既存ページを判定し、作成したページを
+    索引に追加する。渡さない場合はタイトルで都度検索する。
+    既存ページのプロパティが変わらない場合は更新しない。
+    """
     number = issue['number']
     title = issue['title']
     state = issue['state']
     labels = issue['labels']
-    issue_url = f'https://github.com/{ORGANIZATION}/{REPO}/issues/{number}'
+    issue_url = get_issue_url(number)
     
     properties = {
         'Name': {
@@ -139,20 +392,29 @@ def sync_issue_to_notion(notion_client: requests.Session, issue: Dict[str, Any])
         }
     }
     
-    existing_page_id = get_existing_page(notion_client, title)
+    if page_index is not None:
+        existing_page = page_index.get(issue_url)
+    else:
+        existing_page = get_existing_page(notion_client, title)
+    
+    if existing_page and property_values(existing_page['properties']) == property_values(properties):
+        return 'skipped'
     
-    if existing_page_id:
+    if existing_page:
         # 既存ページの更新
-        response = notion_client.patch(
-            f'https://api.notion.com/v1/pages/{existing_page_id}',
+        response = notion_limiter().call(
+            notion_client.patch,
+            f'{NOTION_API_URL}/pages/{existing_page["id"]}',
             json={'properties': properties},
             headers=NOTION_HEADERS
         )
         print(f'更新: Issue #{number}')
     else:
         # 新規ページの作成
-        response = notion_client.post(
-            'https://api.notion.com/v1/pages',
+        response = notion_limiter().call(
+            notion_client.post,
+            f'{NOTION_API_URL}/pages',
+            idempotent=False,
             json={
                 'parent': {'database_id': NOTION_DATABASE_ID},
                 'properties': properties
@@ -163,26 +425,107 @@ def sync_issue_to_notion(notion_client: requests.Session, issue: Dict[str, Any])
     
     if response.status_code != 200:
         raise Exception(f'Notion API error: {response.text}')
+    
+    if page_index is not None:
+        page_index[issue_url] = response.json()
+    return 'updated' if existing_page else 'created'
+
+def sync_issues_concurrently(
+    issues: List[Dict[str, Any]],
+    page_index: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Dict[str, int]:
+    """Issueを並行して同期し、結果ごとの件数を返す
+
+    ワーカー数はNOTION_CONCURRENCYで制限し、Notion APIの呼び出し頻度は
+    共通のレート制限に従う。1件の失敗で他のIssueの同期は止めない。
+    """
+    # 同じIssueを並行して作成しないよう、番号で重複を除く
+    unique_issues = list({issue['number']: issue for issue in issues}.values())
+    counts = {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+    
+    def sync_issue(issue: Dict[str, Any]) -> str:
+        with shared_metrics().phase('notion.issue'):
+            return sync_issue_to_notion(notion_session(), issue, page_index)
+    
+    with ThreadPoolExecutor(max_workers=NOTION_CONCURRENCY) as executor:
+        futures = {executor.submit(sync_issue, issue): issue for issue in unique_issues}
+        for future in as_completed(futures):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                print(f'失敗: Issue #{futures[future]["number"]}: {e}')
+    
+    return counts
+
+def write_metrics(counts: Optional[Dict[str, int]]) -> None:
+    """計測値をSYNC_METRICS_FILEに書き出す（未設定なら何もしない）"""
+    if not SYNC_METRICS_FILE:
+        return
+    metrics = shared_metrics()
+    metrics.set_value('github_graphql_cost', GITHUB_RATE_LIMIT['cost'])
+    for name, value in (counts or {}).items():
+        metrics.set_value(f'issues_{name}', value)
+    try:
+        metrics.write(SYNC_METRICS_FILE)
+    except OSError as e:
+        print(f'計測値の書き出しに失敗しました: {e}')
 
 def main():
     """メイン処理"""
     if not all([GITHUB_TOKEN, NOTION_TOKEN, NOTION_DATABASE_ID]):
         raise ValueError('必要な環境変数が設定されていません')
     
+    metrics = shared_metrics()
+    metrics.track_rate_limiter('notion', notion_limiter())
+    counts = None
     try:
-        # GitHubからIssueを取得
-        issues = get_github_issues()
+        # GitHubから前回の同期以降に更新されたIssueを取得
+        sync_state = load_sync_state()
+        project_key = f'{ORGANIZATION}/{PROJECT_NUMBER}'
+        since = sync_state.get(project_key)
+        with metrics.phase('github.fetch'):
+            issues, synced_at = get_github_issues(since)
+        print(f'更新されたIssue: {len(issues)} 件（前回の同期: {since or "なし"}）')
         
         # Notionクライアントの作成
-        notion_client = requests.Session()
+        notion_client = notion_session()
         
-        # 各Issueを同期
-        for issue in issues:
-            sync_issue_to_notion(notion_client, issue)
+        # 既存ページの索引を作成（1回の走査で作成・更新を判定する）
+        page_index = None
+        if NOTION_LOOKUP == 'index' and issues:
+            with metrics.phase('notion.index'):
+                page_index = build_page_index(notion_client)
+            print(f'既存ページ: {len(page_index)} 件')
+        
+        # 各Issueを並行して同期
+        started = time.perf_counter()
+        with metrics.phase('notion.sync'):
+            counts = sync_issues_concurrently(issues, page_index)
+        print(
+            f'作成 {counts["created"]} / 更新 {counts["updated"]} / '
+            f'変更なし {counts["skipped"]} / 失敗 {counts["failed"]} '
+            f'({time.perf_counter() - started:.1f}秒)'
+        )
+        
+        # 全件の同期に成功した場合だけ同期時刻を進める
+        if counts['failed']:
+            raise Exception(f'{counts["failed"]} 件のIssueの同期に失敗しました')
+        if synced_at:
+            sync_state[project_key] = synced_at
+            save_sync_state(sync_state)
             
     except Exception as e:
         print(f'エラー: {str(e)}')
         exit(1)
+    finally:
+        print(
+            f'GitHub API: {GITHUB_RATE_LIMIT["requests"]} リクエスト / '
+            f'コスト {GITHUB_RATE_LIMIT["cost"]} / 残り {GITHUB_RATE_LIMIT["remaining"]}'
+        )
+        print(f'Notion API: {notion_limiter().stats.summary()}')
+        print(metrics.summary())
+        write_metrics(counts)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""Tests of the browser importer's journal and scheduling"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('playwright.async_api')
+
+from playwright.async_api import async_playwright, Error as PlaywrightError  # noqa: E402
+
+import confluence_to_notion  # noqa: E402
+from confluence_to_notion import ImportJournal, import_worker, login_to_notion, run_imports  # noqa: E402
+from fixture_servers import FakeNotionWebServer  # noqa: E402
+
+CONFLUENCE_URL = 'https://confluence.example.com'
+
+
+class StubPage:
+    """Records navigation instead of driving a browser"""
+
+    def __init__(self):
+        self.url = 'about:blank'
+        self.visited = []
+
+    async def goto(self, url):
+        self.url = url
+        self.visited.append(url)
+
+    async def close(self):
+        pass
+
+
+class StubContext:
+    def __init__(self):
+        self.page = StubPage()
+
+    async def new_page(self):
+        return self.page
+
+
+def run_worker(journal, context, space_keys, monkeypatch, outcome='done'):
+    started = []
+
+    async def start(page, confluence_url, space_key, notion_url):
+        started.append(space_key)
+        page.url = f"https://notion.example.com/import/{space_key}-{len(started)}"
+
+    async def wait(page, timeout, poll_interval, on_poll=None):
+        return outcome
+
+    monkeypatch.setattr(confluence_to_notion, 'start_confluence_import', start)
+    monkeypatch.setattr(confluence_to_notion, 'wait_for_import_result', wait)
+
+    async def run():
+        queue = asyncio.Queue()
+        for space_key in space_keys:
+            queue.put_nowait(space_key)
+        results = []
+        await import_worker(1, context, queue, results, journal, CONFLUENCE_URL,
+                            'https://notion.example.com', 0, 10, 1)
+        return results
+
+    return started, asyncio.run(run())
+
+
+def test_journal_get_returns_a_copy(tmp_path):
+    journal = ImportJournal(str(tmp_path / 'journal.json'), CONFLUENCE_URL)
+    journal.update('A', state='failed')
+    entry = journal.get('A')
+    journal.update('A', state='running')
+    assert entry['state'] == 'failed'
+
+
+@pytest.mark.parametrize('prior_state, rechecked', [
+    ('failed', False),
+    ('pending', False),
+    ('running', True),
+])
+def test_worker_reimports_unless_left_running(tmp_path, monkeypatch, prior_state, rechecked):
+    path = str(tmp_path / 'journal.json')
+    journal = ImportJournal(path, CONFLUENCE_URL)
+    old_url = 'https://notion.example.com/import/old'
+    journal.update('A', state=prior_state, attempts=1, url=old_url)
+
+    context = StubContext()
+    started, results = run_worker(journal, context, ['A'], monkeypatch)
+
+    assert started == ([] if rechecked else ['A'])
+    assert context.page.visited == ([old_url] if rechecked else [])
+    entry = ImportJournal(path, CONFLUENCE_URL).get('A')
+    assert entry['state'] == 'done'
+    assert entry['attempts'] == 2
+    assert (entry['url'] == old_url) == rechecked
+    assert [result['state'] for result in results] == ['done']
+
+
+def run_against_stand_in(server, journal, space_keys, parallel):
+    """Log into the stand-in once and import the spaces with `parallel` contexts"""
+    async def run():
+        async with async_playwright() as p:
+            try:
+                browser = await p.chromium.launch()
+            except PlaywrightError as e:
+                pytest.skip(f"chromium is not available: {e}")
+            try:
+                context = await browser.new_context()
+                page = await context.new_page()
+                await login_to_notion(page, 'fixture@example.com', 'fixture', server.url)
+                storage_state = await context.storage_state()
+                await context.close()
+                return await run_imports(browser, space_keys, storage_state, CONFLUENCE_URL,
+                                         server.url, journal, parallel=parallel,
+                                         timeout=30, poll_interval=1)
+            finally:
+                await browser.close()
+
+    return asyncio.run(run())
+
+
+def test_parallel_imports_against_stand_in(tmp_path):
+    path = str(tmp_path / 'journal.json')
+    space_keys = ['ALPHA', 'BETA', 'BROKEN', 'GAMMA']
+    with FakeNotionWebServer(import_seconds=0.5, failing_spaces={'BROKEN'}) as server:
+        results = run_against_stand_in(server, ImportJournal(path, CONFLUENCE_URL), space_keys, 2)
+        assert [result['space_key'] for result in results] == space_keys
+        assert {result['worker'] for result in results} == {1, 2}
+        journal = ImportJournal(path, CONFLUENCE_URL)
+        assert {key: (journal.get(key)['state'], journal.get(key)['attempts']) for key in space_keys} == {
+            'ALPHA': ('done', 1),
+            'BETA': ('done', 1),
+            'BROKEN': ('failed', 1),
+            'GAMMA': ('done', 1),
+        }
+        failed_url = journal.get('BROKEN')['url']
+
+        # A rerun skips finished spaces and starts a new import of the failed one
+        server.failing_spaces.clear()
+        results = run_against_stand_in(server, ImportJournal(path, CONFLUENCE_URL), space_keys, 2)
+        assert [(result['space_key'], result['state']) for result in results] == [('BROKEN', 'done')]
+        entry = ImportJournal(path, CONFLUENCE_URL).get('BROKEN')
+        assert (entry['state'], entry['attempts']) == ('done', 2)
+        assert entry['url'] != failed_url